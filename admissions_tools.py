@@ -0,0 +1,202 @@
+'''
+### PURPOSE: ####
+Local admissions store: a SQLite file holding every residential/PHP episode from the Avatar "Admissions in Date
+Range" reports loaded so far. Once history lives in the store, a weekly report only has to cover recent admissions.
+Loading the same report file twice is skipped entirely, because reports are recognised by a hash of their contents.
+
+Each report is cleaned with clean_avatar_report and upserted on (pid, epn). Episodes that are new or whose name,
+dates or program changed are written; unchanged episodes are left alone. Open episodes are stored with no discharge
+date and stay open until a report discharges them. A stored discharge date is never cleared by a report showing the
+episode open, since that report predates the discharge. Otherwise the most recently loaded report wins, so
+refresh_all loads a set of reports oldest first (by report_date).
+
+#### TABLES: ####
+    episodes: pid, epn, name, name_key (normalize_name of name), adm_date, disc_date (NULL while open), program,
+              updated_at. Indexed on (name_key, adm_date), pid, adm_date and disc_date.
+    reports:  digest, path, episodes, changed, loaded_at. One row per report file loaded.
+
+#### USAGE: ####
+    store = AdmissionsStore('data_files/admissions.sqlite')
+    store.refresh('batch_42.xls')
+    store.refresh_all(['batch_41.xls', 'batch_40.xls'])      # loaded oldest first
+    avatar_df = store.frame(discharged_since='2024-01-01')    # same layout as clean_avatar_report
+'''
+import os
+import sqlite3
+from datetime import datetime
+import pandas as pd
+
+import measure_tools
+from cache_tools import file_digest
+from match_tools import normalize_name
+from metrics_tools import stage
+
+DEFAULT_ADMISSIONS_DB = os.environ.get(
+    'OUTCOME_MEASURES_ADMISSIONS', os.path.join(os.path.expanduser('~'), '.outcome_measures_admissions.sqlite'))
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS episodes (
+    pid TEXT NOT NULL,
+    epn TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    adm_date TEXT,
+    disc_date TEXT,
+    program TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (pid, epn)
+);
+CREATE INDEX IF NOT EXISTS episodes_name_adm ON episodes (name_key, adm_date);
+CREATE INDEX IF NOT EXISTS episodes_pid ON episodes (pid);
+CREATE INDEX IF NOT EXISTS episodes_adm ON episodes (adm_date);
+CREATE INDEX IF NOT EXISTS episodes_disc ON episodes (disc_date);
+CREATE TABLE IF NOT EXISTS reports (
+    digest TEXT PRIMARY KEY,
+    path TEXT,
+    episodes INTEGER,
+    changed INTEGER,
+    loaded_at TEXT
+);
+'''
+
+# Only rows that differ are rewritten, so total_changes counts new and changed episodes
+_UPSERT = '''
+INSERT INTO episodes (pid, epn, name, name_key, adm_date, disc_date, program, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (pid, epn) DO UPDATE SET
+    name = excluded.name, name_key = excluded.name_key, adm_date = excluded.adm_date,
+    disc_date = COALESCE(excluded.disc_date, episodes.disc_date), program = excluded.program,
+    updated_at = excluded.updated_at
+WHERE episodes.name IS NOT excluded.name OR episodes.adm_date IS NOT excluded.adm_date
+    OR episodes.disc_date IS NOT COALESCE(excluded.disc_date, episodes.disc_date)
+    OR episodes.program IS NOT excluded.program
+'''
+
+_EPISODE_COLUMNS = ['name', 'pid', 'adm_date', 'disc_date', 'epn', 'program']
+
+def _iso_dates(series):
+    # ISO dates sort correctly as text, so the date indexes work for range queries
+    return [None if pd.isna(value) else value for value in pd.to_datetime(series).dt.strftime('%Y-%m-%d')]
+
+def report_date(avatar_df):
+    '''
+    Latest admission or discharge date in a cleaned Avatar report: the most recent activity it covers, used to put
+    reports in order.
+    '''
+    dates = pd.concat([pd.to_datetime(avatar_df['adm_date']), pd.to_datetime(avatar_df['disc_date'])])
+    return dates.max()
+
+def _text(series):
+    return [None if pd.isna(value) else str(value) for value in series]
+
+class AdmissionsStore:
+    def __init__(self, path=None, timeout=30):
+        self.path = path or DEFAULT_ADMISSIONS_DB
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Worker processes loading reports at the same time wait on SQLite's lock rather than failing
+        self.connection = sqlite3.connect(self.path, timeout=timeout)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def upsert(self, avatar_df):
+        '''
+        Writes the episodes of a cleaned Avatar report (the output of clean_avatar_report) and returns how many were
+        new or changed.
+        '''
+        with stage('admissions_upsert', rows_in=len(avatar_df)) as record:
+            updated_at = datetime.now().isoformat(timespec='seconds')
+            rows = zip(_text(avatar_df['pid']), _text(avatar_df['epn']), _text(avatar_df['name']),
+                       [normalize_name(name) for name in avatar_df['name']], _iso_dates(avatar_df['adm_date']),
+                       _iso_dates(avatar_df['disc_date']), _text(avatar_df['program']), [updated_at] * len(avatar_df))
+            with self.connection:
+                before = self.connection.total_changes
+                self.connection.executemany(_UPSERT, rows)
+                changed = self.connection.total_changes - before
+            record.rows_out = changed
+        return changed
+
+    def loaded(self, avatar_report_path):
+        '''
+        Returns True if a file with the same contents as `avatar_report_path` was loaded before.
+        '''
+        digest = file_digest(avatar_report_path)
+        return self.connection.execute('SELECT 1 FROM reports WHERE digest = ?', (digest,)).fetchone() is not None
+
+    def refresh(self, avatar_report_path, avatar_df=None):
+        '''
+        Loads an Avatar report into the store unless a file with the same contents was loaded before. Returns the
+        number of new or changed episodes (0 for a report already loaded). `avatar_df` is the report already cleaned,
+        if it has been.
+        '''
+        if self.loaded(avatar_report_path):
+            return 0
+
+        if avatar_df is None:
+            avatar_df = measure_tools.clean_avatar_report(avatar_report_path)
+        changed = self.upsert(avatar_df)
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?)',
+                (file_digest(avatar_report_path), os.path.abspath(avatar_report_path), len(avatar_df), changed,
+                 datetime.now().isoformat(timespec='seconds')))
+        return changed
+
+    def refresh_all(self, avatar_report_paths, errors=None):
+        '''
+        Loads every report not loaded before, one at a time and oldest first by report_date, so later reports win
+        whatever order the paths are given in. Returns {path: new or changed episodes}. A report that cannot be
+        read raises, unless `errors` is a dict: it then collects {path: exception} and the rest are still loaded.
+        '''
+        changed, pending = {}, []
+        for path in dict.fromkeys(avatar_report_paths):
+            changed[path] = 0
+            try:
+                if self.loaded(path):
+                    continue
+                avatar_df = measure_tools.clean_avatar_report(path)
+            except Exception as error:
+                if errors is None:
+                    raise
+                errors[path] = error
+                continue
+            latest = report_date(avatar_df)
+            pending.append((pd.Timestamp.min if pd.isna(latest) else latest, path, avatar_df))
+
+        for _, path, avatar_df in sorted(pending, key=lambda report: report[0]):
+            changed[path] = self.refresh(path, avatar_df)
+        return changed
+
+    def frame(self, discharged_since=None):
+        '''
+        Returns the stored episodes in the clean_avatar_report layout, newest admission first. With
+        `discharged_since`, only episodes still open or discharged on or after that date are returned, which is all
+        a batch of assessments dated from then on can match.
+        '''
+        query = f'SELECT {", ".join(_EPISODE_COLUMNS)} FROM episodes'
+        parameters = ()
+        if discharged_since is not None and not pd.isna(discharged_since):
+            query += ' WHERE disc_date IS NULL OR disc_date >= ?'
+            parameters = (pd.Timestamp(discharged_since).strftime('%Y-%m-%d'),)
+        query += ' ORDER BY adm_date DESC'
+
+        with stage('admissions_frame') as record:
+            dataframe = pd.read_sql_query(query, self.connection, params=parameters)
+            dataframe['adm_date'] = pd.to_datetime(dataframe['adm_date'])
+            dataframe['disc_date'] = pd.to_datetime(dataframe['disc_date'])
+            dataframe['name'] = dataframe['name'].astype('category')
+            dataframe['pid'] = measure_tools.compact_ids(dataframe['pid'], 'UInt32')
+            dataframe['epn'] = measure_tools.compact_ids(dataframe['epn'], 'UInt16')
+            dataframe['program'] = dataframe['program'].astype('category')
+            record.rows_out = len(dataframe)
+        return dataframe
@@ -0,0 +1,130 @@
+'''
+### PURPOSE: ####
+Times and memory-profiles the main pipeline stages on synthetic data (see synthetic_data.py) across a range of
+input sizes, and compares the results with a stored baseline so regressions show up.
+
+#### STAGES: ####
+    - clean_data: reading and cleaning the Survey Monkey export
+    - clean_avatar_report: reading and cleaning the Avatar admissions report
+    - generate_scores: scoring every subscale
+    - match: the name/date match in import_prep (exact episode match plus fuzzy resolution)
+    - xml_batch: writing the DERS Avatar import batch with xml_tools
+
+Each stage is timed as the best of --repeat runs; peak memory is the tracemalloc peak of one separate run.
+
+#### USAGE: ####
+    python benchmark.py --sizes 1k,10k,100k                     # run and compare with benchmark_baseline.json
+    python benchmark.py --sizes 1k,10k,100k --save-baseline     # run and store the results as the new baseline
+Exits with status 1 if any stage is slower than the baseline by more than --tolerance.
+'''
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import measure_tools
+import import_prep
+import xml_tools
+import synthetic_data
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+def _positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+def _measure(function, repeat):
+    if repeat < 1:
+        raise ValueError(f"repeat must be at least 1, not {repeat}")
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'seconds': round(best, 4), 'peak_mb': round(peak / 1024 ** 2, 2)}
+
+def run_size(n_rows, repeat=3, directory=None):
+    '''
+    Generates a dataset of `n_rows` assessments and benchmarks every stage on it. Returns {stage: measurement}.
+    '''
+    with tempfile.TemporaryDirectory(prefix='outcome_measures_bench_', dir=directory) as workspace:
+        export_path, report_path = synthetic_data.write_dataset(workspace, n_rows, seed=n_rows)
+        results = {}
+
+        cleaned, results['clean_data'] = _measure(lambda: measure_tools.clean_data(export_path), repeat)
+        avatar_df, results['clean_avatar_report'] = _measure(
+            lambda: measure_tools.clean_avatar_report(report_path), repeat)
+        _, results['generate_scores'] = _measure(lambda: measure_tools.generate_scores(cleaned), repeat)
+        matched, results['match'] = _measure(lambda: import_prep.prepare_import(cleaned, avatar_df), repeat)
+
+        xml_path = os.path.join(workspace, 'ders.xml')
+        _, results['xml_batch'] = _measure(lambda: xml_tools.write_batch(matched, 'ders', xml_path), repeat)
+
+    return results
+
+def compare(results, baseline, tolerance):
+    '''
+    Returns a list of (size, stage, baseline seconds, current seconds) for every stage slower than baseline by more
+    than `tolerance` (a fraction).
+    '''
+    regressions = []
+    for size, stages in results.items():
+        for stage, measurement in stages.items():
+            reference = baseline.get('results', {}).get(size, {}).get(stage)
+            if reference and measurement['seconds'] > reference['seconds'] * (1 + tolerance):
+                regressions.append((size, stage, reference['seconds'], measurement['seconds']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Outcome Measures pipeline on synthetic data.")
+    parser.add_argument('--sizes', default='1k,10k,100k', help="Comma-separated row counts, e.g. 1k,10k,1M,10M")
+    parser.add_argument('--repeat', type=_positive_int, default=3, help="Timed runs per stage; the best is kept (at least 1)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before flagging (0.25 = 25%%)")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes.split(','):
+        n_rows = synthetic_data.parse_size(size)
+        results[str(n_rows)] = run_size(n_rows, repeat=args.repeat)
+        for stage, measurement in results[str(n_rows)].items():
+            print(f"{n_rows:>10} rows  {stage:<20} {measurement['seconds']:>9.4f} s  {measurement['peak_mb']:>9.2f} MB")
+
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.tolerance)
+    for size, stage, before, after in regressions:
+        print(f"REGRESSION: {stage} at {size} rows went from {before:.4f} s to {after:.4f} s")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+'''
+### PURPOSE: ####
+On-disk cache for cleaned Survey Monkey exports and Avatar "Admissions in Date Range" reports. Parsing XLSX/XLS
+files is by far the slowest part of cleaning, and the same batch file is often reprocessed several times while
+names are being corrected. Cached frames are keyed by:
+    - a hash of the source file's CONTENTS (so renaming or re-downloading an identical file still hits), and
+    - a hash of the cleaning schema (column mappings plus the source of the cleaning function), so any change to
+      how a file is cleaned invalidates the entries made under the old rules automatically.
+
+#### STORAGE FORMAT: ####
+Each entry is a directory holding one .npy file per column plus a small JSON manifest describing column order and
+dtypes. Numeric and datetime columns are memory-mapped on load, so a repeat load is close to a zero-copy read.
+Entries are evicted oldest-access-first once the cache exceeds its size limit, and unconditionally once they have
+not been read for longer than the age limit.
+'''
+import os
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import tempfile
+import numpy as np
+import pandas as pd
+
+import measure_tools
+from metrics_tools import stage
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'OUTCOME_MEASURES_CACHE', os.path.join(os.path.expanduser('~'), '.outcome_measures_cache'))
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_MAX_AGE_DAYS = 30
+
+MANIFEST = 'manifest.json'
+
+def file_digest(path, block_size=1024 * 1024):
+    '''
+    Returns a hex digest of the file's contents, read in fixed-size blocks.
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def schema_digest(*parts):
+    '''
+    Hashes everything that determines the shape of a cleaned frame: column lists, option values and the source
+    code of the cleaning functions themselves.
+    '''
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        if callable(part):
+            part = inspect.getsource(part)
+        digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+class FrameCache:
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.directory = directory or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, source_path, schema):
+        return f'{file_digest(source_path)}-{schema}'
+
+    def load(self, key):
+        '''
+        Returns the cached DataFrame for `key`, or None on a miss.
+        '''
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, MANIFEST)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        # Another worker may evict the entry after its manifest was read; that is a miss too, and the frame is rebuilt
+        try:
+            columns = {}
+            for position, column in enumerate(manifest['columns']):
+                columns[column['name']] = _load_column(entry, position, column)
+            index = _load_column(entry, 'index', manifest['index'])
+            os.utime(entry)  # Recording the access for eviction
+        except OSError:
+            return None
+        return pd.DataFrame(columns, index=pd.Index(index, name=manifest['index']['name']), copy=False)
+
+    def store(self, key, dataframe):
+        '''
+        Writes `dataframe` under `key` atomically, then evicts old entries. If the entry already exists (e.g. another
+        worker cached the same file meanwhile) it is left as it is.
+        '''
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=self.directory)
+        try:
+            manifest = {
+                'columns': [_save_column(staging, position, name, dataframe[name])
+                            for position, name in enumerate(dataframe.columns)],
+                'index': _save_column(staging, 'index', dataframe.index.name, dataframe.index.to_series()),
+            }
+            with open(os.path.join(staging, MANIFEST), 'w') as manifest_file:
+                json.dump(manifest, manifest_file)
+            entry = os.path.join(self.directory, key)
+            try:
+                os.replace(staging, entry)
+            except OSError:
+                # Another process stored the same key first (the entry is a non-empty directory). Entries under one
+                # key hold the same frame, so theirs is kept
+                if not os.path.exists(os.path.join(entry, MANIFEST)):
+                    raise
+                shutil.rmtree(staging, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes entries not read within max_age_days, then the least recently read entries until the cache fits
+        within max_bytes.
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+
+        cutoff = time.time() - self.max_age_days * 86400
+        total = sum(size for _, size, _ in entries)
+        for accessed, size, path in sorted(entries):
+            if accessed >= cutoff and total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+
+def _save_column(directory, position, name, series):
+    column = {'name': name, 'dtype': str(series.dtype)}
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Codes go in the usual file, the categories alongside them
+        np.save(os.path.join(directory, f'{position}.npy'), series.cat.codes.to_numpy())
+        np.save(os.path.join(directory, f'{position}.categories.npy'), series.cat.categories.to_numpy(), allow_pickle=True)
+        column['kind'] = 'categorical'
+        column['ordered'] = bool(series.cat.ordered)
+    elif isinstance(series.dtype, pd.core.dtypes.dtypes.BaseMaskedDtype):
+        # Nullable integers: the values and the missing-value mask are stored separately
+        values = series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0)
+        np.save(os.path.join(directory, f'{position}.npy'), values)
+        np.save(os.path.join(directory, f'{position}.mask.npy'), series.isna().to_numpy())
+        column['kind'] = 'masked'
+    else:
+        values = series.to_numpy()
+        if values.dtype == object:
+            np.save(os.path.join(directory, f'{position}.npy'), values, allow_pickle=True)
+            column['kind'] = 'object'
+        else:
+            np.save(os.path.join(directory, f'{position}.npy'), values)
+            column['kind'] = 'array'
+    return column
+
+def _load_column(directory, position, column):
+    path = os.path.join(directory, f'{position}.npy')
+    if column['kind'] == 'object':
+        return np.load(path, allow_pickle=True)
+    if column['kind'] == 'categorical':
+        categories = np.load(os.path.join(directory, f'{position}.categories.npy'), allow_pickle=True)
+        return pd.Categorical.from_codes(np.load(path), categories, ordered=column['ordered'])
+    if column['kind'] == 'masked':
+        array_type = pd.api.types.pandas_dtype(column['dtype']).construct_array_type()
+        return array_type(np.load(path, mmap_mode='c'), np.load(os.path.join(directory, f'{position}.mask.npy')))
+    return np.load(path, mmap_mode='c')  # Copy-on-write: callers may modify the frame without touching the cache
+
+_default_cache = None
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FrameCache()
+    return _default_cache
+
+def clean_data_schema(dropna=True):
+    '''
+    Schema digest for cleaned exports: every function and constant clean_data's output depends on.
+    '''
+    return schema_digest(
+        'clean_data', measure_tools.DROPPED_COLUMNS, measure_tools.EXPORT_COLUMNS, dropna, measure_tools.ITEM_DTYPE,
+        measure_tools.INVALID_RESPONSE, measure_tools.clean_data, measure_tools.read_export,
+        measure_tools.file_extension, measure_tools.clean_export_frame, measure_tools.compact_items)
+
+def avatar_report_schema():
+    '''
+    Schema digest for cleaned Avatar reports: every function clean_avatar_report's output depends on.
+    '''
+    return schema_digest(
+        'clean_avatar_report', measure_tools.clean_avatar_report, measure_tools.file_extension,
+        measure_tools._clean_avatar_frame, measure_tools.compact_ids)
+
+def cached_clean_data(import_file_location, dropna=True, cache=None):
+    '''
+    Drop-in replacement for measure_tools.clean_data that serves repeat loads of the same file from the cache.
+    '''
+    cache = cache or default_cache()
+    key = cache.key(import_file_location, clean_data_schema(dropna))
+
+    with stage('cache_load:clean_data') as record:
+        dataframe = cache.load(key)
+        record.rows_out = None if dataframe is None else len(dataframe)
+    if dataframe is None:
+        dataframe = measure_tools.clean_data(import_file_location, dropna=dropna)
+        cache.store(key, dataframe)
+    return dataframe
+
+def cached_clean_avatar_report(avatar_report_path, cache=None):
+    '''
+    Drop-in replacement for measure_tools.clean_avatar_report that serves repeat loads of the same report from
+    the cache.
+    '''
+    cache = cache or default_cache()
+    key = cache.key(avatar_report_path, avatar_report_schema())
+
+    with stage('cache_load:clean_avatar_report') as record:
+        dataframe = cache.load(key)
+        record.rows_out = None if dataframe is None else len(dataframe)
+    if dataframe is None:
+        dataframe = measure_tools.clean_avatar_report(avatar_report_path)
+        cache.store(key, dataframe)
+    return dataframe
@@ -0,0 +1,175 @@
+'''
+### PURPOSE: ####
+A single command line entry point for the Outcome Measures tools, built for scheduled jobs that run it many times a
+day. Only the standard library's argparse is imported at startup. pandas, numpy and the pipeline modules are imported
+inside the subcommand that needs them, so `--help` and `instruments` return without loading them.
+
+#### SUBCOMMANDS: ####
+    clean        clean a Survey Monkey export into the cleaned-column layout (CSV)
+    score        clean and score an export: every subscale plus the validity bitmask (CSV)
+    match        clean an export and match it to Avatar episodes, as import_prep does (CSV)
+    export-xml   clean, match and write the Avatar XML import batch for each assessment
+    rollup       print cottage/month score summaries from a rollup table (see rollup_tools)
+    instruments  list the instrument specifications (items, range, subscales)
+
+Output goes to stdout unless -o/--output is given. Exports are cleaned through the on-disk frame cache (cache_tools)
+unless --no-cache is given.
+
+#### USAGE: ####
+    python cli.py clean "Outcome Measures.xlsx" -o cleaned.csv
+    python cli.py score "Outcome Measures.xlsx" --flags -o scores.csv
+    python cli.py match "Outcome Measures.xlsx" --avatar-report batch_42.xls -o matched.csv
+    python cli.py export-xml "Outcome Measures.xlsx" --avatar-report batch_42.xls --output-dir xml/
+    python cli.py score export.csv --rollups data_files/rollups.npz --store data_files/score_store -o scores.csv
+    python cli.py rollup data_files/rollups.npz --by cottage --start 2024-01 --end 2024-03
+    python cli.py --metrics run.metrics.json score export.csv -o scores.csv
+'''
+import os
+import sys
+import argparse
+
+XML_ASSESSMENTS = ['ders', 'ari', 'dts', 'camm']  # The assessments with an Avatar XML layout (see xml_tools)
+
+def _cleaned(args):
+    if args.no_cache:
+        from measure_tools import clean_data
+        return clean_data(args.raw_file, dropna=not args.keep_incomplete)
+    from cache_tools import cached_clean_data
+    return cached_clean_data(args.raw_file, dropna=not args.keep_incomplete)
+
+def _matched(args):
+    from import_prep import load_admissions, prepare_import
+    cleaned = _cleaned(args)
+    avatar_df = load_admissions(args.avatar_report, admissions_db=args.admissions_db,
+                                discharged_since=cleaned['assess_date'].min())
+    return prepare_import(cleaned, avatar_df)
+
+def _write_csv(dataframe, output):
+    dataframe.to_csv(output if output != '-' else sys.stdout, index=False)
+
+def clean_command(args):
+    _write_csv(_cleaned(args), args.output)
+
+def score_command(args):
+    import pandas as pd
+    from measure_tools import generate_scores, validity_flags
+    if args.rollups:
+        # Exports are cumulative, so only submissions the score store has not seen are folded into the rollups
+        from rollup_tools import RollupTable
+        from store_tools import ScoreStore, incremental_scores
+        dropna = not args.keep_incomplete
+        scores = incremental_scores(args.raw_file, ScoreStore(args.store, dropna=dropna), dropna=dropna,
+                                    rollups=RollupTable(args.rollups))
+    else:
+        scores = generate_scores(_cleaned(args))
+    if args.flags:
+        scores = pd.concat([scores, validity_flags(scores['validity'])], axis=1)
+    _write_csv(scores, args.output)
+
+def match_command(args):
+    _write_csv(_matched(args), args.output)
+
+def export_xml_command(args):
+    from match_tools import MATCHED, FUZZY_MATCHED
+    from xml_tools import write_batch
+    matched = _matched(args)
+    matched = matched.loc[matched['match_status'].isin([MATCHED, FUZZY_MATCHED])]
+    os.makedirs(args.output_dir, exist_ok=True)
+    for assessment in args.assessments:
+        path = os.path.join(args.output_dir, f'{args.prefix}_{assessment}.xml')
+        written = write_batch(matched, assessment, path, pretty=args.pretty)
+        print(f"{assessment}: {written} records -> {path}")
+
+def rollup_command(args):
+    from rollup_tools import RollupTable
+    if not os.path.exists(args.rollup_file):
+        raise SystemExit(f"No rollup table at {args.rollup_file}")
+    rollups = RollupTable(args.rollup_file)
+    _write_csv(rollups.summary(by=args.by, start=args.start, end=args.end), args.output)
+
+def instruments_command(args):
+    from instrument_specs import INSTRUMENTS
+    for instrument in INSTRUMENTS.values():
+        low, high = instrument.item_range
+        print(f"{instrument.name}: {len(instrument.items)} items ({instrument.items[0]}..{instrument.items[-1]}), "
+              f"range {low}-{high}, max missing {instrument.max_missing:.0%}, "
+              f"{'higher' if instrument.higher_is_better else 'lower'} is better")
+        for subscale in instrument.subscales:
+            print(f"    {subscale.name}: {subscale.method} of {', '.join(subscale.items)}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description="Outcome Measures cleaning, scoring, matching and export.")
+    parser.add_argument('--metrics', help="Write per-stage timing/memory metrics for this run to this JSON file")
+    subcommands = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    def export_command(name, help_text, handler):
+        command = subcommands.add_parser(name, help=help_text, description=help_text)
+        command.add_argument('raw_file', help="Survey Monkey export (CSV or Excel)")
+        command.add_argument('--keep-incomplete', action='store_true',
+                             help="Keep rows missing a name or assessment date, or with no responses")
+        command.add_argument('--no-cache', action='store_true', help="Clean the export without the on-disk frame cache")
+        command.set_defaults(handler=handler)
+        return command
+
+    def with_admissions(command):
+        command.add_argument('--avatar-report', help="Avatar 'Admissions in Date Range' report")
+        command.add_argument('--admissions-db', help="SQLite admissions store to match against (see admissions_tools)")
+        return command
+
+    export_command('clean', "Clean a Survey Monkey export.", clean_command).add_argument(
+        '-o', '--output', default='-', help="Output CSV (default: stdout)")
+    score = export_command('score', "Clean and score a Survey Monkey export.", score_command)
+    score.add_argument('--flags', action='store_true', help="Add one validation flags column per instrument")
+    score.add_argument('--rollups', help="Rollup table (.npz) to fold newly seen submissions into (see rollup_tools); needs --store")
+    score.add_argument('--store', help="Score store directory that tracks the submissions already scored (see store_tools)")
+    score.add_argument('-o', '--output', default='-', help="Output CSV (default: stdout)")
+    with_admissions(export_command('match', "Match a Survey Monkey export to Avatar episodes.", match_command)).add_argument(
+        '-o', '--output', default='-', help="Output CSV (default: stdout)")
+    export_xml = with_admissions(export_command('export-xml', "Write Avatar XML import batches for the matched rows.",
+                                                export_xml_command))
+    export_xml.add_argument('--output-dir', required=True, help="Directory for the XML files")
+    export_xml.add_argument('--prefix', default='batch', help="File name prefix (default: batch)")
+    export_xml.add_argument('--assessments', type=lambda text: text.split(','), default=XML_ASSESSMENTS,
+                            help=f"Comma-separated assessments to export (default: {','.join(XML_ASSESSMENTS)})")
+    export_xml.add_argument('--pretty', action='store_true', help="Indent the XML")
+
+    rollup = subcommands.add_parser('rollup', help="Print score summaries from a rollup table.")
+    rollup.add_argument('rollup_file', help="Rollup table (.npz) written by score --rollups")
+    rollup.add_argument('--by', type=lambda text: [column for column in text.split(',') if column], default=None,
+                        help="Comma-separated columns to group by, e.g. cottage or month (default: all of them, '' for overall)")
+    rollup.add_argument('--start', help="First month to include (YYYY-MM)")
+    rollup.add_argument('--end', help="Last month to include (YYYY-MM)")
+    rollup.add_argument('-o', '--output', default='-', help="Output CSV (default: stdout)")
+    rollup.set_defaults(handler=rollup_command)
+
+    subcommands.add_parser('instruments', help="List the instrument specifications.").set_defaults(handler=instruments_command)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'avatar_report', None) is None and hasattr(args, 'admissions_db') and not args.admissions_db:
+        parser.error("Provide --avatar-report or --admissions-db")
+    if getattr(args, 'rollups', None):
+        if not args.store:
+            parser.error("--rollups needs --store: the score store records which submissions were already counted")
+        if args.no_cache:
+            parser.error("--rollups scores through the score store, so it cannot be combined with --no-cache")
+    if hasattr(args, 'assessments'):
+        unknown = [assessment for assessment in args.assessments if assessment not in XML_ASSESSMENTS]
+        if unknown:
+            parser.error(f"No XML layout for: {', '.join(unknown)} (choose from {', '.join(XML_ASSESSMENTS)})")
+
+    if not args.metrics:
+        args.handler(args)
+        return 0
+    import metrics_tools
+    metrics_tools.enable(args.metrics, run_label=args.command)
+    try:
+        args.handler(args)
+    finally:
+        metrics_tools.disable().write()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+'''
+### PURPOSE: ####
+Versioned, lazily computed score columns over the full assessment history, so a change to one instrument's scoring
+rules (reverse keying, which items a subscale uses, proration) only recomputes the columns that rule feeds, and
+only when they are next read.
+
+The history is kept in columnar form: the identifying columns and, for each instrument, its item responses, split
+into append-only segments. Every derived column (each subscale, plus one "<instrument>_flags" validation column per
+instrument) has a version: a digest of exactly what it depends on.
+    - subscale: the scoring engine's code, its own items and method, its instrument's item_range and max_missing,
+      and which of ITS items are reverse keyed (so reverse keying dts_6 changes dts_appraisal and, through it,
+      dts_overall, but no other DTS subscale)
+    - composite subscale: its method and the versions of the subscales it combines
+    - instrument flags: the engine's code and the instrument's items, range, max_missing and subscales
+Computed columns are cached in each segment under their version. Reading a column serves the cached file when its
+version matches the current specs. Otherwise only that instrument's item responses are read (a fraction of the
+battery) and only the stale columns are computed, through a ScoringEngine built for just those subscales. The new
+version replaces the old one on disk. Unaffected columns are never touched.
+
+Item responses are stored as cleaned (compact_items), so a change to cleaning itself still needs the history
+appended again. A store expects one writer at a time; the manifest is replaced atomically and is the commit point.
+
+#### STORAGE FORMAT: ####
+    <store>/manifest.json                   segments in order, batch ids added, next segment number
+    <store>/segment-<n>/rows.pkl            identifying columns (name, assess_date, cottage, ...)
+    <store>/segment-<n>/meta.json           row count and the item columns in each items file
+    <store>/segment-<n>/items-<instrument>.npy / .mask.npy     responses (uint8) and their missing mask
+    <store>/segment-<n>/<column>-<version>.npy                 a computed column
+
+#### USAGE: ####
+    columns = ScoreColumns('data_files/score_columns')
+    columns.append(clean_data('Outcome Measures.xlsx'), batch_id='2024-03')
+    columns.stale()                        # columns whose current version has not been computed everywhere yet
+    columns['dts_overall']                 # computed on first read, served from the segment files afterwards
+    scores = columns.frame()               # same layout as measure_tools.score_frame over the whole history
+'''
+import os
+import glob
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from measure_tools import INSTRUMENTS, ScoringEngine, VALIDITY_BITS
+from cache_tools import schema_digest
+from metrics_tools import stage
+
+DEFAULT_MAX_SEGMENTS = 32
+
+MANIFEST = 'manifest.json'
+FLAGS_SUFFIX = '_flags'
+
+def column_versions(instruments=None):
+    '''
+    Returns {column: version digest} for every subscale and instrument flags column of `instruments`.
+    '''
+    instruments = instruments or INSTRUMENTS
+    versions = {}
+    for instrument in instruments.values():
+        direct = {scale.name for scale in instrument.subscales if all(item in instrument.items for item in scale.items)}
+        for scale in instrument.subscales:
+            if scale.name in direct:
+                versions[scale.name] = schema_digest(
+                    'subscale', ScoringEngine, scale, instrument.item_range, instrument.max_missing,
+                    sorted(item for item in instrument.reverse_keyed if item in scale.items))
+        for scale in instrument.subscales:
+            if scale.name not in direct:
+                versions[scale.name] = schema_digest('composite', scale, [versions[part] for part in scale.items])
+        versions[instrument.name + FLAGS_SUFFIX] = schema_digest(
+            'flags', ScoringEngine, instrument.items, instrument.item_range, instrument.max_missing, instrument.subscales)
+    return versions
+
+def _save_array(path, values):
+    handle, staging = tempfile.mkstemp(prefix='.staging-', suffix='.npy', dir=os.path.dirname(path))
+    os.close(handle)
+    np.save(staging, values)
+    os.replace(staging, path)
+
+class ScoreColumns:
+    def __init__(self, directory, instruments=None, max_segments=DEFAULT_MAX_SEGMENTS):
+        self.directory = directory
+        self.instruments = instruments or INSTRUMENTS
+        self.max_segments = max_segments
+        self.versions = column_versions(self.instruments)
+        self.score_columns = [scale.name for instrument in self.instruments.values() for scale in instrument.subscales]
+        self.owner = {column: name for name, instrument in self.instruments.items()
+                      for column in [scale.name for scale in instrument.subscales] + [name + FLAGS_SUFFIX]}
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest = self._read_manifest()
+        self.computed = 0  # (segment, column) pairs computed by this object rather than read from the cache
+
+    def _read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as manifest_file:
+                return json.load(manifest_file)
+        return {'segments': [], 'batches': [], 'next': 0}
+
+    def _write_manifest(self, manifest):
+        handle, staging = tempfile.mkstemp(prefix='.manifest-', dir=self.directory)
+        with os.fdopen(handle, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(staging, os.path.join(self.directory, MANIFEST))
+        self.manifest = manifest
+        for name in os.listdir(self.directory):
+            if name.startswith('segment-') and name not in manifest['segments']:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def __len__(self):
+        return sum(self._meta(segment)['rows'] for segment in self.manifest['segments'])
+
+    def _path(self, segment, name):
+        return os.path.join(self.directory, segment, name)
+
+    def _meta(self, segment):
+        with open(self._path(segment, 'meta.json')) as meta_file:
+            return json.load(meta_file)
+
+    def append(self, cleaned, batch_id=None):
+        '''
+        Adds a cleaned frame (clean_data output) as a new segment, unless `batch_id` was added before. No scores
+        are computed until they are read. Returns the segment name, or None if nothing was added.
+        '''
+        if len(cleaned) == 0 or (batch_id is not None and str(batch_id) in self.manifest['batches']):
+            return None
+        with stage('columns_append', rows_in=len(cleaned)):
+            segment = f"segment-{self.manifest['next']:06d}"
+            staging = tempfile.mkdtemp(prefix='.staging-', dir=self.directory)
+            first_item = cleaned.columns.get_loc(next(iter(self.instruments.values())).items[0])
+            cleaned.iloc[:, :first_item].reset_index(drop=True).to_pickle(os.path.join(staging, 'rows.pkl'))
+            items = {}
+            for name, instrument in self.instruments.items():
+                block = cleaned.loc[:, instrument.items]
+                np.save(os.path.join(staging, f'items-{name}.mask.npy'), block.isna().to_numpy())
+                np.save(os.path.join(staging, f'items-{name}.npy'), block.to_numpy(dtype=np.uint8, na_value=0))
+                items[name] = instrument.items
+            with open(os.path.join(staging, 'meta.json'), 'w') as meta_file:
+                json.dump({'rows': len(cleaned), 'items': items}, meta_file)
+            os.replace(staging, os.path.join(self.directory, segment))
+
+            manifest = dict(self.manifest)
+            manifest.update(segments=manifest['segments'] + [segment], next=manifest['next'] + 1,
+                            batches=manifest['batches'] + ([str(batch_id)] if batch_id is not None else []))
+            self._write_manifest(manifest)
+        if len(self.manifest['segments']) > self.max_segments:
+            self.compact()
+        return segment
+
+    def _cached(self, segment, column):
+        return os.path.exists(self._path(segment, f'{column}-{self.versions[column]}.npy'))
+
+    def stale(self, columns=None):
+        '''
+        Returns the columns (default: all) that would be computed for at least one segment if read now.
+        '''
+        columns = columns or self.score_columns + [name + FLAGS_SUFFIX for name in self.instruments]
+        return [column for column in columns
+                if any(not self._cached(segment, column) for segment in self.manifest['segments'])]
+
+    def _responses(self, segment, items):
+        # Reads just the requested item columns, as float64 with NaN for missing responses
+        meta = self._meta(segment)
+        values = np.empty((meta['rows'], len(items)))
+        for name, stored in meta['items'].items():
+            wanted = [(position, stored.index(item)) for position, item in enumerate(items) if item in stored]
+            if not wanted:
+                continue
+            targets, sources = zip(*wanted)
+            responses = np.load(self._path(segment, f'items-{name}.npy'), mmap_mode='r')[:, list(sources)]
+            missing = np.load(self._path(segment, f'items-{name}.mask.npy'), mmap_mode='r')[:, list(sources)]
+            values[:, list(targets)] = np.where(missing, np.nan, responses)
+        absent = [item for item in items if not any(item in stored for stored in meta['items'].values())]
+        if absent:
+            raise ValueError(f"{segment} has no responses for {', '.join(absent)}; append the history again")
+        return values
+
+    def _compute(self, segment, columns):
+        # Groups the stale columns by instrument and scores each group with an engine built for just those columns
+        for name in dict.fromkeys(self.owner[column] for column in columns):
+            instrument = self.instruments[name]
+            wanted = [column for column in columns if self.owner[column] == name]
+            if name + FLAGS_SUFFIX in wanted:
+                engine = ScoringEngine([instrument])
+            else:
+                scales = {scale.name: scale for scale in instrument.subscales}
+                needed, pending = set(), list(wanted)
+                while pending:  # A composite needs the subscales it combines
+                    column = pending.pop()
+                    if column not in needed:
+                        needed.add(column)
+                        pending.extend(part for part in scales[column].items if part in scales)
+                subscales = [scale for scale in instrument.subscales if scale.name in needed]
+                used = {item for scale in subscales for item in scale.items}
+                items = [item for item in instrument.items if item in used]
+                engine = ScoringEngine([instrument._replace(
+                    items=items, reverse_keyed=[item for item in instrument.reverse_keyed if item in used],
+                    subscales=subscales)])
+
+            scores, flags = engine.evaluate_items(self._responses(segment, engine.item_columns))
+            results = dict(zip(engine.score_columns, scores.T))
+            results[name + FLAGS_SUFFIX] = flags[:, 0]
+            for column in wanted:
+                for old in glob.glob(self._path(segment, f'{column}-*.npy')):
+                    os.remove(old)
+                _save_array(self._path(segment, f'{column}-{self.versions[column]}.npy'), results[column])
+                self.computed += 1
+
+    def columns(self, columns):
+        '''
+        Returns {column: array over the whole history} for the given subscale and flags columns, computing only the
+        ones whose current version is not cached in a segment.
+        '''
+        unknown = [column for column in columns if column not in self.owner]
+        if unknown:
+            raise KeyError(f"Not a score column: {', '.join(unknown)}")
+        parts = {column: [] for column in columns}
+        with stage('columns_read', rows_in=len(columns)) as record:
+            before = self.computed
+            for segment in self.manifest['segments']:
+                stale = [column for column in columns if not self._cached(segment, column)]
+                if stale:
+                    self._compute(segment, stale)
+                for column in columns:
+                    parts[column].append(np.load(self._path(segment, f'{column}-{self.versions[column]}.npy')))
+            record.rows_out = self.computed - before
+        return {column: np.concatenate(arrays) if arrays else np.empty(0) for column, arrays in parts.items()}
+
+    def __getitem__(self, column):
+        return pd.Series(self.columns([column])[column], name=column)
+
+    def rows(self):
+        '''
+        The identifying columns of every stored assessment, in the order they were appended.
+        '''
+        frames = [pd.read_pickle(self._path(segment, 'rows.pkl')) for segment in self.manifest['segments']]
+        if not frames:
+            return pd.DataFrame(columns=['name', 'assess_date'])
+        rows = pd.concat(frames, ignore_index=True)
+        for column in rows.columns:
+            if column != 'assess_date' and rows[column].dtype == object:
+                rows[column] = rows[column].astype('category')
+        return rows
+
+    def frame(self, columns=None, validity_column='validity'):
+        '''
+        Returns the identifying columns with the requested subscale columns (default: all of them) and, with
+        `validity_column`, the packed validation bitmask, as measure_tools.score_frame lays them out.
+        '''
+        columns = list(columns or self.score_columns)
+        flags = [name + FLAGS_SUFFIX for name in self.instruments] if validity_column else []
+        values = self.columns(columns + [column for column in flags if column not in columns])
+        frame = pd.DataFrame({column: values[column] for column in columns})
+        if validity_column:
+            validity = np.zeros(len(frame), dtype=np.uint32)
+            for number, column in enumerate(flags):
+                validity |= values[column].astype(np.uint32) << np.uint32(VALIDITY_BITS * number)
+            frame[validity_column] = validity
+        return pd.concat([self.rows(), frame], axis=1)
+
+    def compact(self):
+        '''
+        Folds every segment into one: rows and responses are concatenated, and each computed column that is cached
+        at its current version in every segment is carried over.
+        '''
+        segments = self.manifest['segments']
+        if len(segments) < 2:
+            return
+        with stage('columns_compact') as record:
+            metas = [self._meta(segment) for segment in segments]
+            segment = f"segment-{self.manifest['next']:06d}"
+            staging = tempfile.mkdtemp(prefix='.staging-', dir=self.directory)
+            self.rows().to_pickle(os.path.join(staging, 'rows.pkl'))
+            items = {}
+            for name in self.instruments:
+                stored = [meta['items'].get(name) for meta in metas]
+                if any(names != stored[0] for names in stored):
+                    raise ValueError(f"Segments store different {name} items; append the history again")
+                for suffix in ('.npy', '.mask.npy'):
+                    np.save(os.path.join(staging, f'items-{name}{suffix}'),
+                            np.concatenate([np.load(self._path(part, f'items-{name}{suffix}')) for part in segments]))
+                items[name] = stored[0]
+            for column, version in self.versions.items():
+                if all(self._cached(part, column) for part in segments):
+                    np.save(os.path.join(staging, f'{column}-{version}.npy'),
+                            np.concatenate([np.load(self._path(part, f'{column}-{version}.npy')) for part in segments]))
+            rows = sum(meta['rows'] for meta in metas)
+            with open(os.path.join(staging, 'meta.json'), 'w') as meta_file:
+                json.dump({'rows': rows, 'items': items}, meta_file)
+            os.replace(staging, os.path.join(self.directory, segment))
+
+            manifest = dict(self.manifest)
+            manifest.update(segments=[segment], next=manifest['next'] + 1)
+            self._write_manifest(manifest)
+            record.rows_out = rows
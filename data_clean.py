@@ -1,9 +1,10 @@
-import pandas as pd
 import os
 import sys
 from datetime import datetime
 
 def clean_return(import_file_location):
+    import pandas as pd
+
     # Path to raw input data from Survey Monkey
     data = pd.read_excel(import_file_location)
 
@@ -29,6 +30,8 @@ def clean_return(import_file_location):
     return data
 
 def clean_and_export(import_file_location, export_file_location, open_file=False):
+    import pandas as pd
+
     assert os.path.exists(import_file_location), 'Path to data not found'
 
     # Default destination for the cleaned CSV file if not export_file_location is provided
@@ -0,0 +1,189 @@
+'''
+### PURPOSE: ####
+Finds duplicate submissions, both within a batch and against the batches already exported to Avatar, before they
+reach an import file. Every cleaned row gets two keys:
+    - a visit key: a hash of the normalized client name (normalize_name) and the assessment date
+    - a response key: the visit key plus a hash of the full response vector
+Rows sharing a response key are EXACT_DUPLICATE. Rows that share only a visit key are NEAR_DUPLICATE: the same client
+and day with different answers, typically a resubmitted survey. Avatar accepts one assessment per client and day, so
+either kind needs a person to decide. The first occurrence in a batch, and anything not seen before, is UNIQUE.
+
+Keys are computed with vectorized hashing and checked against hash-based indexes, so a batch is checked in a single
+linear pass whatever the index size.
+
+#### INDEX: ####
+DuplicateIndex stores the keys of every exported row, with the batch id and assessment date, in one .npz file that
+is replaced atomically. A retention policy keeps it bounded. Entries whose assessment date is more than
+`retention_days` before the newest recorded assessment are dropped, and beyond `max_entries` the oldest assessments
+go first. Rows older than the retention window are only checked within their own batch.
+
+Recording a batch id again replaces that batch's entries, and a batch is never checked against its own entries, so a
+batch can be re-run (e.g. after a name fix) without flagging itself. The index expects one writer at a time:
+run_batches has its workers clean and match, then checks, writes and records each batch in the parent process in
+manifest order, so every batch is also checked against the batches before it in the same manifest.
+
+#### USAGE: ####
+    index = DuplicateIndex('data_files/exported.npz')
+    flagged = flag_duplicates(matched, index, batch_id=42)    # adds duplicate_status and duplicate_of
+    ... export the UNIQUE rows ...
+    index.record(flagged.loc[exported_rows], batch_id=42)
+'''
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+from measure_tools import SCORING_ENGINE
+from match_tools import normalize_name
+from metrics_tools import stage
+
+UNIQUE = 'unique'
+EXACT_DUPLICATE = 'exact_duplicate'
+NEAR_DUPLICATE = 'near_duplicate'
+DUPLICATE = 'duplicate'  # match_status given to flagged rows so they go to the review file instead of an import file
+
+DEFAULT_RETENTION_DAYS = 400
+DEFAULT_MAX_ENTRIES = 5000000
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+def _normalized_names(names):
+    # Each distinct name is normalized once
+    names = pd.Series(names)
+    if isinstance(names.dtype, pd.CategoricalDtype):
+        normalized = np.array([normalize_name(name) for name in names.cat.categories] + [''], dtype=object)
+        return normalized[names.cat.codes.to_numpy()]  # Code -1 (missing) picks the trailing ''
+    return np.array([normalize_name(name) for name in names], dtype=object)
+
+def submission_keys(dataframe):
+    '''
+    Returns (visit keys, response keys, assessment day numbers) for a cleaned frame, as uint64/uint64/int64 arrays.
+    '''
+    days = pd.to_datetime(dataframe['assess_date']).to_numpy(dtype='datetime64[D]')
+    days = (days - _EPOCH).astype(np.int64)
+    visit = pd.DataFrame({'name': _normalized_names(dataframe['name']), 'day': days})
+    visit_keys = pd.util.hash_pandas_object(visit, index=False).to_numpy()
+
+    items = [column for column in SCORING_ENGINE.item_columns if column in dataframe.columns]
+    responses = pd.DataFrame(dataframe[items].to_numpy(dtype='float64', na_value=np.nan))
+    response_keys = pd.util.hash_pandas_object(responses, index=False).to_numpy()
+    response_keys = pd.util.hash_pandas_object(pd.DataFrame({'visit': visit_keys, 'responses': response_keys}),
+                                               index=False).to_numpy()
+    return visit_keys, response_keys, days
+
+class DuplicateIndex:
+    def __init__(self, path=None, retention_days=DEFAULT_RETENTION_DAYS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.retention_days = retention_days
+        self.max_entries = max_entries
+        self.visit_keys, self.response_keys, self.days, self.batches = self._read()
+        self._lookup = None
+
+    def _read(self):
+        if self.path and os.path.exists(self.path):
+            with np.load(self.path, allow_pickle=False) as stored:
+                return stored['visit_keys'], stored['response_keys'], stored['days'], stored['batches']
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64), np.empty(0, dtype=str)
+
+    def __len__(self):
+        return len(self.visit_keys)
+
+    def lookup(self, visit_keys, response_keys, exclude_batch=None):
+        '''
+        Returns, for each key pair, whether the visit and the exact response were recorded, and the batch the visit
+        was recorded under ('' when it was not). Entries recorded under `exclude_batch` are ignored.
+        '''
+        exclude_batch = None if exclude_batch is None else str(exclude_batch)
+        if self._lookup is None or self._lookup[0] != exclude_batch:
+            kept = np.ones(len(self), dtype=bool) if exclude_batch is None else self.batches != exclude_batch
+            visit_keys_kept, batches_kept = self.visit_keys[kept], self.batches[kept]
+            latest = ~pd.Index(visit_keys_kept).duplicated(keep='last')
+            self._lookup = (exclude_batch, pd.Index(visit_keys_kept[latest]), batches_kept[latest],
+                            pd.Index(self.response_keys[kept]))
+        _, visits, batches, responses = self._lookup
+        position = visits.get_indexer(visit_keys)
+        seen_visit = position >= 0
+        seen_response = pd.Index(response_keys).isin(responses)
+        if not len(batches):
+            return seen_visit, seen_response, np.full(len(position), '')
+        return seen_visit, seen_response, np.where(seen_visit, batches[position.clip(0)], '')
+
+    def record(self, dataframe, batch_id, save=True):
+        '''
+        Records the keys of `dataframe`'s rows (the rows just exported) under `batch_id`. See record_keys.
+        '''
+        return self.record_keys(submission_keys(dataframe), batch_id, save=save)
+
+    def record_keys(self, keys, batch_id, save=True):
+        '''
+        Records (visit keys, response keys, days), as returned by submission_keys, under `batch_id`, replacing
+        anything recorded under it before. Applies the retention policy and, with `save`, saves the index if it has
+        a path.
+        '''
+        visit_keys, response_keys, days = keys
+        with stage('dedup_record', rows_in=len(visit_keys)) as record:
+            kept = self.batches != str(batch_id)
+            self.visit_keys = np.concatenate([self.visit_keys[kept], visit_keys])
+            self.response_keys = np.concatenate([self.response_keys[kept], response_keys])
+            self.days = np.concatenate([self.days[kept], days])
+            self.batches = np.concatenate([self.batches[kept], np.full(len(visit_keys), str(batch_id))])
+            self._apply_retention()
+            record.rows_out = len(self)
+        if save and self.path:
+            self.save()
+
+    def _apply_retention(self):
+        keep = np.ones(len(self), dtype=bool)
+        if len(self):
+            keep &= self.days >= self.days.max() - self.retention_days
+        if keep.sum() > self.max_entries:
+            # Newest assessments first; the cut-off day is the one at the max_entries boundary
+            cutoff = np.sort(self.days[keep])[-self.max_entries]
+            keep &= self.days >= cutoff
+        if not keep.all():
+            self.visit_keys, self.response_keys = self.visit_keys[keep], self.response_keys[keep]
+            self.days, self.batches = self.days[keep], self.batches[keep]
+        self._lookup = None
+
+    def save(self, path=None):
+        path = path or self.path
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        handle, staging = tempfile.mkstemp(prefix='.dedup-', suffix='.npz', dir=directory)
+        os.close(handle)
+        np.savez(staging, visit_keys=self.visit_keys, response_keys=self.response_keys, days=self.days,
+                 batches=self.batches.astype(str))
+        os.replace(staging, path)
+        return path
+
+def flag_duplicates(dataframe, index=None, batch_id=None, status_column='duplicate_status', source_column='duplicate_of'):
+    '''
+    Returns a copy of a cleaned (or matched) frame with `status_column` set to UNIQUE, EXACT_DUPLICATE or
+    NEAR_DUPLICATE, and `source_column` naming what it duplicates: "batch <id>" for a previously exported batch in
+    `index`, "row <label>" for an earlier row of the same frame. Rows are taken in frame order, so the first
+    occurrence within the frame is the one kept as UNIQUE. With `batch_id`, the frame's own earlier run (entries
+    recorded under that id) is not counted.
+    '''
+    with stage('flag_duplicates', rows_in=len(dataframe)) as record:
+        visit_keys, response_keys, _ = submission_keys(dataframe)
+        visits = pd.Series(visit_keys)
+        responses = pd.Series(response_keys)
+
+        # Within the frame
+        repeat_visit = visits.duplicated().to_numpy()
+        repeat_response = responses.duplicated().to_numpy()
+        first_label = pd.Series(dataframe.index).groupby(visit_keys).transform('first').to_numpy()
+        status = np.where(repeat_response, EXACT_DUPLICATE, np.where(repeat_visit, NEAR_DUPLICATE, UNIQUE)).astype(object)
+        source = np.where(repeat_visit, pd.Series(first_label).map('row {}'.format).to_numpy(), None)
+
+        # Against earlier batches, which take precedence over a copy within the frame
+        if index is not None and len(index):
+            seen_visit, seen_response, batches = index.lookup(visit_keys, response_keys, exclude_batch=batch_id)
+            status = np.where(seen_response, EXACT_DUPLICATE, np.where(seen_visit, NEAR_DUPLICATE, status))
+            source = np.where(seen_visit, np.char.add('batch ', batches.astype(str)).astype(object), source)
+
+        flagged = dataframe.copy()
+        flagged[status_column] = status
+        flagged[source_column] = source
+        record.rows_out = int((status != UNIQUE).sum())
+    return flagged
@@ -0,0 +1,64 @@
+'''
+### PURPOSE: ####
+Splits a matched assessment frame (the output of import_prep's matching step) into the Avatar import files:
+one file per assessment (DERS-16, ARI, DTS, CEAS, CAMM) holding only that assessment's columns for matched rows,
+plus one file holding every row that still needs a hand match.
+
+All files are written concurrently from a single pass over the frame. Missing values are written as "Missing"
+at serialization time (na_rep), so numeric columns keep their dtypes instead of the whole frame being converted
+to object by fillna.
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from measure_tools import INSTRUMENTS
+from match_tools import MATCHED, FUZZY_MATCHED
+from metrics_tools import stage
+
+# Identifying columns leading every import file, in order. Any that are absent from the frame are skipped.
+ID_COLUMNS = [
+    'matched_all', 'epn_matched', 'id_matched', 'name', 'match_status', 'suggested_name', 'suggestion_score',
+    'pid', 'entered_id', 'epn', 'entered_epn', 'adm_date', 'assess_date', 'disc_date']
+
+# Extra per-assessment columns Avatar expects alongside the item responses
+IMPORT_LAYOUT = {
+    'ders': INSTRUMENTS['ders'].items + ['ders_assessment_type', 'ders_draft_final'],
+    'ari': INSTRUMENTS['ari'].items + ['ari_total'],
+    'dts': INSTRUMENTS['dts'].items + ['dts_status'],
+    'ceas': INSTRUMENTS['ceas'].items,
+    'camm': INSTRUMENTS['camm'].items,
+}
+
+UNMATCHED = 'unmatched'
+
+def import_file_paths(output_dir, prefix):
+    '''
+    Returns {output name: path} for every file write_import_files produces.
+    '''
+    return {name: os.path.join(output_dir, f'{prefix}_{name}.csv') for name in list(IMPORT_LAYOUT) + [UNMATCHED]}
+
+def write_import_files(dataframe, output_dir, prefix, status_column='match_status', na_rep='Missing', max_workers=None):
+    '''
+    Writes every assessment's import file and the unmatched-rows file for one batch into `output_dir`.
+    Rows count as matched when their status is MATCHED or FUZZY_MATCHED. Returns {output name: (path, rows written)}.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    paths = import_file_paths(output_dir, prefix)
+    matched_rows = dataframe[status_column].isin([MATCHED, FUZZY_MATCHED]).to_numpy()
+    id_columns = [column for column in ID_COLUMNS if column in dataframe.columns]
+
+    jobs = {}
+    for name, columns in IMPORT_LAYOUT.items():
+        jobs[name] = (matched_rows, id_columns + [column for column in columns if column in dataframe.columns])
+    jobs[UNMATCHED] = (~matched_rows, list(dataframe.columns))
+
+    def write(name):
+        rows, columns = jobs[name]
+        with stage(f'write_csv:{name}', rows_in=len(dataframe)) as record:
+            subset = dataframe.loc[rows, columns]
+            subset.to_csv(paths[name], index=False, na_rep=na_rep)
+            record.rows_out = len(subset)
+        return name, (paths[name], len(subset))
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(jobs)) as executor:
+        return dict(executor.map(write, jobs))
@@ -1,6 +1,6 @@
 '''
 ### PROGRAM PURPOSE: ####
-This program is intended to take a raw file, exported from Survey Monkey which contains survey data 
+This program is intended to take a raw file, exported from Survey Monkey which contains survey data
 from the Outcome Measures battery of assessments, pairs it with matched identification information from
 the Avatar "Admissions in Date Range" report, and exports 6 separate CSVs.
 
@@ -12,88 +12,283 @@ This program creates 5 assessment-level files and 1 file for any non-matched nam
     - Distress Tolerance Scale (DTS)
     - Compassionate Engagement and Action Scales (CEAS)
     - Child and Adolescent Mindfulness Measure (CAMM)
-The sixth file contains all rows that did not find a match during processing. This is most likely due to names being 
+The sixth file contains all rows that did not find a match during processing. This is most likely due to names being
 spelled incorrectly at the time of entry into Survey Monkey. These files will have to be manually reviewed and appropriately
-matched with a client ID number and the correct episode number for the assessment(s) in question. 
+matched with a client ID number and the correct episode number for the assessment(s) in question.
 
 #### REQUIRED INFORMATION: ####
-The program requires input from the user specifying the location of the raw data file which would have been 
-downloaded prior to runtime as well as a copy of an 'Admissions by Date Range' report from AVATAR. 
+Each batch needs the location of the raw data file downloaded from Survey Monkey, a copy of an 'Admissions by Date Range'
+report from AVATAR and a directory to write the output files to. Batches can be run one at a time or many at once from
+a manifest (CSV or JSON) with one entry per batch and the columns: batch_id, raw_file, avatar_report, output_dir.
+
+#### USAGE: ####
+    python import_prep.py --batch-id 42 --raw-file "Outcome Measures.xlsx" --avatar-report batch_42.xls --output-dir out/
+    python import_prep.py --manifest batches.csv --workers 4
+    python import_prep.py --manifest batches.csv --admissions-db data_files/admissions.sqlite
+Batches sharing an Avatar report are run in the same worker so the report is only parsed once.
 '''
-from measure_tools import clean_data, clean_avatar_report
+from cache_tools import cached_clean_data, cached_clean_avatar_report
+from admissions_tools import AdmissionsStore
+from dedup_tools import DuplicateIndex, flag_duplicates, submission_keys, UNIQUE, DUPLICATE
+from measure_tools import mask_invalid_responses, score_ari
+from match_tools import EpisodeIndex, NameIndex, MATCHED, FUZZY_MATCHED
+from export_tools import write_import_files
+import metrics_tools
+from metrics_tools import stage
+import numpy as np
 import pandas as pd
 import os
-import platform
+import json
+import argparse
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import sys
 
-# Setting the destination for final files based on current computer operating system
-if platform.system() == "Windows":
-    output_path = r"U:/Outcome_Measures/Import_ready_files/"
-    print(f"\nYOU ARE RUNNING THIS FILE ON WINDOWS. EXPORT LOCATION WILL BE: {output_path}")
-else:
-    output_path = r"/Users/mattlui/Desktop/outcome_measures/data_dump/"
-    print(f"\nYOU ARE RUNNING THIS FILE ON MacOS. EXPORT LOCATION WILL BE: {output_path}")
-
-# DIRECTORY SPECIFICATION & BATCH IDENTIFICATION
-batch_id = str(input("Please enter current batch number: "))
-raw_file = os.path.join(r"C:\Users\mlui-tankersley\Downloads", "batch_" + batch_id, "Excel","Outcome Measures.xlsx")
-avatar_report_path = os.path.join(r"U:\Outcome_Measures\avatar_admissions_reports", "batch_" + batch_id + ".xls")
-
-# BACKUP DIRECTORY SPECIFICATION IN CASE SURVEY MONKEY DOES NOT INCLUDE AN 'EXCEL' FOLDER AFTER UN-ZIPPING DATA FILE
-if os.path.exists(raw_file) == False:
-    raw_file = os.path.join(r"C:\Users\mlui-tankersley\Downloads", "batch_" + batch_id,"Outcome Measures.xlsx")
-
-# DIRECTORY VALIDATION
-while os.path.exists(raw_file) == False:
-    raw_file = input("Path not found. Please enter path to raw data or enter 'q' to exit program:\n")
-    if raw_file.lower() == 'q':
-        sys.exit()
-
-while os.path.exists(avatar_report_path) == False:
-    avatar_report_path = input("Path not found. Please enter path to Avatar Admissions report or enter 'q' to exit program:\n")
-    if avatar_report_path.lower() == 'q':
-        sys.exit()
-
-# DATA CLEANING
-df = clean_data(raw_file)
-avatar_df = clean_avatar_report(avatar_report_path)
-df = df.loc[df['name'].str.lower().sort_values().index]  # Case insensitive sorting in-place
-
-# Merging names with Avatar IDs and EPNs
-merged = df.merge(avatar_df, how="left", on="name")
-missing = merged.loc[merged["pid"].isnull()]
-matched = merged[(merged["adm_date"] <= merged["assess_date"]) & (merged["assess_date"] <= merged["disc_date"])]
-
-# Combining the matches with the non-matches for hand review
-combined = pd.concat([missing, matched])
-
-combined["ders_assessment_type"] = '15'
-combined["ders_draft_final"] = 'D'
-combined["ari_total"] = combined.loc[:,[col for col in combined.columns if "ari" in col]].astype("float64").sum(axis=1)
-combined["dts_status"] = 'D'
-
-# Reorganizing dataframe into better column sequence & dropping CEAS columns from further analysis
-combined = combined[[
-    'name', 'pid', 'entered_id', 'epn', 'entered_epn', 'adm_date', 'assess_date', 'disc_date',
-    'ders_1', 'ders_2', 'ders_3', 'ders_4', 'ders_5', 'ders_6', 'ders_7', 'ders_8', 'ders_9', 'ders_10', 'ders_11', 'ders_12', 'ders_13', 'ders_14', 'ders_15', 'ders_16', 'ders_assessment_type', 'ders_draft_final', 
-    'ari_1', 'ari_2', 'ari_3', 'ari_4', 'ari_5', 'ari_6', 'ari_7', 'ari_total', 
+MANIFEST_COLUMNS = ['batch_id', 'raw_file', 'avatar_report', 'output_dir']
+
+IMPORT_COLUMNS = [
+    'name', 'match_status', 'suggested_name', 'suggestion_score', 'pid', 'entered_id', 'epn', 'entered_epn', 'adm_date', 'assess_date', 'disc_date',
+    'ders_1', 'ders_2', 'ders_3', 'ders_4', 'ders_5', 'ders_6', 'ders_7', 'ders_8', 'ders_9', 'ders_10', 'ders_11', 'ders_12', 'ders_13', 'ders_14', 'ders_15', 'ders_16', 'ders_assessment_type', 'ders_draft_final',
+    'ari_1', 'ari_2', 'ari_3', 'ari_4', 'ari_5', 'ari_6', 'ari_7', 'ari_total',
     'dts_1', 'dts_2', 'dts_3', 'dts_4', 'dts_5', 'dts_6', 'dts_7', 'dts_8', 'dts_9', 'dts_10', 'dts_11', 'dts_12', 'dts_13', 'dts_14', 'dts_15', 'dts_status',
-    'camm_1', 'camm_2', 'camm_3', 'camm_4', 'camm_5', 'camm_6', 'camm_7', 'camm_8', 'camm_9', 'camm_10']
+    'ceas_self_1', 'ceas_self_2', 'ceas_self_3', 'ceas_self_4', 'ceas_self_5', 'ceas_self_6', 'ceas_self_7', 'ceas_self_8', 'ceas_self_9', 'ceas_self_10', 'ceas_self_11', 'ceas_self_12', 'ceas_self_13',
+    'ceas_from_1', 'ceas_from_2', 'ceas_from_3', 'ceas_from_4', 'ceas_from_5', 'ceas_from_6', 'ceas_from_7', 'ceas_from_8', 'ceas_from_9', 'ceas_from_10', 'ceas_from_11', 'ceas_from_12', 'ceas_from_13',
+    'ceas_to_1', 'ceas_to_2', 'ceas_to_3', 'ceas_to_4', 'ceas_to_5', 'ceas_to_6', 'ceas_to_7', 'ceas_to_8', 'ceas_to_9', 'ceas_to_10', 'ceas_to_11', 'ceas_to_12', 'ceas_to_13',
+    'camm_1', 'camm_2', 'camm_3', 'camm_4', 'camm_5', 'camm_6', 'camm_7', 'camm_8', 'camm_9', 'camm_10'
 ]
 
-combined[["pid", "entered_id"]] = combined.loc[:, ["pid", "entered_id"]].astype("float64")  # Standardizing typing for numerical columns to enable boolean comparisons for matches
-combined.insert(loc=0, column='id_matched', value=combined['pid'] == combined['entered_id'])  # Avatar ID from algorithm matching and staff-entered values comparison
-combined.insert(loc=0, column='epn_matched', value=combined['epn'] == combined['entered_epn'])  # Avatar EPN from algorithm matching and staff-entered values comparison 
-combined.insert(loc=0, column="matched_all", value=(combined["id_matched"] & combined["epn_matched"]))
-combined.sort_values(by=['matched_all', 'id_matched','name'], inplace=True)
-combined.fillna(value="Missing", inplace=True)
-
-output_path = output_path + "batch_" + batch_id + "-" + str(datetime.today().strftime('%m.%d.%Y')) + '.csv'
-combined.to_csv(path_or_buf=output_path, index=False)
-
-if platform.system() == "Windows":
-    print('\nOpening window to exported files...dot..dot..dot..')
-    os.startfile(r'U:/Outcome_Measures/Import_ready_files')
-else:
-    print(f"Processing completed. Output files dropped in {output_path}")
+def prepare_import(df, avatar_df):
+    '''
+    Matches cleaned assessments to Avatar IDs/EPNs and lays them out for the import files. Every assessment is kept:
+    rows whose name was not found, or whose name was found without an episode covering the assessment date, stay in
+    for hand review.
+    '''
+    # Case insensitive sorting. The sorts are stable, so rows keep their export order within a name and the first
+    # submission is the one flag_duplicates keeps
+    df = df.loc[df['name'].str.lower().sort_values(kind='mergesort').index]
+
+    # Matching names & assessment dates with Avatar IDs and EPNs
+    with stage('match_episodes', rows_in=len(df)) as record:
+        episode_index = EpisodeIndex(avatar_df)
+        combined = episode_index.match(df)
+        record.rows_out = len(combined)
+
+    # Suggesting the closest Avatar name for unmatched rows and auto-resolving the unambiguous ones
+    with stage('resolve_names', rows_in=len(combined)) as record:
+        combined = NameIndex(avatar_df, episode_index).resolve(combined)
+        record.rows_out = len(combined)
+
+    # Out-of-range and non-numeric responses are exported as missing, never as the stored placeholder
+    combined = mask_invalid_responses(combined)
+    combined["ders_assessment_type"] = '15'
+    combined["ders_draft_final"] = 'D'
+    combined["ari_total"] = score_ari(combined)  # The engine's ARI score: items 1-6, null when too few were answered
+    combined["dts_status"] = 'D'
+
+    # Reorganizing dataframe into better column sequence
+    combined = combined[[col for col in IMPORT_COLUMNS if col in combined.columns]]
+
+    # Comparing the algorithm's Avatar ID/EPN with the values staff entered, when the export carries them
+    sort_by = ['name']
+    if 'entered_id' in combined.columns and 'entered_epn' in combined.columns:
+        # Staff-entered values can be text, so they are read as numbers for the comparison; the compact ID columns are left as they are
+        entered_id = pd.to_numeric(combined['entered_id'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        entered_epn = pd.to_numeric(combined['entered_epn'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        combined.insert(loc=0, column='id_matched', value=combined['pid'].to_numpy(dtype='float64', na_value=np.nan) == entered_id)  # Avatar ID from algorithm matching and staff-entered values comparison
+        combined.insert(loc=0, column='epn_matched', value=combined['epn'].to_numpy(dtype='float64', na_value=np.nan) == entered_epn)  # Avatar EPN from algorithm matching and staff-entered values comparison
+        combined.insert(loc=0, column="matched_all", value=(combined["id_matched"] & combined["epn_matched"]))
+        sort_by = ['matched_all', 'id_matched', 'name']
+    combined.sort_values(by=sort_by, inplace=True, kind='mergesort')
+
+    return combined
+
+def load_admissions(avatar_report, admissions_db=None, discharged_since=None):
+    '''
+    Returns the cleaned Avatar episodes for a batch. Without `admissions_db` the report itself is cleaned (through the
+    file cache). With it, the report is loaded into that admissions store (skipped if it was loaded before) and the
+    episodes come from the store, limited to those still open or discharged on or after `discharged_since`. With a
+    store, `avatar_report` can be None to use the episodes already loaded.
+    '''
+    if not admissions_db:
+        return cached_clean_avatar_report(avatar_report)
+    with AdmissionsStore(admissions_db) as store:
+        if avatar_report:
+            store.refresh(avatar_report)
+        return store.frame(discharged_since=discharged_since)
+
+def _export_batch(summary, combined, index=None):
+    # Flags duplicates against `index` as it stands (so including batches recorded earlier in the same run), writes
+    # the import files and records the exported rows in `index` without saving it
+    batch_id = summary['batch_id']
+    if index is not None:
+        combined = flag_duplicates(combined, index, batch_id=batch_id)
+        combined.loc[combined['duplicate_status'] != UNIQUE, 'match_status'] = DUPLICATE
+
+    # Writing the per-assessment import files and the unmatched file in parallel. Missing values are written as
+    # "Missing" during serialization so numeric columns keep their types.
+    prefix = "batch_" + str(batch_id) + "-" + str(datetime.today().strftime('%m.%d.%Y'))
+    written = write_import_files(combined, summary['output_dir'], prefix)
+    if index is not None:
+        index.record_keys(submission_keys(combined.loc[combined['match_status'].isin([MATCHED, FUZZY_MATCHED])]),
+                          batch_id, save=False)
+
+    summary.update(status='ok', rows=len(combined), error=None,
+                   outcomes=combined['match_status'].value_counts().to_dict(),
+                   files={name: path for name, (path, _) in written.items()})
+
+def run_batch(batch_id, raw_file, avatar_report, output_dir, avatar_df=None, metrics_dir=None, profile_stage=None,
+              admissions_db=None, dedup_index=None, export=True):
+    '''
+    Runs clean -> match -> export for one batch and returns its status summary. A pre-cleaned Avatar report can be
+    passed as avatar_df to skip parsing it again, and admissions_db names an admissions store (see
+    admissions_tools) to match against instead of the report alone. With dedup_index (a DuplicateIndex file, see
+    dedup_tools), duplicates of earlier rows or of previously exported batches get the DUPLICATE match status and go
+    to the unmatched file for review, and the exported rows are recorded in the index under batch_id (replacing an
+    earlier run of the same batch). With export=False the batch stops after matching and the matched frame is
+    returned as summary['combined'] for the caller to check and write. With metrics_dir set, per-stage timings for
+    the batch are written to metrics_dir/batch_<batch_id>.metrics.json (and profile_stage, if given, is run under
+    cProfile).
+    '''
+    summary = {'batch_id': str(batch_id), 'raw_file': raw_file, 'avatar_report': avatar_report, 'output_dir': output_dir}
+    if metrics_dir:
+        metrics_tools.enable(os.path.join(metrics_dir, f'batch_{batch_id}.metrics.json'),
+                             profile_stage=profile_stage, run_label=f'batch_{batch_id}')
+    try:
+        df = cached_clean_data(raw_file)
+        if avatar_df is None:
+            avatar_df = load_admissions(avatar_report, admissions_db, discharged_since=df['assess_date'].min())
+        combined = prepare_import(df, avatar_df)
+        if not export:
+            summary.update(status='ok', combined=combined)
+        else:
+            index = DuplicateIndex(dedup_index) if dedup_index else None
+            _export_batch(summary, combined, index)
+            if index is not None:
+                index.save()
+    except Exception as error:
+        summary.update(status='failed', rows=0, error=f'{type(error).__name__}: {error}', outcomes={}, files={})
+    finally:
+        if metrics_dir:
+            summary['metrics'] = metrics_tools.disable().write()
+    return summary
+
+def _failed_batches(batches, error):
+    return [dict(batch, batch_id=str(batch['batch_id']), status='failed', rows=0,
+                 error=f'{type(error).__name__}: {error}', outcomes={}, files={}) for batch in batches]
+
+def _run_report_group(avatar_report, batches, metrics_dir=None, profile_stage=None, admissions_db=None, export=True):
+    # Runs every batch that shares one Avatar report, parsing the report once for all of them. With an admissions
+    # store, run_batches has already loaded the report into it
+    try:
+        avatar_df = load_admissions(None if admissions_db else avatar_report, admissions_db)
+    except Exception as error:
+        return _failed_batches(batches, error)
+    return [run_batch(avatar_df=avatar_df, metrics_dir=metrics_dir, profile_stage=profile_stage, export=export, **batch)
+            for batch in batches]
+
+def run_batches(batches, max_workers=None, metrics_dir=None, profile_stage=None, admissions_db=None, dedup_index=None):
+    '''
+    Runs many batches in parallel worker processes. `batches` is a sequence of dicts with the MANIFEST_COLUMNS keys.
+    Batches sharing an Avatar report are grouped into a single task so the report is parsed once. With
+    admissions_db, every report is loaded into the store (oldest first) before any batch runs. With dedup_index the
+    workers only clean and match; each batch is then checked, written and recorded here one at a time in manifest
+    order, so a batch is checked against the batches before it in the same manifest as well as those exported by
+    earlier runs. Returns one status summary per batch, in manifest order.
+    '''
+    groups = {}
+    for batch in batches:
+        batch = {column: batch[column] for column in MANIFEST_COLUMNS}
+        groups.setdefault(batch['avatar_report'], []).append(batch)
+
+    # The admissions store is brought up to date before the workers start, one report at a time and oldest first,
+    # rather than by the workers in whatever order they finish
+    summaries = []
+    if admissions_db:
+        errors = {}
+        with AdmissionsStore(admissions_db) as store:
+            store.refresh_all(list(groups), errors=errors)
+        for report, error in errors.items():
+            summaries.extend(_failed_batches(groups.pop(report), error))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_run_report_group, report, group, metrics_dir, profile_stage, admissions_db,
+                                   not dedup_index)
+                   for report, group in groups.items()]
+        for future in as_completed(futures):
+            summaries.extend(future.result())
+
+    order = {str(batch['batch_id']): position for position, batch in enumerate(batches)}
+    summaries.sort(key=lambda summary: order.get(summary['batch_id'], len(order)))
+
+    # One process checks, writes and records the batches in manifest order against a single copy of the index
+    if dedup_index:
+        index = DuplicateIndex(dedup_index)
+        matched = [summary for summary in summaries if 'combined' in summary]
+        for summary in matched:
+            combined = summary.pop('combined')
+            batch_id = summary['batch_id']
+            if metrics_dir:
+                metrics_tools.enable(os.path.join(metrics_dir, f'batch_{batch_id}.export.metrics.json'),
+                                     profile_stage=profile_stage, run_label=f'batch_{batch_id}_export')
+            try:
+                _export_batch(summary, combined, index)
+            except Exception as error:
+                summary.update(status='failed', rows=0, error=f'{type(error).__name__}: {error}', outcomes={}, files={})
+            finally:
+                if metrics_dir:
+                    summary['export_metrics'] = metrics_tools.disable().write()
+        if matched:
+            index.save()
+    return summaries
+
+def read_manifest(manifest_path):
+    '''
+    Reads a batch manifest from CSV (one row per batch) or JSON (a list of objects) into a list of dicts.
+    '''
+    if os.path.splitext(manifest_path)[1].lower() == '.json':
+        with open(manifest_path) as manifest_file:
+            batches = json.load(manifest_file)
+    else:
+        batches = pd.read_csv(manifest_path, dtype=str).to_dict('records')
+
+    for batch in batches:
+        missing = [column for column in MANIFEST_COLUMNS if not batch.get(column)]
+        if missing:
+            raise ValueError(f"Manifest entry {batch} is missing: {', '.join(missing)}")
+    return batches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match Survey Monkey outcome measures with Avatar admissions and write import files.")
+    parser.add_argument('--manifest', help="CSV or JSON manifest with batch_id, raw_file, avatar_report and output_dir for each batch")
+    parser.add_argument('--batch-id', help="Batch number (single-batch mode)")
+    parser.add_argument('--raw-file', help="Survey Monkey export (single-batch mode)")
+    parser.add_argument('--avatar-report', help="Avatar 'Admissions in Date Range' report (single-batch mode)")
+    parser.add_argument('--output-dir', help="Directory for the import files (single-batch mode)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for manifest runs (default: CPU count)")
+    parser.add_argument('--metrics-dir', help="Write per-stage timing/memory metrics for each batch to this directory")
+    parser.add_argument('--admissions-db', help="SQLite admissions store to load each Avatar report into and match against")
+    parser.add_argument('--dedup-index', help="Duplicate index file (.npz) to check batches against and record exported rows in")
+    parser.add_argument('--profile-stage', help="Run this stage under cProfile (requires --metrics-dir), e.g. match_episodes")
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        summaries = run_batches(read_manifest(args.manifest), max_workers=args.workers,
+                                metrics_dir=args.metrics_dir, profile_stage=args.profile_stage,
+                                admissions_db=args.admissions_db, dedup_index=args.dedup_index)
+    elif all([args.batch_id, args.raw_file, args.avatar_report, args.output_dir]):
+        summaries = [run_batch(args.batch_id, args.raw_file, args.avatar_report, args.output_dir,
+                               metrics_dir=args.metrics_dir, profile_stage=args.profile_stage,
+                               admissions_db=args.admissions_db, dedup_index=args.dedup_index)]
+    else:
+        parser.error("Provide --manifest, or all of --batch-id, --raw-file, --avatar-report and --output-dir")
+
+    for summary in summaries:
+        if summary['status'] == 'ok':
+            outcomes = ', '.join(f'{outcome}={count}' for outcome, count in sorted(summary['outcomes'].items()))
+            print(f"batch {summary['batch_id']}: ok, {summary['rows']} rows ({outcomes}) -> {summary['output_dir']}")
+        else:
+            print(f"batch {summary['batch_id']}: FAILED - {summary['error']}")
+    return 0 if all(summary['status'] == 'ok' for summary in summaries) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+'''
+### PURPOSE: ####
+Reads and cleans several Survey Monkey exports or Avatar admissions reports at once, such as a quarter's exports from
+several sites or collectors. Files are parsed in a pool of worker processes. XLSX parsing is pure-Python and holds
+the GIL, so processes (not threads) are what make it scale with cores. Each file is cleaned to the usual schema
+(clean_data / clean_avatar_report) and every row is tagged with the file it came from. The per-file frames are
+concatenated once at the end.
+
+Sources can be a single path, directory or glob pattern, or a list of them. A directory stands for the CSV and Excel
+files directly inside it. Matching files are read in sorted order and duplicates are skipped.
+
+#### USAGE: ####
+    cleaned = ingest_exports('data_files/exports/2024-Q1/*.xlsx')
+    avatar_df = ingest_avatar_reports(['site_a_admissions.xls', 'site_b_admissions.xls'])
+'''
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+import measure_tools
+from cache_tools import cached_clean_data, cached_clean_avatar_report
+from metrics_tools import stage
+
+SOURCE_COLUMN = 'source_file'
+SOURCE_EXTENSIONS = ('csv', 'xlsx', 'xls')  # The files a directory source expands to
+REPORT_COLUMN = 'report_file'  # Named apart from SOURCE_COLUMN so both survive matching
+
+def expand_sources(sources):
+    '''
+    Expands a path, directory, glob pattern or list of them into a list of existing files, in order and without
+    duplicates. Raises FileNotFoundError for a source that matches nothing.
+    '''
+    if isinstance(sources, (str, os.PathLike)):
+        sources = [sources]
+    paths = []
+    for source in sources:
+        source = os.fspath(source)
+        if any(character in source for character in '*?['):
+            matches = sorted(glob.glob(source))
+        elif os.path.isdir(source):
+            matches = sorted(path for path in glob.glob(os.path.join(source, '*'))
+                             if os.path.isfile(path) and measure_tools.file_extension(path) in SOURCE_EXTENSIONS)
+        else:
+            matches = [source] if os.path.exists(source) else []
+        if not matches:
+            raise FileNotFoundError(f"No files match {source}")
+        paths.extend(match for match in matches if match not in paths)
+    return paths
+
+def _clean_export(path, dropna, use_cache):
+    if use_cache:
+        return cached_clean_data(path, dropna=dropna)
+    return measure_tools.clean_data(path, dropna=dropna)
+
+def _clean_avatar_report(path, use_cache):
+    if use_cache:
+        return cached_clean_avatar_report(path)
+    return measure_tools.clean_avatar_report(path)
+
+def _parse_all(function, paths, arguments, max_workers):
+    # A single file is parsed in-process; there is nothing to overlap
+    if len(paths) == 1 or max_workers == 1:
+        return [function(path, *arguments) for path in paths]
+    workers = min(len(paths), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, paths, *[[argument] * len(paths) for argument in arguments]))
+
+def _combine(frames, paths, tag_column, categorical_columns):
+    # Tags each frame with its source, then concatenates once. Categories differ between files, so categorical
+    # columns are rebuilt over the combined values afterwards.
+    for frame, path in zip(frames, paths):
+        frame.insert(loc=0, column=tag_column, value=pd.Categorical([path] * len(frame), categories=paths))
+    combined = pd.concat(frames, ignore_index=True, copy=False)
+    for column in categorical_columns:
+        combined[column] = combined[column].astype('category')
+    return combined
+
+def ingest_exports(sources, max_workers=None, dropna=True, use_cache=False):
+    '''
+    Cleans every Survey Monkey export in `sources` in parallel and returns one frame in the clean_data layout, with a
+    leading source_file column, sorted by name and assessment date. With use_cache, each file goes through the
+    on-disk frame cache (cache_tools).
+    '''
+    paths = expand_sources(sources)
+    with stage('ingest_exports') as record:
+        frames = _parse_all(_clean_export, paths, (dropna, use_cache), max_workers)
+        combined = _combine(frames, paths, SOURCE_COLUMN, ['name', 'cottage'])
+        combined.sort_values(by=['name', 'assess_date'], kind='mergesort', inplace=True)
+        combined.reset_index(drop=True, inplace=True)
+        record.rows_out = len(combined)
+    return combined
+
+def ingest_avatar_reports(sources, max_workers=None, use_cache=False):
+    '''
+    Cleans every Avatar report in `sources` in parallel and returns one frame in the clean_avatar_report layout,
+    with a leading report_file column. An episode (pid, epn) listed in several reports is kept once, from the last
+    report it appears in, so list reports oldest first.
+    '''
+    paths = expand_sources(sources)
+    with stage('ingest_avatar_reports') as record:
+        frames = _parse_all(_clean_avatar_report, paths, (use_cache,), max_workers)
+        combined = _combine(frames, paths, REPORT_COLUMN, ['name', 'program'])
+        combined = combined.drop_duplicates(subset=['pid', 'epn'], keep='last')
+        combined = combined.sort_values(by='adm_date', ascending=False, kind='mergesort').reset_index(drop=True)
+        record.rows_out = len(combined)
+    return combined
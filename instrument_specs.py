@@ -0,0 +1,87 @@
+'''
+### PURPOSE: ####
+Declarative specifications of the Outcome Measures battery (DERS-16, ARI, DTS, CEAS and CAMM): item columns,
+reverse-keyed items, response ranges, subscales and how much missing data each tolerates. Kept free of third-party
+imports so tools that only need the specs (e.g. `cli.py instruments`) start without loading numpy or pandas;
+measure_tools compiles them into the ScoringEngine and re-exports them.
+'''
+from collections import namedtuple
+
+# INSTRUMENT SPECIFICATIONS
+# Each measure in the Outcome Measures battery is described once, as data. A Subscale lists the items it is built
+# from and whether they are summed or averaged. A Subscale whose items are the names of other subscales is a
+# composite (e.g. the overall DTS score is the average of the four DTS subscale scores). Reverse-keyed items are
+# flipped within item_range (low + high - response) before aggregation.
+#
+# max_missing is the fraction of a subscale's items that may be missing (or out of range) with the subscale still
+# scored: sums are prorated to the full item count and means are taken over the answered items. A subscale missing
+# more items than that, or a composite missing any of its subscales, is null. 0 means no proration.
+#
+# higher_is_better gives the direction of improvement for every subscale of the instrument.
+Subscale = namedtuple('Subscale', ['name', 'items', 'method'])
+Instrument = namedtuple('Instrument', ['name', 'items', 'reverse_keyed', 'item_range', 'subscales', 'max_missing',
+                                       'higher_is_better'], defaults=[0.0, False])
+
+def _items(prefix, *numbers):
+    return [f'{prefix}_{number}' for number in numbers]
+
+INSTRUMENTS = {
+    'ders': Instrument(
+        name='ders',
+        items=_items('ders', *range(1, 17)),
+        reverse_keyed=[],
+        item_range=(1, 5),
+        subscales=[
+            Subscale('ders_overall', _items('ders', *range(1, 17)), 'sum'),
+            Subscale('ders_clarity', _items('ders', 1, 2), 'sum'),
+            Subscale('ders_goals', _items('ders', 3, 7, 15), 'sum'),
+            Subscale('ders_impulse', _items('ders', 4, 8, 11), 'sum'),
+            Subscale('ders_strategies', _items('ders', 5, 6, 12, 14, 16), 'sum'),
+            Subscale('ders_nonacceptance', _items('ders', 9, 10, 13), 'sum'),
+        ],
+        max_missing=0.2),
+    'ari': Instrument(
+        name='ari',
+        items=_items('ari', *range(1, 8)),
+        reverse_keyed=[],
+        item_range=(0, 2),
+        subscales=[
+            Subscale('ari', _items('ari', *range(1, 7)), 'sum'),
+        ]),
+    'dts': Instrument(
+        name='dts',
+        items=_items('dts', *range(1, 16)),
+        reverse_keyed=['dts_6'],
+        item_range=(1, 5),
+        subscales=[
+            Subscale('dts_overall', ['dts_tolerance', 'dts_appraisal', 'dts_absorption', 'dts_regulation'], 'mean'),
+            Subscale('dts_tolerance', _items('dts', 1, 3, 5), 'mean'),
+            Subscale('dts_appraisal', _items('dts', 6, 7, 9, 10, 11, 12), 'mean'),
+            Subscale('dts_absorption', _items('dts', 2, 4, 15), 'mean'),
+            Subscale('dts_regulation', _items('dts', 8, 13, 14), 'mean'),
+        ],
+        max_missing=0.2,
+        higher_is_better=True),
+    'ceas': Instrument(
+        name='ceas',
+        items=_items('ceas_self', *range(1, 14)) + _items('ceas_from', *range(1, 14)) + _items('ceas_to', *range(1, 14)),
+        reverse_keyed=[],
+        item_range=(1, 10),
+        subscales=[
+            Subscale('ceas_self', _items('ceas_self', 1, 2, 4, 5, 6, 8, 9, 10, 12, 13), 'sum'),
+            Subscale('ceas_to', _items('ceas_to', 1, 2, 4, 5, 6, 8, 9, 10, 12, 13), 'sum'),
+            Subscale('ceas_from', _items('ceas_from', 1, 2, 4, 5, 6, 8, 9, 10, 12, 13), 'sum'),
+        ],
+        max_missing=0.2,
+        higher_is_better=True),
+    'camm': Instrument(
+        name='camm',
+        items=_items('camm', *range(1, 11)),
+        reverse_keyed=[],
+        item_range=(0, 4),
+        subscales=[
+            Subscale('camm', _items('camm', *range(1, 11)), 'sum'),
+        ],
+        max_missing=0.2,
+        higher_is_better=False),  # Items are summed as answered (not reversed), so a higher total is less mindful
+}
@@ -0,0 +1,132 @@
+'''
+### PURPOSE: ####
+Longitudinal change per client episode, built on the scored frame from generate_scores: did the client improve
+between their first and most recent assessment?
+
+For every subscale and every episode (or every client, when no episode information is available) the report holds:
+    - <subscale>_baseline and <subscale>_latest: the first and most recent valid scores
+    - <subscale>_change: latest minus baseline (null with fewer than two valid scores)
+    - <subscale>_rci: the Jacobson-Truax reliable change index, change / (SD * sqrt(2 * (1 - reliability))), where SD
+      is the standard deviation of the baseline scores and reliability is Cronbach's alpha for the subscale
+    - <subscale>_status: IMPROVED or DETERIORATED when the RCI passes the critical value in the direction the
+      instrument counts as better (its higher_is_better spec), NO_RELIABLE_CHANGE otherwise, INSUFFICIENT_DATA
+      when there is no change to test
+along with n_assessments, baseline_date, latest_date and days_in_treatment (from admission when the episode's
+admission date is known, from the first assessment otherwise).
+
+Everything is one sort followed by grouped first/last/count aggregations; there are no per-client Python loops.
+
+#### USAGE: ####
+    cleaned = clean_data('Outcome Measures.xlsx')
+    report = longitudinal_report(cleaned, clean_avatar_report('admissions.xls'))
+'''
+import numpy as np
+import pandas as pd
+
+from measure_tools import INSTRUMENTS, SCORING_ENGINE, score_frame
+from match_tools import EpisodeIndex
+from metrics_tools import stage
+
+IMPROVED = 'improved'
+DETERIORATED = 'deteriorated'
+NO_RELIABLE_CHANGE = 'no_reliable_change'
+INSUFFICIENT_DATA = 'insufficient_data'
+
+RCI_CRITICAL = 1.96  # Two-tailed p < .05
+
+def subscale_items(instruments=None):
+    '''
+    Returns {subscale: item columns}, with composites expanded to the items of the subscales they combine.
+    '''
+    scales = [scale for instrument in (instruments or INSTRUMENTS).values() for scale in instrument.subscales]
+    direct = {scale.name: scale.items for scale in scales}
+    return {scale.name: [item for part in scale.items for item in direct.get(part, [part])] for scale in scales}
+
+def higher_is_better(instruments=None):
+    '''
+    Returns {subscale: True if a higher score means improvement}.
+    '''
+    return {scale.name: instrument.higher_is_better
+            for instrument in (instruments or INSTRUMENTS).values() for scale in instrument.subscales}
+
+def cronbach_alpha(cleaned, instruments=None):
+    '''
+    Cronbach's alpha for every subscale, estimated from a cleaned frame's item responses. Reverse-keyed items are
+    flipped and out-of-range responses ignored; each subscale uses the rows that answered all of its items.
+    '''
+    instruments = instruments or INSTRUMENTS
+    columns = [item for instrument in instruments.values() for item in instrument.items]
+    values = cleaned.loc[:, columns].to_numpy(dtype='float64', na_value=np.nan)
+    low = np.array([instrument.item_range[0] for instrument in instruments.values() for _ in instrument.items])
+    high = np.array([instrument.item_range[1] for instrument in instruments.values() for _ in instrument.items])
+    values[(values < low) | (values > high)] = np.nan
+    position = {item: index for index, item in enumerate(columns)}
+    for instrument in instruments.values():
+        for item in instrument.reverse_keyed:
+            values[:, position[item]] = sum(instrument.item_range) - values[:, position[item]]
+
+    alphas = {}
+    for scale, items in subscale_items(instruments).items():
+        block = values[:, [position[item] for item in items]]
+        block = block[~np.isnan(block).any(axis=1)]
+        k = block.shape[1]
+        total_variance = block.sum(axis=1).var(ddof=1) if len(block) > 1 else np.nan
+        if k < 2 or not total_variance:
+            alphas[scale] = np.nan
+            continue
+        alphas[scale] = k / (k - 1) * (1 - block.var(axis=0, ddof=1).sum() / total_variance)
+    return pd.Series(alphas, name='alpha')
+
+def change_report(scores, reliability, avatar_df=None, baseline_sd=None, critical=RCI_CRITICAL):
+    '''
+    Builds the per-episode change report from a scored frame (generate_scores output, or any frame with name,
+    assess_date and subscale columns). `reliability` maps subscale to reliability coefficient (e.g. the output of
+    cronbach_alpha). Episodes come from the frame's own epn column if it has one, otherwise from matching against
+    `avatar_df` when given; without either, each client's whole history is treated as one episode. `baseline_sd`
+    optionally maps subscale to a normative SD to use instead of the sample's baseline SD.
+    '''
+    scale_columns = [column for column in SCORING_ENGINE.score_columns if column in scores.columns]
+    with stage('longitudinal', rows_in=len(scores)) as record:
+        if 'epn' not in scores.columns and avatar_df is not None:
+            scores = EpisodeIndex(avatar_df).match(scores)
+        keys = ['name', 'epn'] if 'epn' in scores.columns else ['name']
+
+        ordered = scores.sort_values(by=keys + ['assess_date'], kind='mergesort')
+        groups = ordered.groupby(keys, sort=False, observed=True, dropna=False)
+        baseline = groups[scale_columns].first()  # First and last VALID score for each subscale
+        latest = groups[scale_columns].last()
+        valid = groups[scale_columns].count()
+        change = (latest - baseline).where(valid >= 2)
+
+        sd = baseline.std(ddof=1) if baseline_sd is None else pd.Series(baseline_sd).reindex(scale_columns)
+        reliability = pd.Series(reliability).reindex(scale_columns)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rci = change / (sd * np.sqrt(2 * (1 - reliability)))
+        direction = pd.Series(higher_is_better()).reindex(scale_columns).map({True: 1.0, False: -1.0})
+        improvement = (rci * direction).to_numpy()
+        status = np.select([np.isnan(improvement), improvement >= critical, improvement <= -critical],
+                           [INSUFFICIENT_DATA, IMPROVED, DETERIORATED], NO_RELIABLE_CHANGE)
+        status = pd.DataFrame(status, index=rci.index, columns=scale_columns)
+
+        report = pd.DataFrame({
+            'n_assessments': groups.size(),
+            'baseline_date': groups['assess_date'].min(),
+            'latest_date': groups['assess_date'].max(),
+        })
+        started = groups['adm_date'].first().fillna(report['baseline_date']) if 'adm_date' in ordered.columns \
+            else report['baseline_date']
+        report['days_in_treatment'] = (report['latest_date'] - started).dt.days
+
+        parts = {'baseline': baseline, 'latest': latest, 'change': change, 'rci': rci, 'status': status}
+        columns = {f'{scale}_{part}': frame[scale] for scale in scale_columns for part, frame in parts.items()}
+        report = pd.concat([report, pd.DataFrame(columns, index=report.index)], axis=1).reset_index()
+        record.rows_out = len(report)
+    return report
+
+def longitudinal_report(cleaned, avatar_df=None, baseline_sd=None, critical=RCI_CRITICAL):
+    '''
+    Scores a cleaned frame (clean_data output), estimates each subscale's reliability from it and returns the
+    per-episode change report.
+    '''
+    return change_report(score_frame(cleaned), cronbach_alpha(cleaned), avatar_df=avatar_df,
+                         baseline_sd=baseline_sd, critical=critical)
@@ -0,0 +1,283 @@
+'''
+### PURPOSE: ####
+Resolves each Survey Monkey assessment to the Avatar episode that was open on its assessment date.
+
+Episodes from clean_avatar_report are sorted once by (client name, admission date) into a flat interval index. Each
+assessment is then located with a single binary search for the latest admission on or before its assessment date,
+so matching n assessments against m episodes costs O(n log m) and never builds the name-level cartesian product a
+merge-then-filter does.
+
+#### MATCH OUTCOMES: ####
+    - MATCHED: the name exists in Avatar and one of its episodes covers the assessment date
+    - NO_EPISODE: the name exists in Avatar but none of its episodes covers the assessment date
+    - NO_NAME: the name does not appear in the Avatar report at all (most likely misspelled in Survey Monkey)
+    - FUZZY_MATCHED: a NO_NAME row that NameIndex.resolve confidently matched to a similarly spelled Avatar name
+'''
+import numpy as np
+import pandas as pd
+from difflib import SequenceMatcher
+
+MATCHED = 'matched'
+NO_EPISODE = 'no_episode'
+NO_NAME = 'no_name'
+
+_DAY_OFFSET = 2 ** 31  # Shifts day numbers positive so they can be packed under the name code
+_OPEN = np.iinfo(np.int64).max
+
+def _days(dates, missing):
+    days = pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[D]')
+    values = days.astype(np.int64)
+    return np.where(np.isnat(days), missing, values)
+
+def _name_codes(names, values):
+    # Categorical names are looked up once per category rather than once per row
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        by_category = names.get_indexer(values.cat.categories).astype(np.int64)
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, by_category[codes], -1)
+    return names.get_indexer(values).astype(np.int64)
+
+class EpisodeIndex:
+    def __init__(self, avatar_df):
+        '''
+        Builds the interval index from a cleaned Avatar report (the output of clean_avatar_report). Episodes with no
+        discharge date are treated as still open.
+        '''
+        self.episodes = avatar_df.reset_index(drop=True)
+        self.names = pd.Index(pd.unique(self.episodes['name'].to_numpy(dtype=object)))
+        codes = _name_codes(self.names, self.episodes['name'])
+        admitted = _days(self.episodes['adm_date'], missing=_DAY_OFFSET - 1)  # Never on or before a real date
+        discharged = _days(self.episodes['disc_date'], missing=_OPEN)
+
+        order = np.lexsort((admitted, codes))
+        self.rows = order
+        self.codes = codes[order]
+        self.admitted = admitted[order]
+        self.discharged = discharged[order]
+        self.keys = (self.codes << 32) | (self.admitted + _DAY_OFFSET)
+        # Latest discharge among each name's episodes up to and including this one, used to detect nested episodes
+        self.reach = pd.Series(self.discharged).groupby(self.codes).cummax().to_numpy()
+
+    def lookup(self, names, assess_dates):
+        '''
+        Returns two arrays aligned with the inputs: the row position in self.episodes of the covering episode (-1
+        when there is none) and the match outcome.
+        '''
+        codes = _name_codes(self.names, names)
+        days = _days(assess_dates, missing=-_DAY_OFFSET)
+        keys = (codes << 32) | (days + _DAY_OFFSET)
+
+        candidate = np.searchsorted(self.keys, keys, side='right') - 1
+        safe = candidate.clip(0)
+        same_name = (codes >= 0) & (candidate >= 0) & (self.codes[safe] == codes) & (days > -_DAY_OFFSET)
+        covered = same_name & (self.discharged[safe] >= days)
+
+        # Rare case: a later admission did not cover the date but an earlier, longer episode for the same name does
+        for position in np.flatnonzero(same_name & ~covered & (self.reach[safe] >= days)):
+            scan = candidate[position]
+            while scan >= 0 and self.codes[scan] == codes[position]:
+                if self.discharged[scan] >= days[position]:
+                    candidate[position] = scan
+                    covered[position] = True
+                    break
+                scan -= 1
+
+        positions = np.where(covered, self.rows[candidate.clip(0)], -1)
+        outcome = np.where(codes < 0, NO_NAME, np.where(covered, MATCHED, NO_EPISODE))
+        return positions, outcome
+
+    def match(self, assessments, status_column='match_status'):
+        '''
+        Returns `assessments` with the covering episode's columns (pid, adm_date, disc_date, epn, program)
+        appended and a status column holding the match outcome. Every assessment appears exactly once; episode
+        columns are null where there is no covering episode.
+        '''
+        positions, outcome = self.lookup(assessments['name'], assessments['assess_date'])
+        episode_columns = [column for column in self.episodes.columns if column != 'name']
+        episodes = self.episodes[episode_columns].reindex(positions)
+        episodes.index = assessments.index
+
+        matched = pd.concat([assessments, episodes], axis=1)
+        matched[status_column] = outcome
+        return matched
+
+FUZZY_MATCHED = 'fuzzy_matched'
+
+_SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for letter in letters}
+
+def normalize_name(name):
+    '''
+    Lower-cases a "Last,First" name and strips everything but letters and the comma separating the two parts.
+    '''
+    return ''.join(character for character in str(name).lower() if character.isalpha() or character == ',')
+
+def soundex(word):
+    '''
+    American Soundex code for `word` (e.g. "Robert" and "Rupert" both give "r163"); empty for an empty word.
+    '''
+    letters = [character for character in word.lower() if character in _SOUNDEX_CODES]
+    if not letters:
+        return ''
+    code = letters[0]
+    previous = _SOUNDEX_CODES[letters[0]]
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES[letter]
+        if digit != '0' and digit != previous:
+            code += digit
+        if letter not in 'hw':  # H and W do not separate letters sharing a code
+            previous = digit
+    return (code + '000')[:4]
+
+def _trigrams(normalized):
+    padded = f'  {normalized} '
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+def _swap(normalized):
+    last, _, first = normalized.partition(',')
+    return f'{first},{last}'
+
+class NameIndex:
+    '''
+    Candidate index over the client names in a cleaned Avatar report, used to suggest the intended client for
+    Survey Monkey names that have no exact match. Names are blocked two ways so only a handful are ever scored per
+    query instead of every Avatar name:
+        - spelling: character trigrams of the full normalized name
+        - phonetic: the Soundex code of the last name and of the first name. A common code can cover hundreds of
+          names, so only the max_phonetic of them sharing the most trigrams with the query are kept
+    Candidates are scored with difflib's similarity ratio (also against the query with first and last name swapped)
+    and, by default, kept only if one of their episodes covers the assessment date. Scores are computed once per
+    normalized name, however many assessments carry it.
+    '''
+    def __init__(self, avatar_df, episode_index=None, min_shared_trigrams=3, max_candidates=20, max_phonetic=10):
+        self.episode_index = episode_index or EpisodeIndex(avatar_df)
+        self.names = list(self.episode_index.names)
+        self.normalized = [normalize_name(name) for name in self.names]
+        self.min_shared_trigrams = min_shared_trigrams
+        self.max_candidates = max_candidates
+        self.max_phonetic = max_phonetic
+        self._scored = {}  # (normalized name, min_score) -> [(score, position)], best first
+        self._matchers = {}  # Position -> SequenceMatcher holding that Avatar name
+
+        self.phonetic_postings = {}
+        self.trigram_postings = {}
+        for position, normalized in enumerate(self.normalized):
+            for part in normalized.split(','):
+                self.phonetic_postings.setdefault(soundex(part), []).append(position)
+            for gram in _trigrams(normalized):
+                self.trigram_postings.setdefault(gram, []).append(position)
+        self.trigram_postings = {gram: np.array(positions, dtype=np.intp) for gram, positions in self.trigram_postings.items()}
+
+    def candidates(self, name):
+        '''
+        Returns the positions of Avatar names sharing enough trigrams or a phonetic key with `name`.
+        '''
+        normalized = normalize_name(name)
+        postings = [self.trigram_postings[gram] for gram in _trigrams(normalized) if gram in self.trigram_postings]
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.names)) if postings else \
+            np.zeros(len(self.names), dtype=np.int64)
+        order = np.lexsort((np.arange(len(shared)), -shared))  # Most shared trigrams first
+        blocked = order[shared[order] >= self.min_shared_trigrams][:self.max_candidates]
+
+        phonetic = set()
+        for part in normalized.split(','):
+            phonetic.update(self.phonetic_postings.get(soundex(part), ()))
+        phonetic = sorted(phonetic.difference(blocked.tolist()), key=lambda position: (-shared[position], position))
+        return set(blocked.tolist()) | set(phonetic[:self.max_phonetic])
+
+    def _matcher(self, position):
+        matcher = self._matchers.get(position)
+        if matcher is None:
+            # difflib indexes the second sequence, so each Avatar name is indexed once and reused across queries
+            matcher = self._matchers[position] = SequenceMatcher(None, '', self.normalized[position])
+        return matcher
+
+    def score(self, name, position, min_score=0.0):
+        '''
+        Similarity of `name` to the Avatar name at `position`, in either name order. Returns 0 without running the
+        full comparison when quick_ratio (an upper bound on the similarity) shows it is below `min_score`.
+        '''
+        normalized = normalize_name(name)
+        matcher = self._matcher(position)
+        best = 0.0
+        for query in (normalized, _swap(normalized)):
+            matcher.set_seq1(query)
+            bound = matcher.quick_ratio()
+            if bound > best and bound >= min_score:
+                best = max(best, matcher.ratio())
+        return best
+
+    def scored(self, name, min_score=0.0):
+        '''
+        Returns the candidates for `name` scoring at least `min_score` as (score, position), best first.
+        '''
+        key = (normalize_name(name), min_score)
+        if key not in self._scored:
+            scores = ((self.score(key[0], position, min_score), position) for position in self.candidates(key[0]))
+            self._scored[key] = sorted(((score, position) for score, position in scores
+                                        if score >= min_score and score > 0), reverse=True)
+        return self._scored[key]
+
+    def suggest(self, assessments, k=3, min_score=0.6, require_episode=True):
+        '''
+        Returns up to `k` scored candidates for every row of `assessments` (columns: row, rank, suggested_name, pid,
+        epn, adm_date, disc_date, score). `row` is the assessment's index label.
+        '''
+        columns = ['row', 'rank', 'suggested_name', 'pid', 'epn', 'adm_date', 'disc_date', 'score']
+        sequence, rows, candidate_names, dates, scores = [], [], [], [], []
+        for number, (row, name, assess_date) in enumerate(
+                zip(assessments.index, assessments['name'], assessments['assess_date'])):
+            for score, position in self.scored(name, min_score):
+                sequence.append(number)
+                rows.append(row)
+                candidate_names.append(self.names[position])
+                dates.append(assess_date)
+                scores.append(score)
+        if not sequence:
+            return pd.DataFrame(columns=columns)
+
+        # Every candidate of every row is checked against its assessment date in a single lookup
+        episodes, outcome = self.episode_index.lookup(candidate_names, dates)
+        keep = outcome == MATCHED if require_episode else np.ones(len(episodes), dtype=bool)
+        sequence = np.asarray(sequence)[keep]
+        rank = pd.Series(sequence).groupby(sequence).cumcount().to_numpy() + 1
+        keep = np.flatnonzero(keep)[rank <= k]
+        rank = rank[rank <= k]
+
+        suggestions = pd.DataFrame({'row': pd.Series(rows, dtype=object).iloc[keep].to_numpy(), 'rank': rank,
+                                    'suggested_name': np.asarray(candidate_names, dtype=object)[keep]})
+        details = self.episode_index.episodes[['pid', 'epn', 'adm_date', 'disc_date']].reindex(episodes[keep])
+        suggestions = pd.concat([suggestions, details.reset_index(drop=True)], axis=1)
+        suggestions['score'] = np.asarray(scores)[keep]
+        return suggestions[columns]
+
+    def resolve(self, matched, min_score=0.9, margin=0.05, status_column='match_status'):
+        '''
+        Takes the output of EpisodeIndex.match and fills in the episode for NO_NAME rows whose best candidate scores at
+        least `min_score` and beats the runner-up by `margin`; those rows get the FUZZY_MATCHED status. The best
+        candidate and its score are recorded on every NO_NAME row (suggested_name, suggestion_score) for review.
+        '''
+        matched = matched.copy()
+        matched['suggested_name'] = None
+        matched['suggestion_score'] = np.nan
+        unmatched = matched.loc[matched[status_column] == NO_NAME]
+        if unmatched.empty:
+            return matched
+
+        suggestions = self.suggest(unmatched, k=2)
+        if suggestions.empty:
+            return matched
+        best = suggestions.loc[suggestions['rank'] == 1].set_index('row')
+        runner_up = suggestions.loc[suggestions['rank'] == 2].set_index('row')['score'].reindex(best.index, fill_value=0)
+
+        matched.loc[best.index, 'suggested_name'] = best['suggested_name']
+        matched.loc[best.index, 'suggestion_score'] = best['score']
+        resolved = best.loc[(best['score'] >= min_score) & (best['score'] - runner_up >= margin)].index
+        episode_columns = [column for column in self.episode_index.episodes.columns if column != 'name']
+        positions, _ = self.episode_index.lookup(best.loc[resolved, 'suggested_name'], matched.loc[resolved, 'assess_date'])
+        episodes = self.episode_index.episodes.iloc[positions]
+        for column in episode_columns:
+            matched.loc[resolved, column] = episodes[column].array
+        matched.loc[resolved, status_column] = FUZZY_MATCHED
+        return matched
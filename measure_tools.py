@@ -1,71 +1,319 @@
 import os
+import csv
+import heapq
+import itertools
+import tempfile
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from instrument_specs import Subscale, Instrument, INSTRUMENTS
+from metrics_tools import stage
+
+# Survey Monkey export layout: PII/metadata columns dropped on import and the names given to the remaining columns
+DROPPED_COLUMNS = [
+    'Respondent ID', 'Collector ID', 'End Date', 
+    'IP Address', 'Email Address', 'First Name', 'Last Name', 'Custom Data 1', 
+    'Program']
+
+EXPORT_COLUMNS = [
+    'first_name', 'last_name', 'assess_date', 'cottage', 
+    'ders_1', 'ders_2', 'ders_3','ders_4','ders_5','ders_6','ders_7','ders_8','ders_9','ders_10','ders_11','ders_12','ders_13','ders_14','ders_15','ders_16',
+    'ari_1', 'ari_2', 'ari_3', 'ari_4', 'ari_5', 'ari_6', 'ari_7',
+    'dts_1', 'dts_2', 'dts_3', 'dts_4', 'dts_5', 'dts_6', 'dts_7', 'dts_8', 'dts_9', 'dts_10', 'dts_11', 'dts_12', 'dts_13', 'dts_14', 'dts_15',
+    'ceas_self_1', 'ceas_self_2', 'ceas_self_3', 'ceas_self_4', 'ceas_self_5', 'ceas_self_6', 'ceas_self_7', 'ceas_self_8', 'ceas_self_9', 'ceas_self_10', 'ceas_self_11', 'ceas_self_12', 'ceas_self_13',
+    'ceas_from_1', 'ceas_from_2', 'ceas_from_3', 'ceas_from_4', 'ceas_from_5', 'ceas_from_6', 'ceas_from_7', 'ceas_from_8', 'ceas_from_9', 'ceas_from_10', 'ceas_from_11', 'ceas_from_12', 'ceas_from_13',
+    'ceas_to_1', 'ceas_to_2', 'ceas_to_3', 'ceas_to_4', 'ceas_to_5', 'ceas_to_6', 'ceas_to_7', 'ceas_to_8', 'ceas_to_9', 'ceas_to_10', 'ceas_to_11', 'ceas_to_12', 'ceas_to_13',
+    'camm_1', 'camm_2', 'camm_3', 'camm_4', 'camm_5', 'camm_6', 'camm_7', 'camm_8', 'camm_9', 'camm_10'
+]
+
+def file_extension(path):
+    '''
+    Lower-case extension of `path` without the dot ("csv", "xlsx", ...). Only the last suffix counts, so names with
+    several dots ("Outcome Measures 01.02.2024.xlsx") are read correctly.
+    '''
+    return os.path.splitext(path)[1].lower().lstrip('.')
+
+def read_export(import_file_location):
+    '''
+    Reads a raw Survey Monkey export (CSV or Excel) without any cleaning.
+    '''
+    extension = file_extension(import_file_location)
+
+    with stage('read_export') as record:
+        if extension == 'csv':
+            dataframe = pd.read_csv(import_file_location)
+        else:
+            dataframe = pd.read_excel(import_file_location)
+        record.rows_out = len(dataframe)
+    return dataframe
 
 def clean_data(import_file_location, dropna=True):
-    file_extension = os.path.basename(import_file_location).split('.')[1]
+    dataframe = read_export(import_file_location)
 
-    if file_extension == 'csv':
-        dataframe = pd.read_csv(import_file_location)
-    else:
-        dataframe = pd.read_excel(import_file_location)
+    with stage('clean_export', rows_in=len(dataframe)) as record:
+        dataframe = clean_export_frame(dataframe, dropna=dropna)
+        dataframe.reset_index(drop=True, inplace=True)
+        dataframe.sort_values(by=["name", "assess_date"], inplace=True)
+        record.rows_out = len(dataframe)
+    
+    return dataframe
 
-    dataframe.drop(labels=[
-        'Respondent ID', 'Collector ID', 'End Date', 
-        'IP Address', 'Email Address', 'First Name', 'Last Name', 'Custom Data 1', 
-        'Program'], axis=1, inplace=True)
-    dataframe.drop(0, inplace=True)
+def clean_export_frame(dataframe, dropna=True):
+    '''
+    Applies the Survey Monkey column cleanup (drop PII columns, rename, build "name", parse dates) to a raw export 
+    frame, or to any chunk of one. The extra question-text header row Survey Monkey adds sits at index label 0, so 
+    it is only dropped from the chunk that contains it.
+    '''
+    dataframe = dataframe.drop(labels=DROPPED_COLUMNS, axis=1)
+    dataframe.drop(0, inplace=True, errors='ignore')
     dataframe.iloc[:,3] = pd.to_datetime(dataframe.iloc[:,0]).dt.date
     dataframe.drop('Start Date', axis=1, inplace=True)
     
-    new_cols = [
-        'first_name', 'last_name', 'assess_date', 'cottage', 
-        'ders_1', 'ders_2', 'ders_3','ders_4','ders_5','ders_6','ders_7','ders_8','ders_9','ders_10','ders_11','ders_12','ders_13','ders_14','ders_15','ders_16',
-        'ari_1', 'ari_2', 'ari_3', 'ari_4', 'ari_5', 'ari_6', 'ari_7',
-        'dts_1', 'dts_2', 'dts_3', 'dts_4', 'dts_5', 'dts_6', 'dts_7', 'dts_8', 'dts_9', 'dts_10', 'dts_11', 'dts_12', 'dts_13', 'dts_14', 'dts_15',
-        'ceas_self_1', 'ceas_self_2', 'ceas_self_3', 'ceas_self_4', 'ceas_self_5', 'ceas_self_6', 'ceas_self_7', 'ceas_self_8', 'ceas_self_9', 'ceas_self_10', 'ceas_self_11', 'ceas_self_12', 'ceas_self_13',
-        'ceas_from_1', 'ceas_from_2', 'ceas_from_3', 'ceas_from_4', 'ceas_from_5', 'ceas_from_6', 'ceas_from_7', 'ceas_from_8', 'ceas_from_9', 'ceas_from_10', 'ceas_from_11', 'ceas_from_12', 'ceas_from_13',
-        'ceas_to_1', 'ceas_to_2', 'ceas_to_3', 'ceas_to_4', 'ceas_to_5', 'ceas_to_6', 'ceas_to_7', 'ceas_to_8', 'ceas_to_9', 'ceas_to_10', 'ceas_to_11', 'ceas_to_12', 'ceas_to_13',
-        'camm_1', 'camm_2', 'camm_3', 'camm_4', 'camm_5', 'camm_6', 'camm_7', 'camm_8', 'camm_9', 'camm_10'
-    ]
-    
-    dataframe.columns = new_cols
+    dataframe.columns = EXPORT_COLUMNS
     dataframe.insert(loc=1, column='name', value=dataframe['last_name'].str.strip(' ') + ',' + dataframe['first_name'].str.strip(' '))
-    dataframe.drop(['first_name', 'last_name', 'cottage'], axis=1, inplace=True)
+    dataframe.drop(['first_name', 'last_name'], axis=1, inplace=True)  # cottage is kept for the rollups (rollup_tools)
 
+    # Item gaps are left for validation to handle per instrument; only rows that can't be identified, or that hold no
+    # responses at all, are dropped
     if dropna:
-        dataframe.dropna(how='any', inplace=True)
+        dataframe.dropna(subset=['name', 'assess_date'], inplace=True)
+        dataframe = dataframe.loc[dataframe.loc[:, "ders_1":].notna().any(axis=1)]
 
-    dataframe['assess_date'] = pd.to_datetime(dataframe['assess_date'])
-    dataframe.loc[:, "ders_1":] = dataframe.loc[:, "ders_1":].astype('float64')
-    dataframe.reset_index(drop=True, inplace=True)
-    dataframe.sort_values(by=["name", "assess_date"], inplace=True)
-    
-    return dataframe
+    dataframe['assess_date'] = pd.to_datetime(dataframe['assess_date']).dt.normalize()
+    dataframe['name'] = dataframe['name'].astype('category')
+    dataframe['cottage'] = dataframe['cottage'].astype('category')
+
+    return compact_items(dataframe)
+
+# COMPACT TYPES
+# Item responses are small whole numbers, so they are held as nullable unsigned 8-bit integers (1 byte per response
+# plus a mask) rather than float64. Client names, PIDs and programs are interned as categoricals or small integers.
+ITEM_DTYPE = 'UInt8'
+INVALID_RESPONSE = 255  # Stored in place of responses that aren't whole numbers from 0 to 254; outside every item_range
+
+def compact_items(dataframe, first_item='ders_1'):
+    '''
+    Converts every item column from `first_item` onward to ITEM_DTYPE with a single conversion of the item block.
+    Responses that are not whole numbers between 0 and 254 become INVALID_RESPONSE, which validation flags as out
+    of range, so a single bad cell never stops a batch.
+    '''
+    items = list(dataframe.columns[dataframe.columns.get_loc(first_item):])
+    values = dataframe[items].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    missing = dataframe[items].isna().to_numpy()
+    invalid = ~missing & ~((values == np.floor(values)) & (values >= 0) & (values < INVALID_RESPONSE))
+
+    responses = np.where(missing, 0, np.where(invalid, INVALID_RESPONSE, values))
+    responses = responses.astype(pd.api.types.pandas_dtype(ITEM_DTYPE).numpy_dtype)
+    compact = {column: pd.arrays.IntegerArray(responses[:, position], missing[:, position])
+               for position, column in enumerate(items)}
+    leading = {column: dataframe[column] for column in dataframe.columns[:dataframe.columns.get_loc(first_item)]}
+    return pd.DataFrame({**leading, **compact}, index=dataframe.index)
+
+def compact_ids(series, dtype):
+    '''
+    Converts an ID column to the nullable integer `dtype` when every value is numeric, and to a categorical otherwise.
+    '''
+    numeric = pd.to_numeric(series, errors='coerce')
+    if numeric.isna().sum() == series.isna().sum():
+        return numeric.astype(dtype)
+    return series.astype('category')
 
 def clean_avatar_report(avatar_report_path):
-    file_extension = os.path.basename(avatar_report_path).split('.')[1]
-    if file_extension == 'csv':
-        dataframe = pd.read_csv(avatar_report_path)
-    else:
-        dataframe = pd.read_excel(avatar_report_path)
+    extension = file_extension(avatar_report_path)
+    with stage('read_avatar_report') as record:
+        if extension == 'csv':
+            dataframe = pd.read_csv(avatar_report_path)
+        else:
+            dataframe = pd.read_excel(avatar_report_path)
+        record.rows_out = len(dataframe)
+
+    with stage('clean_avatar_report', rows_in=len(dataframe)) as record:
+        dataframe = _clean_avatar_frame(dataframe)
+        record.rows_out = len(dataframe)
+
+    return dataframe
+
+def _clean_avatar_frame(dataframe):
     # Import and initial cleaning
     dataframe.columns = dataframe.iloc[5]  # Resetting the columns headers to their correct values
     dataframe.drop([0,1,2,3,4,5], inplace=True)  # Getting rid of blank rows put in by Crystal Report formatting
     dataframe.dropna(axis=1, how="all", inplace=True)
     
     # Selecting only clients in residential/PHP program. 
-    dataframe = dataframe.loc[(dataframe['Program'] == 'Residential Program') | (dataframe['Program'] == 'PHP + Room and Board Program')]
+    dataframe = dataframe.loc[(dataframe['Program'] == 'Residential Program') | (dataframe['Program'] == 'PHP + Room and Board Program')].copy()
     
     dataframe.sort_values(by='Adm Date', ascending=False, inplace=True)
     dataframe = dataframe[["Client Name", "PID","Adm Date", "Disc. Date", "EP#", "Program"]]
-    dataframe["Adm Date"] = pd.to_datetime(dataframe["Adm Date"].dt.date)
-    dataframe["Disc. Date"].fillna(value=datetime.today(), inplace=True)
-    dataframe["Disc. Date"] = pd.to_datetime(dataframe["Disc. Date"].dt.date)
+    # The header row read in with the data leaves these columns as object dtype, so they are parsed before truncating
+    dataframe["Adm Date"] = pd.to_datetime(dataframe["Adm Date"]).dt.normalize()
+    dataframe["Disc. Date"] = pd.to_datetime(dataframe["Disc. Date"]).dt.normalize()  # Open episodes stay NaT (still open)
     dataframe.columns = ["name", "pid", "adm_date", "disc_date", "epn", "program"]
+    dataframe["name"] = dataframe["name"].astype("category")
+    dataframe["pid"] = compact_ids(dataframe["pid"], "UInt32")
+    dataframe["epn"] = compact_ids(dataframe["epn"], "UInt16")
+    dataframe["program"] = dataframe["program"].astype("category")
 
     return dataframe
 
+# INSTRUMENT SPECIFICATIONS
+# Subscale, Instrument and INSTRUMENTS are defined in instrument_specs, which has no third-party imports, and are
+# re-exported from here.
+
+# VALIDATION FLAGS
+# Every scored row carries a "validity" bitmask with VALIDITY_BITS bits per instrument, in INSTRUMENTS order
+# (instrument i's flags are (validity >> VALIDITY_BITS * i) & VALIDITY_MASK). 0 means every item was answered in range.
+MISSING_ITEMS = 1   # At least one item was left blank
+OUT_OF_RANGE = 2    # At least one response fell outside item_range; it is scored as missing
+PRORATED = 4        # At least one subscale was scored from fewer than all of its items
+NOT_SCORED = 8      # At least one subscale had too many missing items and is null
+VALIDITY_BITS = 4
+VALIDITY_MASK = 2 ** VALIDITY_BITS - 1
+
+class ScoringEngine:
+    '''
+    Compiles a set of Instrument specs into an item-by-subscale weight matrix so every subscale is scored in a 
+    single pass: one matrix product over a contiguous array of item responses, plus a second (much smaller) 
+    product for composite subscales. Validation runs in the same pass: range checks against each item's 
+    item_range and per-subscale missing counts, reduced to per-instrument flags with two more small products.
+
+    Missing and out-of-range responses are handled per subscale following the instrument's max_missing: sums are
+    prorated to the full item count, means are taken over the answered items, and subscales missing too many items
+    are null.
+    '''
+    def __init__(self, instruments):
+        self.instruments = list(instruments)
+        self.item_columns = [item for instrument in self.instruments for item in instrument.items]
+        self.score_columns = [scale.name for instrument in self.instruments for scale in instrument.subscales]
+        position = {item: index for index, item in enumerate(self.item_columns)}
+
+        self.reverse_index = np.array(
+            [position[item] for instrument in self.instruments for item in instrument.reverse_keyed], dtype=np.intp)
+        self.reverse_offset = np.array(
+            [sum(instrument.item_range) for instrument in self.instruments for _ in instrument.reverse_keyed], dtype='float64')
+        self.low = np.array([instrument.item_range[0] for instrument in self.instruments for _ in instrument.items], dtype='float64')
+        self.high = np.array([instrument.item_range[1] for instrument in self.instruments for _ in instrument.items], dtype='float64')
+
+        scales = [(number, scale) for number, instrument in enumerate(self.instruments) for scale in instrument.subscales]
+        item_scales = [(number, scale) for number, scale in scales if all(item in position for item in scale.items)]
+        composites = [(number, scale) for number, scale in scales if (number, scale) not in item_scales]
+
+        self.weights = np.zeros((len(self.item_columns), len(item_scales)))
+        for column, (_, scale) in enumerate(item_scales):
+            self.weights[[position[item] for item in scale.items], column] = 1.0
+        self.mean_scales = np.array([scale.method == 'mean' for _, scale in item_scales])
+        self.scale_items = self.weights.sum(axis=0)
+        self.allowed_missing = np.array(
+            [np.floor(len(scale.items) * self.instruments[number].max_missing) for number, scale in item_scales])
+
+        scale_position = {scale.name: index for index, (_, scale) in enumerate(item_scales)}
+        self.composite_weights = np.zeros((len(item_scales), len(composites)))
+        for column, (_, scale) in enumerate(composites):
+            rows = [scale_position[name] for name in scale.items]
+            self.composite_weights[rows, column] = 1.0
+        self.composite_divisor = np.array(
+            [len(scale.items) if scale.method == 'mean' else 1 for _, scale in composites], dtype='float64')
+
+        # Membership matrices reducing item- and subscale-level checks to one flag per instrument
+        self.item_instruments = np.zeros((len(self.item_columns), len(self.instruments)))
+        self.item_instruments[np.arange(len(self.item_columns)),
+                              [number for number, instrument in enumerate(self.instruments) for _ in instrument.items]] = 1.0
+        self.scale_instruments = np.zeros((len(item_scales), len(self.instruments)))
+        self.scale_instruments[np.arange(len(item_scales)), [number for number, _ in item_scales]] = 1.0
+
+        computed = [scale.name for _, scale in item_scales] + [scale.name for _, scale in composites]
+        self.output_order = np.array([computed.index(name) for name in self.score_columns], dtype=np.intp)
+
+    def evaluate_items(self, items):
+        '''
+        Scores and validates a 2-D array of item responses laid out in self.item_columns order. Returns the scores 
+        (float64, one column per entry in self.score_columns) and the validation flags (uint8, one column per 
+        instrument). The input is never modified.
+        '''
+        items = np.asarray(items, dtype='float64')
+        blank = np.isnan(items)
+        answered = (items >= self.low) & (items <= self.high)
+        out_of_range = ~blank & ~answered
+        responses = np.where(answered, items, 0.0)
+        if self.reverse_index.size:
+            flipped = self.reverse_offset - responses[:, self.reverse_index]
+            responses[:, self.reverse_index] = np.where(answered[:, self.reverse_index], flipped, 0.0)
+
+        totals = responses @ self.weights
+        counts = answered.astype('float64') @ self.weights
+        missing = self.scale_items - counts
+        scored = missing <= self.allowed_missing
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Means are over the answered items; sums are prorated up to the full item count
+            divisor = np.where(self.mean_scales, counts, counts / self.scale_items)
+            totals = np.where(scored, totals / divisor, np.nan)
+
+        # A composite is null if any of its subscales is
+        composites = (np.nan_to_num(totals) @ self.composite_weights) / self.composite_divisor
+        composites[(~scored).astype('float64') @ self.composite_weights > 0] = np.nan
+        scores = np.concatenate([totals, composites], axis=1)[:, self.output_order]
+
+        flags = np.zeros((len(items), len(self.instruments)), dtype=np.uint8)
+        flags |= np.where(blank.astype('float64') @ self.item_instruments > 0, MISSING_ITEMS, 0).astype(np.uint8)
+        flags |= np.where(out_of_range.astype('float64') @ self.item_instruments > 0, OUT_OF_RANGE, 0).astype(np.uint8)
+        flags |= np.where((scored & (missing > 0)).astype('float64') @ self.scale_instruments > 0, PRORATED, 0).astype(np.uint8)
+        flags |= np.where((~scored).astype('float64') @ self.scale_instruments > 0, NOT_SCORED, 0).astype(np.uint8)
+        return scores, flags
+
+    def score_items(self, items):
+        '''
+        Scores a 2-D array of item responses laid out in self.item_columns order. 
+        Returns a float64 array with one column per entry in self.score_columns. The input is never modified.
+        '''
+        return self.evaluate_items(items)[0]
+
+    def score_frame(self, dataframe, validity_column=None):
+        '''
+        Scores every subscale for a cleaned DataFrame and returns them as a DataFrame sharing its index. With
+        `validity_column`, the packed validation bitmask is added as a column of that name.
+        '''
+        items = dataframe.loc[:, self.item_columns].to_numpy(dtype='float64', na_value=np.nan)
+        scores, flags = self.evaluate_items(items)
+        scores = pd.DataFrame(scores, index=dataframe.index, columns=self.score_columns)
+        if validity_column:
+            shifts = np.arange(len(self.instruments), dtype=np.uint32) * VALIDITY_BITS
+            scores[validity_column] = (flags.astype(np.uint32) << shifts).sum(axis=1, dtype=np.uint32)
+        return scores
+
+def validity_flags(validity, instruments=None):
+    '''
+    Unpacks a validity bitmask column into one flags column per instrument (named "<instrument>_flags").
+    '''
+    names = list(instruments or INSTRUMENTS)
+    validity = pd.Series(validity)
+    packed = validity.to_numpy(dtype=np.uint32)
+    return pd.DataFrame(
+        {f'{name}_flags': ((packed >> (VALIDITY_BITS * number)) & VALIDITY_MASK).astype(np.uint8)
+         for number, name in enumerate(names)}, index=validity.index)
+
+def mask_invalid_responses(dataframe, instruments=None):
+    '''
+    Returns a copy of a cleaned frame with every response outside its instrument's item_range (including
+    INVALID_RESPONSE, which stands in for text and other non-numeric answers) set to missing, as scoring treats them.
+    Used before item responses are written anywhere, e.g. the import files.
+    '''
+    dataframe = dataframe.copy()
+    for instrument in (instruments or INSTRUMENTS).values():
+        items = [item for item in instrument.items if item in dataframe.columns]
+        values = dataframe[items].to_numpy(dtype='float64', na_value=np.nan)
+        low, high = instrument.item_range
+        invalid = ~np.isnan(values) & ((values < low) | (values > high))
+        if invalid.any():
+            for position in np.flatnonzero(invalid.any(axis=0)):
+                dataframe[items[position]] = dataframe[items[position]].mask(invalid[:, position])
+    return dataframe
+
+SCORING_ENGINE = ScoringEngine(INSTRUMENTS.values())
+INSTRUMENT_ENGINES = {name: ScoringEngine([instrument]) for name, instrument in INSTRUMENTS.items()}
+
+def _score_instrument(name, dataframe):
+    scores = INSTRUMENT_ENGINES[name].score_frame(dataframe)
+    series = tuple(scores[column] for column in scores.columns)
+    return series if len(series) > 1 else series[0]
+
 def score_ders(dataframe):
     '''
     SCORING METHODOLOGY:
@@ -87,22 +335,7 @@ def score_ders(dataframe):
     Good score = LOWER
     Bad score = HIGHER
     '''
-    clarity = ["ders_1", "ders_2"] 
-    goals = ["ders_3", "ders_7", "ders_15"]
-    impulse = ["ders_4", "ders_8", "ders_11"]
-    strategies = ["ders_5", "ders_6", "ders_12", "ders_14", "ders_16"]
-    non_acceptance = ["ders_9", "ders_10", "ders_13"]
-
-    columns = [col for col in dataframe.columns if "ders" in col]
-    
-    overall = pd.Series(data=dataframe.loc[:, columns].sum(axis='columns'), name='ders_overall')
-    clarity_score = pd.Series(data=dataframe.loc[:, clarity].sum(axis='columns'), name='ders_clarity')
-    goals_score = pd.Series(data=dataframe.loc[:, goals].sum(axis='columns'), name='ders_goals')
-    impulse_score = pd.Series(data=dataframe.loc[:, impulse].sum(axis='columns'), name='ders_impulse')
-    strategies_score = pd.Series(data=dataframe.loc[:, strategies].sum(axis='columns'), name='ders_strategies')
-    non_acceptance_score = pd.Series(data=dataframe.loc[:, non_acceptance].sum(axis='columns'), name='ders_nonacceptance')
-    
-    return (overall, clarity_score, goals_score, impulse_score, strategies_score, non_acceptance_score)
+    return _score_instrument('ders', dataframe)
 
 def score_ari(dataframe):
     '''
@@ -114,10 +347,7 @@ def score_ari(dataframe):
     Good score = LOWER
     Bad score = HIGHER
     '''
-    
-    columns = [col for col in dataframe.columns if "ari" in col]
-    
-    return pd.Series(data=dataframe.loc[:, columns].iloc[:, :6].sum(axis='columns'), name='ari')
+    return _score_instrument('ari', dataframe)
 
 def score_dts(dataframe):
     '''
@@ -142,22 +372,7 @@ def score_dts(dataframe):
     
     * Question 6 is REVERSE scored.
     '''
-    
-    tolerance = ['dts_1', 'dts_3', 'dts_5']
-    appraisal = ['dts_6', 'dts_7', 'dts_9', 'dts_10', 'dts_11', 'dts_12']
-    absorption = ['dts_2', 'dts_4', 'dts_15']
-    regulation = ['dts_8', 'dts_13', 'dts_14']
-
-    # REVERSE SCORING QUESTION 6
-    dataframe["dts_6"].replace({1:5, 2:4, 4:2, 5:1}, inplace=True)
-
-    tolerance_score = pd.Series(data=dataframe.loc[:, tolerance].mean(axis='columns'), name="dts_tolerance")
-    appraisal_score = pd.Series(data=dataframe.loc[:, appraisal].mean(axis='columns'), name="dts_appraisal")
-    absorption_score = pd.Series(data=dataframe.loc[:, absorption].mean(axis='columns'), name="dts_absorption")
-    regulation_score = pd.Series(data=dataframe.loc[:, regulation].mean(axis='columns'), name="dts_regulation")
-    overall_score = pd.Series(data=(tolerance_score + appraisal_score + absorption_score + regulation_score) / 4, name="dts_overall")
-    
-    return (overall_score, tolerance_score, appraisal_score, absorption_score, regulation_score)
+    return _score_instrument('dts', dataframe)
 
 def score_ceas(dataframe):
     '''
@@ -174,23 +389,7 @@ def score_ceas(dataframe):
         Action = 4-40
         Component-level = 10-100    
     '''
-
-    ceas = dataframe.loc[:, [col for col in dataframe.columns if "ceas_" in col]]
-    
-    cols_to_drop = ['ceas_self_3', 'ceas_self_7', 'ceas_self_11',
-          'ceas_to_3', 'ceas_to_7', 'ceas_to_11', 
-          'ceas_from_3', 'ceas_from_7', 'ceas_from_11']
-    ceas.drop(labels=cols_to_drop, axis='columns', inplace=True)
-    
-    self_cols = [col for col in ceas.columns if "self" in col]
-    to_cols = [col for col in ceas.columns if "to" in col]
-    from_cols = [col for col in ceas.columns if "from" in col]
-    
-    ceas_self = pd.Series(data=ceas.loc[:, self_cols].sum(axis=1), name='ceas_self')
-    ceas_to = pd.Series(data=ceas.loc[:, to_cols].sum(axis=1), name='ceas_to')
-    ceas_from = pd.Series(data=ceas.loc[:, from_cols].sum(axis=1), name='ceas_from')
-    
-    return (ceas_self, ceas_to, ceas_from)
+    return _score_instrument('ceas', dataframe)
 
 def score_camm(dataframe):
     '''
@@ -202,9 +401,18 @@ def score_camm(dataframe):
     
     * All questions on the CAMM are reverse scored
     '''
-    columns = [col for col in dataframe.columns if "camm" in col]
-    
-    return pd.Series(data=dataframe.loc[:, columns].sum(axis='columns'), name='camm')
+    return _score_instrument('camm', dataframe)
+
+def score_frame(dataframe):
+    '''
+    Returns the identifying columns of a cleaned DataFrame alongside every subscale score, in input row order.
+    '''
+    # Scoring every subscale of every instrument in a single pass
+    scores = SCORING_ENGINE.score_frame(dataframe, validity_column='validity')
+
+    # Building scored DataFrame: every column ahead of the items (name, assess_date, cottage, ...) identifies the row
+    identifying = dataframe.columns[:dataframe.columns.get_loc(SCORING_ENGINE.item_columns[0])]
+    return pd.concat([dataframe.loc[:, identifying], scores], axis=1)
 
 def generate_scores(datasource):
     # Cleaning dataset to enable proper scoring in various functions
@@ -216,25 +424,111 @@ def generate_scores(datasource):
         print("Could not generate scores. Datasource was not directory or DataFrame object")
         return None
     
-    # Calculating scores and returning each as a Series object
-    ders_overall, clarity, goals, impulse, strategies, non_acceptance = score_ders(dataframe)
-    ari_series = score_ari(dataframe)
-    ceas_self, ceas_to, ceas_from = score_ceas(dataframe)
-    dts_overall, tolerance, appraisal, absorption, regulation = score_dts(dataframe)
-    camm_series = score_camm(dataframe)
-    
-    # Building scored DataFrame
-    dataframe = pd.concat(
-        [dataframe.loc[:,:"assess_date"],
-        ders_overall, clarity, goals, impulse, strategies, non_acceptance, 
-        ari_series, 
-        dts_overall, tolerance, appraisal, absorption, regulation, 
-        ceas_self, ceas_to, ceas_from, 
-        camm_series], 
-        axis=1)
-    
-    dataframe.sort_values(by=["name", "assess_date"], inplace=True)
+    with stage('generate_scores', rows_in=len(dataframe)) as record:
+        dataframe = score_frame(dataframe)
+        dataframe.sort_values(by=["name", "assess_date"], inplace=True)
+        record.rows_out = len(dataframe)
 
     return dataframe
 
+def read_export_chunks(import_file_location, chunksize=50000):
+    '''
+    Yields a raw Survey Monkey export as DataFrames of at most `chunksize` rows, with the row labels a one-shot 
+    read would have given them. CSV files are read with pandas' chunked reader and XLSX files are streamed through 
+    openpyxl's read-only mode, so neither is ever fully loaded. Any other format (e.g. legacy XLS) cannot be 
+    streamed and is read whole before being sliced.
+    '''
+    extension = file_extension(import_file_location)
+
+    if extension == 'csv':
+        yield from pd.read_csv(import_file_location, chunksize=chunksize)
+    elif extension == 'xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(import_file_location, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows)
+            start = 0
+            while True:
+                block = list(itertools.islice(rows, chunksize))
+                if not block:
+                    break
+                yield pd.DataFrame(block, columns=header, index=pd.RangeIndex(start, start + len(block)))
+                start += len(block)
+        finally:
+            workbook.close()
+    else:
+        dataframe = pd.read_excel(import_file_location)
+        for start in range(0, len(dataframe), chunksize):
+            yield dataframe.iloc[start:start + chunksize]
+
+def iter_clean_data(import_file_location, chunksize=50000, dropna=True):
+    '''
+    Chunked counterpart of clean_data: yields cleaned frames of at most `chunksize` rows. Chunks are NOT sorted 
+    against each other.
+    '''
+    for chunk in read_export_chunks(import_file_location, chunksize=chunksize):
+        yield clean_export_frame(chunk, dropna=dropna)
+
+def stream_scores(import_file_location, output_path, chunksize=50000, dropna=True, max_open_runs=64):
+    '''
+    Streaming counterpart of generate_scores for exports too large to load at once. Each chunk is cleaned, scored, 
+    sorted and written to a temporary run file as soon as it is read; the runs are then combined with an external 
+    k-way merge into a single CSV at `output_path`, sorted by name and assess_date. Peak memory is bounded by 
+    `chunksize` rather than by the size of the export.
+
+    Returns the number of scored rows written.
+    '''
+    columns = None
+    with tempfile.TemporaryDirectory(prefix='outcome_measures_') as run_directory:
+        run_paths = []
+        for chunk in iter_clean_data(import_file_location, chunksize=chunksize, dropna=dropna):
+            with stage('score_chunk', rows_in=len(chunk)) as record:
+                scored = score_frame(chunk)
+                scored.sort_values(by=["name", "assess_date"], inplace=True)
+                columns = list(scored.columns)
+                run_path = os.path.join(run_directory, f'run_{len(run_paths)}.csv')
+                scored.to_csv(run_path, index=False)
+                run_paths.append(run_path)
+                record.rows_out = len(scored)
+
+        if columns is None:
+            columns = ["name", "assess_date", "cottage"] + SCORING_ENGINE.score_columns + ["validity"]
+
+        # Merging in passes so no more than max_open_runs files are ever open at once
+        while len(run_paths) > max_open_runs:
+            merged_paths = []
+            for start in range(0, len(run_paths), max_open_runs):
+                merged_path = os.path.join(run_directory, f'merge_{len(run_paths)}_{start}.csv')
+                _merge_sorted_runs(run_paths[start:start + max_open_runs], merged_path, columns)
+                merged_paths.append(merged_path)
+            run_paths = merged_paths
+
+        with stage('merge_runs') as record:
+            rows_written = _merge_sorted_runs(run_paths, output_path, columns)
+            record.rows_out = rows_written
+        return rows_written
+
+def _merge_key(row):
+    # Same ordering as sort_values(by=["name", "assess_date"]): blanks (NaN/NaT) sort last within each key
+    return (row[0] == '', row[0], row[1] == '', row[1])
+
+def _merge_sorted_runs(run_paths, output_path, columns):
+    files = [open(run_path, newline='') for run_path in run_paths]
+    try:
+        readers = [csv.reader(run_file) for run_file in files]
+        for reader in readers:
+            next(reader)  # Skipping each run's header row
+        rows_written = 0
+        with open(output_path, 'w', newline='') as output_file:
+            writer = csv.writer(output_file, lineterminator='\n')
+            writer.writerow(columns)
+            for row in heapq.merge(*readers, key=_merge_key):
+                writer.writerow(row)
+                rows_written += 1
+        return rows_written
+    finally:
+        for run_file in files:
+            run_file.close()
+
 # TODO add if __name__ == "__main__": segment to trigger function cascade to complete import prep process
\ No newline at end of file
@@ -0,0 +1,156 @@
+'''
+### PURPOSE: ####
+Per-stage timing and memory instrumentation for the Outcome Measures pipeline.
+
+Pipeline code wraps each stage in a `stage(...)` block:
+
+    with metrics_tools.stage("clean_data", rows_in=len(raw)) as record:
+        cleaned = ...
+        record.rows_out = len(cleaned)
+
+While instrumentation is disabled (the default) `stage` hands back one shared do-nothing object, so an instrumented
+stage costs a function call and nothing more. Once `enable()` has been called, every stage records:
+    - wall time in seconds
+    - peak RSS delta: how much the process's peak resident memory grew during the stage (MB)
+    - rows in and rows out, when the stage reports them
+and `write()` saves them as one JSON metrics file for the run. One stage can also be chosen to run under cProfile,
+with the stats dumped next to the metrics file.
+
+Peak RSS comes from the standard library `resource` module, which is unavailable on Windows; memory fields are null
+there.
+'''
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class _NullStage:
+    '''
+    Stand-in returned by stage() while instrumentation is disabled. Accepts and ignores rows_out.
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    @property
+    def rows_out(self):
+        return None
+
+    @rows_out.setter
+    def rows_out(self, value):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+class _Stage:
+    def __init__(self, recorder, name, rows_in):
+        self.recorder = recorder
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.profiler = None
+
+    def __enter__(self):
+        self.started_at = datetime.now().isoformat(timespec='milliseconds')
+        self.peak_before = _peak_rss_mb()
+        if self.name == self.recorder.profile_stage:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.recorder.profile_path(self.name))
+        peak_after = _peak_rss_mb()
+        self.recorder.stages.append({
+            'stage': self.name,
+            'started_at': self.started_at,
+            'seconds': round(seconds, 6),
+            'peak_rss_mb': None if peak_after is None else round(peak_after, 2),
+            'peak_rss_delta_mb': None if peak_after is None else round(peak_after - self.peak_before, 2),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'thread': threading.current_thread().name,
+            'failed': exc_type is not None,
+        })
+        return False
+
+class Recorder:
+    def __init__(self, metrics_path=None, profile_stage=None, run_label=None):
+        self.metrics_path = metrics_path
+        self.profile_stage = profile_stage
+        self.run_label = run_label
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.stages = []
+
+    def stage(self, name, rows_in=None):
+        return _Stage(self, name, rows_in)
+
+    def profile_path(self, stage_name):
+        base = os.path.splitext(self.metrics_path)[0] if self.metrics_path else 'outcome_measures'
+        if os.path.dirname(base):
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+        return f'{base}.{stage_name}.prof'
+
+    def summary(self):
+        return {'run': self.run_label, 'started_at': self.started_at, 'pid': os.getpid(), 'stages': list(self.stages)}
+
+    def write(self, metrics_path=None):
+        metrics_path = metrics_path or self.metrics_path
+        directory = os.path.dirname(metrics_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(metrics_path, 'w') as metrics_file:
+            json.dump(self.summary(), metrics_file, indent=2)
+        return metrics_path
+
+_recorder = None
+
+def enable(metrics_path=None, profile_stage=None, run_label=None):
+    '''
+    Starts recording stages in this process and returns the Recorder. Replaces any recorder already active.
+    '''
+    global _recorder
+    _recorder = Recorder(metrics_path=metrics_path, profile_stage=profile_stage, run_label=run_label)
+    return _recorder
+
+def disable():
+    '''
+    Stops recording and returns the recorder that was active (or None).
+    '''
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+def active():
+    return _recorder
+
+def stage(name, rows_in=None):
+    '''
+    Context manager timing one pipeline stage. Free when instrumentation is disabled.
+    '''
+    if _recorder is None:
+        return _NULL_STAGE
+    return _recorder.stage(name, rows_in)
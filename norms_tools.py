@@ -0,0 +1,173 @@
+'''
+### PURPOSE: ####
+Norms for the scored subscales: places each new score against the historical population of its cohort as a
+percentile rank, without going back over the full history.
+
+For every cohort and subscale the table keeps the distinct historical scores in sorted order with how often each
+occurred. Subscale scores are sums or means of a handful of whole-number items, so they take few distinct values,
+and the table stays small however long the history gets while the percentiles remain exact. A percentile rank is then
+two binary searches per score (np.searchsorted over the whole column at once): the share of the cohort scoring below,
+plus half the share scoring the same. New batches are merged into the existing table, and two tables can be merged
+the same way. A batch id that has already been added is skipped, so re-running a batch never counts it twice.
+
+#### COHORTS: ####
+Cohorts are the distinct combinations of `cohort_columns`; the default is the Avatar program (so the scores need to
+have been matched to episodes). Survey Monkey exports carry no date of birth, so there is no age band to group on
+yet. Any column holding one (e.g. an "age_band" joined from Avatar) can be passed as a cohort column. Every score is
+also added to an ALL_COHORT population norm. Scores whose cohort has fewer than `min_size` scores on record are ranked
+against that population norm instead.
+
+#### USAGE: ####
+    norms = NormsTable.load('data_files/norms.npz') or NormsTable(cohort_columns=['program'])
+    norms.update(scored_history, batch_id='2024-Q1').save('data_files/norms.npz')
+    ranked = attach_percentiles(new_scores, norms)      # adds <subscale>_pct columns
+'''
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+
+from measure_tools import SCORING_ENGINE
+from metrics_tools import stage
+
+ALL_COHORT = 'all'
+UNKNOWN = 'unknown'
+DEFAULT_MIN_SIZE = 30
+
+def cohort_labels(scores, cohort_columns):
+    '''
+    Returns each row's cohort label: its cohort column values joined with " | " (UNKNOWN for a missing value).
+    '''
+    if not cohort_columns:
+        return np.full(len(scores), ALL_COHORT, dtype=object)
+    parts = [scores[column].astype(object).where(scores[column].notna(), UNKNOWN).astype(str) for column in cohort_columns]
+    labels = parts[0]
+    for part in parts[1:]:
+        labels = labels + ' | ' + part
+    return labels.to_numpy(dtype=object)
+
+class NormsTable:
+    def __init__(self, cohort_columns=('program',), subscales=None):
+        self.cohort_columns = list(cohort_columns)
+        self.subscales = list(subscales or SCORING_ENGINE.score_columns)
+        self.batches = []
+        self.tables = {}  # (cohort, subscale) -> (sorted distinct values, counts)
+        self._cumulative = {}
+
+    def update(self, scores, batch_id=None):
+        '''
+        Merges a scored frame into the table. Returns the table, unchanged if `batch_id` was added before.
+        '''
+        if batch_id is not None and str(batch_id) in self.batches:
+            return self
+        with stage('norms_update', rows_in=len(scores)):
+            labels = cohort_labels(scores, self.cohort_columns)
+            cohorts = [(ALL_COHORT, np.ones(len(scores), dtype=bool))]
+            cohorts += [(cohort, labels == cohort) for cohort in pd.unique(labels) if cohort != ALL_COHORT]
+            for subscale in self.subscales:
+                if subscale not in scores.columns:
+                    continue
+                column = scores[subscale].to_numpy(dtype='float64', na_value=np.nan)
+                for cohort, rows in cohorts:
+                    values = column[rows]
+                    new_values, new_counts = np.unique(values[~np.isnan(values)], return_counts=True)
+                    if len(new_values):
+                        self._merge(cohort, subscale, new_values, new_counts)
+            if batch_id is not None:
+                self.batches.append(str(batch_id))
+        return self
+
+    def merge(self, other):
+        '''
+        Adds the counts of another table with the same cohort columns (e.g. one built from a different site's
+        history) into this one. Returns this table.
+        '''
+        if other.cohort_columns != self.cohort_columns:
+            raise ValueError(f"Cannot merge norms by {other.cohort_columns} into norms by {self.cohort_columns}")
+        for (cohort, subscale), (values, counts) in other.tables.items():
+            self._merge(cohort, subscale, values, counts)
+        self.batches += [batch for batch in other.batches if batch not in self.batches]
+        return self
+
+    def _merge(self, cohort, subscale, new_values, new_counts):
+        values, counts = self.tables.get((cohort, subscale), (np.empty(0), np.empty(0, dtype=np.int64)))
+        merged, inverse = np.unique(np.concatenate([values, new_values]), return_inverse=True)
+        merged_counts = np.bincount(inverse, weights=np.concatenate([counts, new_counts]), minlength=len(merged))
+        self.tables[(cohort, subscale)] = (merged, merged_counts.astype(np.int64))
+        self._cumulative.pop((cohort, subscale), None)
+
+    def cohort_size(self, cohort, subscale):
+        return int(self.tables[(cohort, subscale)][1].sum()) if (cohort, subscale) in self.tables else 0
+
+    def _lookup(self, cohort, subscale, scores):
+        if (cohort, subscale) not in self._cumulative:
+            values, counts = self.tables[(cohort, subscale)]
+            self._cumulative[(cohort, subscale)] = (values, np.concatenate([[0], np.cumsum(counts)]))
+        values, cumulative = self._cumulative[(cohort, subscale)]
+        below = cumulative[np.searchsorted(values, scores, side='left')]
+        at_or_below = cumulative[np.searchsorted(values, scores, side='right')]
+        ranks = (below + 0.5 * (at_or_below - below)) / cumulative[-1] * 100
+        return np.where(np.isnan(scores), np.nan, ranks)
+
+    def percentiles(self, scores, min_size=DEFAULT_MIN_SIZE, suffix='_pct'):
+        '''
+        Returns percentile ranks (0-100) for every subscale in the table, as a frame aligned with `scores`. Rows
+        whose cohort has fewer than `min_size` scores on record for a subscale are ranked against ALL_COHORT.
+        '''
+        labels = cohort_labels(scores, self.cohort_columns)
+        codes, cohorts = pd.factorize(labels)
+        ranks = {}
+        with stage('norms_percentiles', rows_in=len(scores)):
+            for subscale in self.subscales:
+                if subscale not in scores.columns:
+                    continue
+                column = scores[subscale].to_numpy(dtype='float64', na_value=np.nan)
+                result = np.full(len(scores), np.nan)
+                for code, cohort in enumerate(cohorts):
+                    if self.cohort_size(cohort, subscale) < min_size:
+                        cohort = ALL_COHORT
+                    if (cohort, subscale) in self.tables:
+                        rows = codes == code
+                        result[rows] = self._lookup(cohort, subscale, column[rows])
+                ranks[subscale + suffix] = result
+        return pd.DataFrame(ranks, index=scores.index)
+
+    def save(self, path):
+        '''
+        Writes the table to a single .npz file, replacing any previous version atomically.
+        '''
+        keys = sorted(self.tables)
+        arrays = {}
+        for number, key in enumerate(keys):
+            arrays[f'values_{number}'], arrays[f'counts_{number}'] = self.tables[key]
+        meta = {'cohort_columns': self.cohort_columns, 'subscales': self.subscales, 'batches': self.batches,
+                'keys': [list(key) for key in keys]}
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        handle, staging = tempfile.mkstemp(prefix='.norms-', suffix='.npz', dir=directory)
+        os.close(handle)
+        np.savez(staging, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(staging, path)
+        return self
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Reads a table written by save(). Returns None if there is no file at `path` yet.
+        '''
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as stored:
+            meta = json.loads(str(stored['meta']))
+            norms = cls(meta['cohort_columns'], meta['subscales'])
+            norms.batches = meta['batches']
+            for number, key in enumerate(meta['keys']):
+                norms.tables[tuple(key)] = (stored[f'values_{number}'], stored[f'counts_{number}'])
+        return norms
+
+def attach_percentiles(scores, norms, min_size=DEFAULT_MIN_SIZE, suffix='_pct'):
+    '''
+    Returns `scores` with a percentile-rank column (<subscale><suffix>) after the subscale scores.
+    '''
+    return pd.concat([scores, norms.percentiles(scores, min_size=min_size, suffix=suffix)], axis=1)
@@ -0,0 +1,212 @@
+'''
+### PURPOSE: ####
+Cottage- and program-level score summaries by period, kept up to date as each batch is scored. History never has to
+be rescored or regrouped to produce them.
+
+For every cohort (by default the cottage) and calendar month, the table keeps five mergeable aggregates per
+subscale: count, sum, sum of squares, min and max. Aggregates of two sets of scores combine by adding the counts,
+sums and sums of squares and taking the min of the mins and the max of the maxes. So:
+    - a newly scored batch is folded in with one grouped aggregation of just that batch
+    - any coarser view (a quarter, a year, a program across its cottages, everyone) is the same combination applied
+      to the stored rows, and needs only the table, not the assessments
+Means come out as sum / count, and variances as (sum of squares - sum^2 / count) / (count - 1).
+
+Scores are folded in through store_tools, indexed by submission fingerprint, and each fingerprint is counted once: the
+table keeps the fingerprints it has folded in (sorted, so checking a batch is a binary search). A cumulative export,
+a re-run, or a score store that starts over and scores everything again only adds the submissions the table has not
+seen. The table and its fingerprints are saved atomically as a single .npz file.
+
+#### DIMENSIONS: ####
+Rows are keyed by `dimensions` plus the assessment month ("YYYY-MM"). The cottage comes from the Survey Monkey export
+and needs no matching. A program-level rollup needs the Avatar program, i.e. scores that have been matched to
+episodes, with e.g. dimensions=('program', 'cottage'). A missing value in a dimension is counted under UNKNOWN.
+
+#### USAGE: ####
+    rollups = RollupTable('data_files/rollups.npz')
+    incremental_scores('Outcome Measures.xlsx', store, rollups=rollups) # unseen submissions are added and saved
+    rollups.summary(by=['cottage'], start='2024-01', end='2024-03')     # per-cottage n/mean/var/sd/min/max, Q1
+    rollups.summary(by=['month'])                                       # every month, all cottages combined
+'''
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+
+from measure_tools import SCORING_ENGINE
+from metrics_tools import stage
+from store_tools import FINGERPRINT
+
+MONTH = 'month'
+UNKNOWN = 'unknown'
+STATISTICS = {'count': 'sum', 'sum': 'sum', 'sum_sq': 'sum', 'min': 'min', 'max': 'max'}  # How each one combines
+
+def month_labels(dates):
+    '''
+    Returns the "YYYY-MM" calendar month of each date.
+    '''
+    return pd.to_datetime(pd.Series(dates)).dt.strftime('%Y-%m').to_numpy(dtype=object)
+
+def _month(value):
+    # Period bounds can be given as "YYYY-MM" text or anything to_datetime reads
+    return None if value is None else pd.Timestamp(value).strftime('%Y-%m')
+
+class RollupTable:
+    def __init__(self, path=None, dimensions=('cottage',), subscales=None):
+        '''
+        Loads the table saved at `path` if there is one (its dimensions and subscales then take precedence), and
+        starts an empty one otherwise.
+        '''
+        self.path = path
+        self.dimensions = list(dimensions)
+        self.subscales = list(subscales or SCORING_ENGINE.score_columns)
+        self.fingerprints = np.empty(0, dtype=np.uint64)  # Sorted
+        self.table = None
+        if path and os.path.exists(path):
+            self._read()
+        if self.table is None:
+            self.table = self._empty()
+
+    @property
+    def keys(self):
+        return self.dimensions + [MONTH]
+
+    def _columns(self):
+        return [f'{subscale}_{statistic}' for subscale in self.subscales for statistic in STATISTICS]
+
+    def _empty(self):
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in self.keys} |
+                            {column: pd.Series(dtype='float64') for column in self._columns()})
+
+    def __len__(self):
+        return len(self.table)
+
+    def aggregate(self, scores):
+        '''
+        Returns the aggregates of a scored frame (e.g. generate_scores output) in the table's layout, one row per
+        dimension values and month present in it.
+        '''
+        missing = [column for column in self.dimensions + ['assess_date'] if column not in scores.columns]
+        if missing:
+            raise ValueError(f"Scores are missing the rollup column(s): {', '.join(missing)}")
+        keys = {column: scores[column].astype(object).where(scores[column].notna(), UNKNOWN).astype(str).to_numpy()
+                for column in self.dimensions}
+        keys[MONTH] = month_labels(scores['assess_date'])
+
+        values = scores.reindex(columns=self.subscales).to_numpy(dtype='float64', na_value=np.nan)
+        answered = ~np.isnan(values)
+        filled = np.where(answered, values, 0.0)
+        parts = {'count': answered.astype('float64'), 'sum': filled, 'sum_sq': filled * filled,
+                 'min': values, 'max': values}
+        frame = pd.DataFrame({f'{subscale}_{statistic}': parts[statistic][:, position]
+                              for position, subscale in enumerate(self.subscales) for statistic in STATISTICS})
+        frame = pd.concat([pd.DataFrame(keys), frame], axis=1)
+        return self._combine(frame)
+
+    def _combine(self, frame, by=None):
+        # One grouped reduction per combining function rather than one per column
+        by = self.keys if by is None else by
+        grouped = frame.assign(_all=0).groupby(by or ['_all'], sort=True, observed=True)
+        parts = []
+        for function in dict.fromkeys(STATISTICS.values()):
+            columns = [f'{subscale}_{statistic}' for subscale in self.subscales
+                       for statistic, combine in STATISTICS.items() if combine == function]
+            parts.append(getattr(grouped[columns], function)())
+        combined = pd.concat(parts, axis=1)[self._columns()]
+        return combined.reset_index(drop=not by)
+
+    def seen(self, fingerprints):
+        '''
+        Boolean array marking the fingerprints already folded into the table.
+        '''
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        if not len(self.fingerprints):
+            return np.zeros(len(fingerprints), dtype=bool)
+        position = np.searchsorted(self.fingerprints, fingerprints).clip(max=len(self.fingerprints) - 1)
+        return self.fingerprints[position] == fingerprints
+
+    def update(self, scores):
+        '''
+        Folds scored submissions indexed by fingerprint (as store_tools.incremental_scores passes them) into the table
+        and saves it if the table has a path. Submissions whose fingerprint was folded in before are skipped. Returns
+        the table.
+        '''
+        if scores.index.name != FINGERPRINT:
+            raise ValueError(f"Scores must be indexed by submission fingerprint ('{FINGERPRINT}'); "
+                             "fold them in through store_tools.incremental_scores")
+        with stage('rollup_update', rows_in=len(scores)) as record:
+            fingerprints = scores.index.to_numpy(dtype=np.uint64)
+            new = ~pd.Index(fingerprints).duplicated() & ~self.seen(fingerprints)
+            batch = self.aggregate(scores.loc[new])
+            if len(batch):
+                self.table = self._combine(pd.concat([self.table, batch], ignore_index=True)) if len(self.table) else batch
+            self.fingerprints = np.sort(np.concatenate([self.fingerprints, fingerprints[new]]))
+            record.rows_out = len(batch)
+        if self.path:
+            self.save()
+        return self
+
+    def summary(self, by=None, start=None, end=None, where=None):
+        '''
+        Returns per-subscale n, mean, var, sd, min and max for every combination of the `by` columns (any of the
+        dimensions and "month"; default all of them, [] for one overall row). `start` and `end` limit it to an
+        inclusive range of months, and `where` maps dimensions to a value or list of values to keep, e.g.
+        {'program': 'Residential Program'}.
+        '''
+        by = self.keys if by is None else list(by)
+        unknown = [column for column in by + list(where or {}) if column not in self.keys]
+        if unknown:
+            raise ValueError(f"Not a rollup dimension: {', '.join(unknown)} (choose from {', '.join(self.keys)})")
+
+        with stage('rollup_summary', rows_in=len(self.table)) as record:
+            rows = np.ones(len(self.table), dtype=bool)
+            if start is not None:
+                rows &= (self.table[MONTH] >= _month(start)).to_numpy()
+            if end is not None:
+                rows &= (self.table[MONTH] <= _month(end)).to_numpy()
+            for column, values in (where or {}).items():
+                values = [values] if isinstance(values, str) or not np.iterable(values) else values
+                rows &= self.table[column].isin([str(value) for value in values]).to_numpy()
+            combined = self._combine(self.table.loc[rows], by)
+
+            # Every subscale at once: each statistic is a (groups x subscales) block
+            block = {statistic: combined[[f'{subscale}_{statistic}' for subscale in self.subscales]].to_numpy(dtype='float64')
+                     for statistic in STATISTICS}
+            count, total = block['count'], block['sum']
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.where(count > 0, total / count, np.nan)
+                variance = np.where(count > 1, np.maximum((block['sum_sq'] - total * mean) / (count - 1), 0), np.nan)
+            statistics = {'n': count.astype(np.int64), 'mean': mean, 'var': variance, 'sd': np.sqrt(variance),
+                          'min': block['min'], 'max': block['max']}
+            summary = {column: combined[column].to_numpy() for column in by}
+            summary.update({f'{subscale}_{statistic}': values[:, position] for position, subscale in enumerate(self.subscales)
+                            for statistic, values in statistics.items()})
+            summary = pd.DataFrame(summary)
+            record.rows_out = len(summary)
+        return summary
+
+    def _read(self):
+        with np.load(self.path, allow_pickle=False) as stored:
+            meta = json.loads(str(stored['meta']))
+            self.dimensions, self.subscales = meta['dimensions'], meta['subscales']
+            table = {column: stored[f'key_{number}'].astype(object) for number, column in enumerate(self.keys)}
+            table.update({column: stored[column] for column in self._columns()})
+            if 'fingerprints' in stored:
+                self.fingerprints = np.sort(stored['fingerprints'])
+        self.table = pd.DataFrame(table)
+
+    def save(self, path=None):
+        '''
+        Writes the table to a single .npz file, replacing any previous version atomically.
+        '''
+        path = path or self.path
+        meta = {'dimensions': self.dimensions, 'subscales': self.subscales}
+        arrays = {f'key_{number}': self.table[column].to_numpy(dtype=str) for number, column in enumerate(self.keys)}
+        arrays.update({column: self.table[column].to_numpy(dtype='float64') for column in self._columns()})
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        handle, staging = tempfile.mkstemp(prefix='.rollups-', suffix='.npz', dir=directory)
+        os.close(handle)
+        np.savez(staging, meta=np.array(json.dumps(meta)), fingerprints=self.fingerprints, **arrays)
+        os.replace(staging, path)
+        return path
@@ -0,0 +1,435 @@
+'''
+### PURPOSE: ####
+Long-running local scoring service. Scoring a handful of new submissions as a one-off script pays for starting
+Python, importing pandas and cleaning the Avatar report every time. The service does that work once: it loads the
+admissions episodes and builds the episode and name indexes at startup. After that each request only scores its rows
+and matches them, which takes milliseconds.
+
+Submissions are posted as JSON in the cleaned-column layout (name as "Last,First", assess_date, and any of the item
+columns; missing items are left out or null). The body can be a single object or a list of objects. Each submission
+gets back its subscale scores, the packed validity bitmask (see measure_tools.validity_flags), its match status, and
+the matched pid, epn, program and admission/discharge dates. A NO_NAME submission also gets the suggested name.
+
+#### BATCHING: ####
+Requests are not scored one by one. Their rows are queued, and a single batcher drains the queue. It waits up to
+`max_delay_ms` after the first row for more to arrive, with at most `max_batch` rows per batch. Each batch is scored
+with one ScoringEngine pass and matched with one EpisodeIndex lookup, in a worker thread so the event loop keeps
+accepting connections. Under load, concurrent requests share batches; a lone request waits no more than max_delay_ms.
+
+#### ENDPOINTS: ####
+    POST /score     score and match one submission or a list of them
+    GET  /metrics   request, row and batch counters, batch sizes and latency percentiles, as JSON
+    GET  /health    liveness, with the number of episodes loaded
+    POST /reload    re-read the admissions source (e.g. after a new Avatar report) without restarting
+
+The server uses only asyncio and the standard library (HTTP/1.1 with keep-alive). It makes no outside network calls,
+so it runs fully offline and can be tested against a synthetic Avatar report from synthetic_data.py.
+
+#### USAGE: ####
+    python score_service.py --avatar-report batch_42.xls --port 8765
+    python score_service.py --admissions-db data_files/admissions.sqlite --discharged-since 2024-01-01
+    curl -s localhost:8765/score -d '{"name": "Doe,Jane", "assess_date": "2024-03-01", "ders_1": 3, ...}'
+'''
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from datetime import datetime
+from http import HTTPStatus
+import numpy as np
+import pandas as pd
+
+from measure_tools import SCORING_ENGINE, INVALID_RESPONSE, VALIDITY_BITS
+from match_tools import EpisodeIndex, NameIndex, NO_NAME
+from import_prep import load_admissions
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 512
+DEFAULT_MAX_DELAY_MS = 2.0
+MAX_BODY_BYTES = 16 * 1024 ** 2
+LATENCY_WINDOW = 10000  # Latest requests kept for the latency percentiles
+
+_EPISODE_FIELDS = ['pid', 'epn', 'program', 'adm_date', 'disc_date']
+
+def _json_value(value):
+    # numpy/pandas scalars and missing values to plain JSON values
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+def _response(value):
+    # Same rules as compact_items: blanks are missing, anything but a whole number from 0 to 254 is INVALID_RESPONSE
+    if value is None or value == '':
+        return np.nan
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return INVALID_RESPONSE
+    if np.isnan(number):
+        return np.nan
+    return number if number.is_integer() and 0 <= number < INVALID_RESPONSE else INVALID_RESPONSE
+
+def submission_arrays(submissions):
+    '''
+    Reads a list of submission dicts into (names, assessment dates, item responses), with the responses as a float64
+    array in SCORING_ENGINE.item_columns order. Raises ValueError if a submission is not an object, lacks a name or
+    assess_date, or has an unreadable date.
+    '''
+    for number, submission in enumerate(submissions):
+        if not isinstance(submission, dict):
+            raise ValueError(f"Submission {number} is not a JSON object")
+        missing = [field for field in ('name', 'assess_date') if not submission.get(field)]
+        if missing:
+            raise ValueError(f"Submission {number} is missing: {', '.join(missing)}")
+    # A handful of rows is far cheaper to read in plain Python than through per-column pandas conversions
+    names = [str(submission['name']).strip() for submission in submissions]
+    try:
+        dates = pd.to_datetime([submission['assess_date'] for submission in submissions]).normalize()
+    except (ValueError, TypeError) as error:
+        raise ValueError(f"Unreadable assess_date: {error}")
+    items = np.array([[_response(submission.get(item)) for item in SCORING_ENGINE.item_columns]
+                      for submission in submissions], dtype='float64').reshape(len(submissions), -1)
+    return names, dates, items
+
+class ScoringService:
+    '''
+    Holds the warm state (episode and name indexes) and scores batches of submissions. Usable without the HTTP
+    server, e.g. ScoringService(avatar_df=...).score_batch([...]).
+    '''
+    def __init__(self, avatar_report=None, admissions_db=None, discharged_since=None, avatar_df=None):
+        self.avatar_report = avatar_report
+        self.admissions_db = admissions_db
+        self.discharged_since = discharged_since
+        self.load(avatar_df)
+
+    def load(self, avatar_df=None):
+        '''
+        (Re)builds the indexes from `avatar_df`, or from the configured report or admissions store. The new indexes
+        replace the old ones in a single assignment, so batches already running finish against the old ones.
+        '''
+        if avatar_df is None:
+            if not (self.avatar_report or self.admissions_db):
+                raise ValueError("No admissions source: give an avatar_report, admissions_db or avatar_df")
+            avatar_df = load_admissions(self.avatar_report, admissions_db=self.admissions_db,
+                                        discharged_since=self.discharged_since)
+        episode_index = EpisodeIndex(avatar_df)
+        # Episode fields as object arrays with a trailing None, so position -1 (no episode) reads as null
+        fields = {column: np.append(episode_index.episodes[column].to_numpy(dtype=object), None)
+                  for column in _EPISODE_FIELDS if column in episode_index.episodes.columns}
+        self.indexes = (episode_index, NameIndex(avatar_df, episode_index), fields)
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+        return len(avatar_df)
+
+    @property
+    def episodes(self):
+        return len(self.indexes[0].episodes)
+
+    def score_batch(self, submissions):
+        '''
+        Scores and matches a list of submission dicts. Returns one result dict per submission, in order.
+        '''
+        episode_index, name_index, fields = self.indexes
+        names, dates, items = submission_arrays(submissions)
+        scores, flags = SCORING_ENGINE.evaluate_items(items)
+        shifts = np.arange(len(SCORING_ENGINE.instruments), dtype=np.uint32) * VALIDITY_BITS
+        validity = (flags.astype(np.uint32) << shifts).sum(axis=1, dtype=np.uint32)
+
+        positions, status = episode_index.lookup(names, dates)
+        status = status.astype(object)
+        suggested = {}
+        unmatched = np.flatnonzero(status == NO_NAME)
+        if len(unmatched):
+            resolved = name_index.resolve(episode_index.match(
+                pd.DataFrame({'name': [names[row] for row in unmatched], 'assess_date': dates[unmatched]})))
+            resolved_positions, _ = episode_index.lookup(resolved['suggested_name'].fillna(''), resolved['assess_date'])
+            for row, outcome, position, name in zip(unmatched, resolved['match_status'], resolved_positions,
+                                                     resolved['suggested_name']):
+                status[row] = outcome
+                if outcome == NO_NAME:
+                    suggested[row] = _json_value(name)
+                else:
+                    positions[row] = position
+
+        results = []
+        for row in range(len(submissions)):
+            result = {'name': names[row], 'assess_date': _json_value(dates[row]), 'match_status': status[row]}
+            result.update({column: _json_value(values[positions[row]]) for column, values in fields.items()})
+            if row in suggested:
+                result['suggested_name'] = suggested[row]
+            result['scores'] = {column: _json_value(value) for column, value in zip(SCORING_ENGINE.score_columns, scores[row])}
+            result['validity'] = int(validity[row])
+            results.append(result)
+        return results
+
+class ServiceMetrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.requests = {}
+        self.errors = 0
+        self.rows = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.batch_seconds = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def request(self, path, seconds, ok):
+        self.requests[path] = self.requests.get(path, 0) + 1
+        self.errors += not ok
+        if path == '/score':
+            self.latencies.append(seconds)
+
+    def batch(self, rows, seconds):
+        self.batches += 1
+        self.rows += rows
+        self.largest_batch = max(self.largest_batch, rows)
+        self.batch_seconds += seconds
+
+    def summary(self):
+        latencies = np.array(self.latencies) * 1000
+        percentiles = {f'p{point}': round(float(np.percentile(latencies, point)), 3) if len(latencies) else None
+                       for point in (50, 90, 99)}
+        return {
+            'started_at': self.started_at,
+            'uptime_seconds': round(time.monotonic() - self.started, 1),
+            'requests': dict(self.requests),
+            'errors': self.errors,
+            'rows_scored': self.rows,
+            'batches': self.batches,
+            'mean_batch_rows': round(self.rows / self.batches, 2) if self.batches else None,
+            'largest_batch_rows': self.largest_batch,
+            'mean_batch_ms': round(self.batch_seconds / self.batches * 1000, 3) if self.batches else None,
+            'score_latency_ms': percentiles,
+        }
+
+class RequestTooLarge(ValueError):
+    '''
+    Raised for a request body over MAX_BODY_BYTES, which is answered with 413 rather than 400.
+    '''
+
+def _settle(future, result=None, error=None):
+    # A caller that disconnected has cancelled its future; setting it then would raise and stop the batcher
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class ScoringServer:
+    def __init__(self, service, host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=DEFAULT_MAX_BATCH,
+                 max_delay_ms=DEFAULT_MAX_DELAY_MS):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.metrics = ServiceMetrics()
+        self.queue = None
+        self.server = None
+        self.batcher = None
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self._batch_loop())
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]  # The port actually bound, when started on port 0
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def score(self, submissions):
+        '''
+        Queues submissions for the batcher and waits for their results.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((submissions, future))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            rows = len(pending[0][0])
+            deadline = loop.time() + self.max_delay
+            while rows < self.max_batch:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                rows += len(item[0])
+
+            submissions = [submission for request, _ in pending for submission in request]
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(None, self.service.score_batch, submissions)
+            except ValueError:
+                # One bad request must not fail the others in its batch, so each is retried on its own
+                for request, future in pending:
+                    try:
+                        _settle(future, result=await loop.run_in_executor(None, self.service.score_batch, request))
+                    except Exception as error:
+                        _settle(future, error=error)
+                continue
+            except Exception as error:
+                for _, future in pending:
+                    _settle(future, error=error)
+                continue
+            self.metrics.batch(len(submissions), time.perf_counter() - started)
+
+            start = 0
+            for request, future in pending:
+                _settle(future, result=results[start:start + len(request)])
+                start += len(request)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError as error:
+                    # The stream can't be trusted past a malformed or oversized request, so the connection is closed
+                    # after answering
+                    too_large = isinstance(error, RequestTooLarge)
+                    status = HTTPStatus.REQUEST_ENTITY_TOO_LARGE if too_large else HTTPStatus.BAD_REQUEST
+                    self.metrics.request('<malformed>', 0.0, False)
+                    await self._write_response(writer, status, {'error': str(error)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                started = time.perf_counter()
+                status, payload = await self._route(method, path, body)
+                self.metrics.request(path, time.perf_counter() - started, status < 400)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        # Returns None at the end of the stream, raises RequestTooLarge for a body over the limit and ValueError for
+        # a malformed request
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        parts = line.decode('latin-1').split(' ', 2)
+        if len(parts) != 3 or not parts[1].startswith('/'):
+            raise ValueError(f"Malformed request line: {line[:100]!r}")
+        method, path, _ = parts
+        headers = {}
+        while True:
+            header = await reader.readline()
+            if header in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = header.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        length = headers.get('content-length', '0')
+        if not length.isdigit():
+            raise ValueError(f"Invalid Content-Length: {length[:100]!r}")
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            raise RequestTooLarge(f"Request body of {length} bytes is over the {MAX_BODY_BYTES} byte limit")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), path.split('?', 1)[0], headers, body
+
+    async def _route(self, method, path, body):
+        routes = {('POST', '/score'): self._score, ('GET', '/metrics'): self._metrics,
+                  ('GET', '/health'): self._health, ('POST', '/reload'): self._reload}
+        if (method, path) not in routes:
+            known = {route_path for _, route_path in routes}
+            status = HTTPStatus.METHOD_NOT_ALLOWED if path in known else HTTPStatus.NOT_FOUND
+            return status, {'error': status.phrase}
+        try:
+            return await routes[(method, path)](body)
+        except ValueError as error:
+            return HTTPStatus.BAD_REQUEST, {'error': str(error)}
+        except Exception as error:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f'{type(error).__name__}: {error}'}
+
+    async def _score(self, body):
+        try:
+            submissions = json.loads(body)
+        except json.JSONDecodeError as error:
+            raise ValueError(f"Body is not valid JSON: {error}")
+        single = isinstance(submissions, dict)
+        submissions = [submissions] if single else submissions
+        if not isinstance(submissions, list):
+            raise ValueError("Body must be a submission object or a list of them")
+        if not submissions:
+            return HTTPStatus.OK, []
+        results = await self.score(submissions)
+        return HTTPStatus.OK, results[0] if single else results
+
+    async def _metrics(self, body):
+        summary = self.metrics.summary()
+        summary['episodes'] = self.service.episodes
+        summary['admissions_loaded_at'] = self.service.loaded_at
+        summary['queued'] = self.queue.qsize()
+        return HTTPStatus.OK, summary
+
+    async def _health(self, body):
+        return HTTPStatus.OK, {'status': 'ok', 'episodes': self.service.episodes}
+
+    async def _reload(self, body):
+        episodes = await asyncio.get_running_loop().run_in_executor(None, self.service.load)
+        return HTTPStatus.OK, {'status': 'reloaded', 'episodes': episodes, 'loaded_at': self.service.loaded_at}
+
+    async def _write_response(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        head = (f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                f'Content-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Outcome Measures scoring and Avatar matching over local HTTP.")
+    parser.add_argument('--avatar-report', help="Avatar 'Admissions in Date Range' report to match against")
+    parser.add_argument('--admissions-db', help="SQLite admissions store to match against (the report, if given, is loaded into it first)")
+    parser.add_argument('--discharged-since', help="With --admissions-db, only load episodes open or discharged on or after this date")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH, help="Most rows scored in one batch")
+    parser.add_argument('--max-delay-ms', type=float, default=DEFAULT_MAX_DELAY_MS,
+                        help="How long a batch waits for more rows after its first one")
+    args = parser.parse_args(argv)
+    if not (args.avatar_report or args.admissions_db):
+        parser.error("Provide --avatar-report or --admissions-db")
+
+    service = ScoringService(args.avatar_report, admissions_db=args.admissions_db, discharged_since=args.discharged_since)
+    server = ScoringServer(service, host=args.host, port=args.port, max_batch=args.max_batch,
+                           max_delay_ms=args.max_delay_ms)
+    print(f"Serving {service.episodes} episodes on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
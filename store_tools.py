@@ -0,0 +1,198 @@
+'''
+### PURPOSE: ####
+Persistent store of scored assessments, so a cumulative Survey Monkey export only has its NEW submissions cleaned
+and scored. Every submission is identified by a fingerprint: a hash of the client name, the assessment's start date
+and the full response vector. An edited submission therefore gets a new fingerprint and is rescored. When an export
+is scored, the raw rows are fingerprinted (cheap: no date parsing, no cleaning). Only the rows the store has not seen
+go through clean_export_frame and the scoring engine. The scores for the whole export are then assembled from the
+store.
+
+#### STORAGE FORMAT: ####
+    <store>/manifest.json      schema digest, the compacted base file and the log segments, in order
+    <store>/base-<n>.pkl       every scored submission as of the last compaction
+    <store>/segment-<n>.pkl    one appended batch of newly scored submissions (append-only log)
+New scores are appended as a new segment, and the manifest is then replaced atomically; the manifest is the commit
+point, so an interrupted run leaves the store as it was. Once more than `max_segments` segments have built up, they
+are compacted into a new base file. If the cleaning or scoring rules change, the store's schema digest no longer
+matches and the store starts over empty.
+
+A store expects one writer at a time. Rows that cleaning drops (incomplete submissions when dropna=True) are never
+stored, so they are looked at again on the next run.
+
+#### USAGE: ####
+    store = ScoreStore('data_files/score_store')
+    scores = incremental_scores('Outcome Measures.xlsx', store)   # same columns as generate_scores
+'''
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+
+import measure_tools
+from cache_tools import schema_digest
+from metrics_tools import stage
+
+DEFAULT_STORE_DIR = os.environ.get(
+    'OUTCOME_MEASURES_STORE', os.path.join(os.path.expanduser('~'), '.outcome_measures_store'))
+DEFAULT_MAX_SEGMENTS = 16
+
+MANIFEST = 'manifest.json'
+FINGERPRINT = 'fingerprint'
+
+def scoring_schema(dropna=True):
+    '''
+    Digest of everything that decides a submission's scores: the export layout, cleaning and the instrument specs.
+    '''
+    return schema_digest(
+        'scores', measure_tools.DROPPED_COLUMNS, measure_tools.EXPORT_COLUMNS, dropna, measure_tools.INSTRUMENTS,
+        measure_tools.clean_export_frame, measure_tools.compact_items, measure_tools.ScoringEngine)
+
+def submission_fingerprints(raw):
+    '''
+    Returns one uint64 fingerprint per row of a raw export frame (the question-text header row already removed),
+    hashed from the stripped "Last,First" name, the raw start date and the item responses.
+    '''
+    raw = raw.drop(labels=measure_tools.DROPPED_COLUMNS, axis=1)
+    first, last = raw.iloc[:, 1].astype(str).str.strip(' '), raw.iloc[:, 2].astype(str).str.strip(' ')
+    responses = raw.iloc[:, 5:].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64')
+    # Hashing one column at a time and folding the results together keeps this vectorized
+    columns = [last + ',' + first, raw.iloc[:, 0].astype(str)] + [pd.Series(column) for column in responses.T]
+    fingerprint = np.zeros(len(raw), dtype=np.uint64)
+    for column in columns:
+        hashed = pd.util.hash_pandas_object(column, index=False).to_numpy()
+        fingerprint = fingerprint * np.uint64(1000003) ^ hashed
+    return pd.Series(fingerprint, index=raw.index, name=FINGERPRINT)
+
+class ScoreStore:
+    def __init__(self, directory=None, max_segments=DEFAULT_MAX_SEGMENTS, dropna=True):
+        self.directory = directory or DEFAULT_STORE_DIR
+        self.max_segments = max_segments
+        self.schema = scoring_schema(dropna)
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest = self._read_manifest()
+        self._scores = None
+
+    def _read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('schema') == self.schema:
+                return manifest
+        # New store, or one scored under different rules: nothing in it can be reused
+        return {'schema': self.schema, 'base': None, 'segments': [], 'next': 0}
+
+    def _write_manifest(self, manifest):
+        handle, staging = tempfile.mkstemp(prefix='.manifest-', dir=self.directory)
+        with os.fdopen(handle, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(staging, os.path.join(self.directory, MANIFEST))
+        self.manifest = manifest
+        self._remove_unlisted()
+
+    def _remove_unlisted(self):
+        listed = {MANIFEST, self.manifest['base']} | set(self.manifest['segments'])
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl') and name not in listed:
+                os.remove(os.path.join(self.directory, name))
+
+    def _write_file(self, prefix, dataframe):
+        name = f"{prefix}-{self.manifest['next']:06d}.pkl"
+        handle, staging = tempfile.mkstemp(prefix='.staging-', dir=self.directory)
+        os.close(handle)
+        dataframe.to_pickle(staging)
+        os.replace(staging, os.path.join(self.directory, name))
+        return name
+
+    def scores(self):
+        '''
+        Every stored submission's scores as one frame indexed by fingerprint, later segments taking precedence.
+        '''
+        if self._scores is None:
+            files = ([self.manifest['base']] if self.manifest['base'] else []) + self.manifest['segments']
+            frames = [pd.read_pickle(os.path.join(self.directory, name)) for name in files]
+            if frames:
+                scores = pd.concat(frames)
+                scores = scores.loc[~scores.index.duplicated(keep='last')]
+                scores['name'] = scores['name'].astype('category')
+                scores['cottage'] = scores['cottage'].astype('category')
+            else:
+                scores = pd.DataFrame(index=pd.Index([], dtype=np.uint64, name=FINGERPRINT))
+            self._scores = scores
+        return self._scores
+
+    def unseen(self, fingerprints):
+        '''
+        Boolean array marking the fingerprints the store holds no scores for.
+        '''
+        return ~pd.Index(fingerprints).isin(self.scores().index)
+
+    def append(self, scored):
+        '''
+        Adds a frame of newly scored submissions (indexed by fingerprint) to the log, compacting if it has grown past
+        max_segments.
+        '''
+        if scored.empty:
+            return
+        with stage('store_append', rows_in=len(scored)):
+            manifest = dict(self.manifest)
+            name = self._write_file('segment', scored)
+            manifest.update(segments=manifest['segments'] + [name], next=manifest['next'] + 1)
+            self._write_manifest(manifest)
+            self._scores = None
+        if len(self.manifest['segments']) > self.max_segments:
+            self.compact()
+
+    def compact(self):
+        '''
+        Folds the base file and every log segment into a single new base file.
+        '''
+        with stage('store_compact') as record:
+            scores = self.scores()
+            manifest = dict(self.manifest)
+            name = self._write_file('base', scores)
+            manifest.update(base=name, segments=[], next=manifest['next'] + 1)
+            self._write_manifest(manifest)
+            record.rows_out = len(scores)
+
+    def clear(self):
+        self._write_manifest({'schema': self.schema, 'base': None, 'segments': [], 'next': self.manifest['next']})
+        self._scores = None
+
+def incremental_scores(import_file_location, store=None, dropna=True, rollups=None):
+    '''
+    Incremental counterpart of generate_scores for a path: cleans and scores only the export rows `store` has not
+    seen, records them, and returns the scores for every submission in the export, sorted by name and date. With
+    `rollups` (a rollup_tools.RollupTable), the newly scored rows are also folded into the rollups.
+    '''
+    store = store or ScoreStore(dropna=dropna)
+    raw = measure_tools.read_export(import_file_location)
+    raw = raw.drop(0, errors='ignore')  # Survey Monkey's question-text header row
+
+    with stage('fingerprint', rows_in=len(raw)) as record:
+        fingerprints = submission_fingerprints(raw)
+        unseen = store.unseen(fingerprints)
+        record.rows_out = int(unseen.sum())
+
+    if unseen.any():
+        with stage('clean_export', rows_in=int(unseen.sum())) as record:
+            cleaned = measure_tools.clean_export_frame(raw.loc[unseen], dropna=dropna)
+            record.rows_out = len(cleaned)
+        with stage('score_new', rows_in=len(cleaned)) as record:
+            scored = measure_tools.score_frame(cleaned)
+            scored.index = pd.Index(fingerprints.loc[scored.index].to_numpy(), name=FINGERPRINT)
+            scored = scored.loc[~scored.index.duplicated()]
+            record.rows_out = len(scored)
+        store.append(scored)
+        if rollups is not None:
+            rollups.update(scored)
+
+    # Assembling the export's scores from the store; rows cleaning dropped have no stored scores and are left out
+    stored = store.scores()
+    if stored.empty:
+        return measure_tools.score_frame(measure_tools.clean_export_frame(raw.iloc[:0], dropna=dropna))
+    present = fingerprints.loc[fingerprints.isin(stored.index)].to_numpy()
+    scores = stored.loc[present].reset_index(drop=True)
+    scores.sort_values(by=["name", "assess_date"], inplace=True)
+    return scores
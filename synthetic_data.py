@@ -0,0 +1,212 @@
+'''
+### PURPOSE: ####
+Generates realistic, entirely fictional input files for testing and benchmarking the Outcome Measures pipeline:
+    - Survey Monkey exports in the exact layout clean_data expects: the metadata/PII columns it drops, the
+      question-text header row Survey Monkey inserts under the column headers, first/last name, assessment date,
+      cottage and every DERS, ARI, DTS, CEAS and CAMM item column.
+    - Avatar "Admissions in Date Range" reports in the layout clean_avatar_report expects: Crystal Reports junk rows
+      with the real header on row 5, the Client Name/PID/Adm Date/Disc. Date/EP#/Program columns, blank padding
+      columns and episodes from programs that get filtered out.
+
+Both files are generated from the same client roster, so most assessments fall inside one of their client's
+episodes. A fraction of names can be misspelled to exercise fuzzy matching. Generation is vectorized and exports
+can be written in chunks, so sizes from 1k up to 10M rows are practical (CSV only at the larger sizes).
+
+#### USAGE: ####
+    python synthetic_data.py --rows 100000 --output-dir data_files/synthetic --format csv
+'''
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+from measure_tools import DROPPED_COLUMNS, EXPORT_COLUMNS, INSTRUMENTS
+
+_ONSETS = ['b', 'br', 'c', 'ch', 'd', 'f', 'g', 'h', 'j', 'k', 'l', 'm', 'n', 'p', 'r', 's', 'sh', 't', 'v', 'w']
+_VOWELS = ['a', 'e', 'i', 'o', 'u', 'ay', 'ee', 'oo']
+_CODAS = ['', 'n', 'r', 'l', 's', 'th', 'son', 'ton', 'ley', 'er']
+
+RESIDENTIAL_PROGRAMS = ['Residential Program', 'PHP + Room and Board Program']
+OTHER_PROGRAMS = ['Outpatient Program', 'Day Treatment Program']
+COTTAGES = ['Cottage A', 'Cottage B', 'Cottage C', 'Cottage D', 'Cottage E']
+
+def _names(rng, count):
+    syllables = 1 + rng.integers(1, 3, count)
+    parts = [np.char.add(rng.choice(_ONSETS, count), rng.choice(_VOWELS, count)) for _ in range(3)]
+    name = np.char.add(parts[0], np.where(syllables > 1, parts[1], ''))
+    name = np.char.add(name, np.where(syllables > 2, parts[2], ''))
+    return np.char.capitalize(np.char.add(name, rng.choice(_CODAS, count)))
+
+def _misspell(rng, names):
+    # Swaps two adjacent letters in each name (e.g. "Johnson" -> "Jonhson")
+    misspelled = names.astype(object)
+    for position, name in enumerate(names):
+        if len(name) > 3:
+            cut = rng.integers(1, len(name) - 2)
+            misspelled[position] = name[:cut] + name[cut + 1] + name[cut] + name[cut + 2:]
+    return misspelled.astype(str)
+
+def generate_roster(n_clients, seed=0, start='2018-01-01', end='2024-12-31', max_episodes=3):
+    '''
+    Returns one row per episode: first_name, last_name, pid, epn, adm_date, disc_date (NaT while open) and program.
+    '''
+    rng = np.random.default_rng(seed)
+    first, last = _names(rng, n_clients), _names(rng, n_clients)
+    episodes = rng.integers(1, max_episodes + 1, n_clients)
+    client = np.repeat(np.arange(n_clients), episodes)
+    epn = np.arange(len(client)) - np.repeat(np.cumsum(episodes) - episodes, episodes) + 1
+
+    span = (pd.Timestamp(end) - pd.Timestamp(start)).days
+    gaps = rng.integers(30, 240, len(client))
+    stays = rng.integers(20, 200, len(client))
+    first_admission = rng.integers(0, max(span // 2, 1), n_clients)[client]
+    # Episodes for a client follow one another: each admission starts after the previous discharge plus a gap
+    offsets = pd.Series(stays + gaps).groupby(client).cumsum().to_numpy() - (stays + gaps)
+    adm_date = pd.Timestamp(start) + pd.to_timedelta(first_admission + offsets, unit='D')
+    disc_date = pd.Series(adm_date + pd.to_timedelta(stays, unit='D'))
+    disc_date[disc_date > pd.Timestamp(end)] = pd.NaT
+
+    return pd.DataFrame({
+        'first_name': first[client],
+        'last_name': last[client],
+        'pid': 100000 + client,
+        'epn': epn,
+        'adm_date': adm_date,
+        'disc_date': disc_date,
+        'program': rng.choice(RESIDENTIAL_PROGRAMS + OTHER_PROGRAMS, len(client), p=[0.6, 0.3, 0.05, 0.05]),
+    })
+
+def iter_survey_export(roster, n_rows, seed=0, chunksize=100000, missing_rate=0.0, misspell_rate=0.05, end='2024-12-31'):
+    '''
+    Yields a raw Survey Monkey export for assessments sampled from `roster`'s residential episodes, in chunks of at
+    most `chunksize` rows. The first chunk begins with Survey Monkey's question-text header row.
+    '''
+    rng = np.random.default_rng(seed + 1)
+    residential = roster.loc[roster['program'].isin(RESIDENTIAL_PROGRAMS)].reset_index(drop=True)
+    adm = residential['adm_date'].to_numpy(dtype='datetime64[D]')
+    disc = residential['disc_date'].fillna(pd.Timestamp(end)).to_numpy(dtype='datetime64[D]')
+    length = np.maximum((disc - adm).astype(np.int64), 1)
+
+    raw_columns = ['Respondent ID', 'Collector ID', 'Start Date'] + DROPPED_COLUMNS[2:] + \
+        ['What is your first name?', 'What is your last name?', 'Date', 'Cottage'] + \
+        [f'Q{number}' for number in range(1, len(EXPORT_COLUMNS) - 3)]
+    item_ranges = [instrument.item_range for instrument in INSTRUMENTS.values() for _ in instrument.items]
+    item_order = [item for instrument in INSTRUMENTS.values() for item in instrument.items]
+    export_items = EXPORT_COLUMNS[4:]
+
+    for start in range(0, n_rows, chunksize):
+        count = min(chunksize, n_rows - start)
+        episode = rng.integers(0, len(residential), count)
+        assess_date = adm[episode] + rng.integers(0, length[episode]).astype('timedelta64[D]')
+        start_date = pd.to_datetime(assess_date) + pd.to_timedelta(rng.integers(8 * 3600, 20 * 3600, count), unit='s')
+        first = residential['first_name'].to_numpy(dtype=str)[episode]
+        last = residential['last_name'].to_numpy(dtype=str)[episode]
+        misspelled = rng.random(count) < misspell_rate
+        if misspelled.any():
+            last = last.copy()
+            last[misspelled] = _misspell(rng, last[misspelled])
+
+        chunk = {
+            'Respondent ID': 10 ** 10 + start + np.arange(count),
+            'Collector ID': 400000000,
+            'Start Date': start_date.strftime('%m/%d/%Y %I:%M:%S %p'),
+            'End Date': (start_date + pd.Timedelta(minutes=15)).strftime('%m/%d/%Y %I:%M:%S %p'),
+            'IP Address': '',
+            'Email Address': '',
+            'First Name': '',
+            'Last Name': '',
+            'Custom Data 1': '',
+            'Program': 'Outcome Measures',
+            'What is your first name?': np.char.add(' ', first),  # Staff often leave stray spaces around names
+            'What is your last name?': last,
+            'Date': pd.to_datetime(assess_date).strftime('%m/%d/%Y'),
+            'Cottage': rng.choice(COTTAGES, count),
+        }
+        items = np.empty((count, len(item_order)))
+        for column, (low, high) in enumerate(item_ranges):
+            items[:, column] = rng.integers(low, high + 1, count)
+        if missing_rate:
+            items[rng.random(items.shape) < missing_rate] = np.nan
+        position = {item: column for column, item in enumerate(item_order)}
+        for question, item in zip(raw_columns[14:], export_items):
+            chunk[question] = items[:, position[item]]
+
+        frame = pd.DataFrame(chunk, columns=raw_columns, index=pd.RangeIndex(start + 1, start + 1 + count))
+        if start == 0:
+            header_row = pd.DataFrame([['Response'] * len(raw_columns)], columns=raw_columns, index=[0])
+            frame = pd.concat([header_row, frame])
+        yield frame
+
+def avatar_report(roster):
+    '''
+    Lays a roster out as a Crystal Reports "Admissions in Date Range" sheet: five junk rows, the real header on row 5,
+    then one row per episode with blank padding columns in between.
+    '''
+    columns = ['Admissions in Date Range', 'Unnamed: 1', 'Unnamed: 2', 'Unnamed: 3', 'Unnamed: 4', 'Unnamed: 5',
+               'Unnamed: 6', 'Unnamed: 7', 'Unnamed: 8']
+    header = ['', 'Client Name', None, 'PID', 'Adm Date', 'Disc. Date', 'EP#', 'Program', None]
+    junk = [['Hillside', None, None, None, None, None, None, None, None],
+            ['Run Date', None, None, None, None, None, None, None, None],
+            [None] * 9, [None] * 9, [None] * 9]
+    body = pd.DataFrame({
+        columns[0]: None,
+        columns[1]: roster['last_name'] + ',' + roster['first_name'],
+        columns[2]: None,
+        columns[3]: roster['pid'],
+        columns[4]: roster['adm_date'],
+        columns[5]: roster['disc_date'],
+        columns[6]: roster['epn'],
+        columns[7]: roster['program'],
+        columns[8]: None,
+    })
+    top = pd.DataFrame(junk + [header], columns=columns)
+    return pd.concat([top, body], ignore_index=True)
+
+def write_dataset(output_dir, n_rows, seed=0, file_format='csv', chunksize=100000, missing_rate=0.0, misspell_rate=0.05):
+    '''
+    Writes a matching Survey Monkey export and Avatar report into `output_dir` and returns their paths.
+    XLSX is written in one piece, so keep it to sizes that fit comfortably in memory.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    roster = generate_roster(max(10, n_rows // 6), seed=seed)
+    export_path = os.path.join(output_dir, f'outcome_measures_{n_rows}.{file_format}')
+    report_path = os.path.join(output_dir, f'avatar_admissions_{n_rows}.{file_format}')
+
+    chunks = iter_survey_export(roster, n_rows, seed=seed, chunksize=chunksize,
+                                missing_rate=missing_rate, misspell_rate=misspell_rate)
+    if file_format == 'csv':
+        for position, chunk in enumerate(chunks):
+            chunk.to_csv(export_path, mode='w' if position == 0 else 'a', header=position == 0, index=False)
+        avatar_report(roster).to_csv(report_path, index=False)
+    else:
+        pd.concat(chunks).to_excel(export_path, index=False)
+        avatar_report(roster).to_excel(report_path, index=False)
+    return export_path, report_path
+
+def parse_size(text):
+    '''
+    Parses sizes such as "1000", "10k" or "10M".
+    '''
+    multipliers = {'k': 1000, 'm': 1000000}
+    text = str(text).strip().lower()
+    if text[-1:] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic Survey Monkey exports and matching Avatar reports.")
+    parser.add_argument('--rows', default='1k', help="Number of assessments, e.g. 1000, 10k, 10M")
+    parser.add_argument('--output-dir', default=os.path.join('data_files', 'synthetic'))
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--missing-rate', type=float, default=0.0, help="Fraction of item responses left blank")
+    parser.add_argument('--misspell-rate', type=float, default=0.05, help="Fraction of last names misspelled")
+    args = parser.parse_args(argv)
+
+    paths = write_dataset(args.output_dir, parse_size(args.rows), seed=args.seed, file_format=args.format,
+                          missing_rate=args.missing_rate, misspell_rate=args.misspell_rate)
+    print("Wrote:\n\t" + "\n\t".join(paths))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,63 @@
+'''
+Shared fixtures for the regression tests. The tool modules live at the repository root, so it is put on sys.path
+here. Input files are generated with synthetic_data, so no real client data is needed.
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from measure_tools import EXPORT_COLUMNS, compact_items
+import synthetic_data
+import cache_tools
+
+@pytest.fixture(autouse=True)
+def frame_cache(tmp_path, monkeypatch):
+    '''
+    Gives every test its own frame cache, so nothing is read from or written to the user's cache directory.
+    '''
+    cache = cache_tools.FrameCache(str(tmp_path / 'frame_cache'))
+    monkeypatch.setattr(cache_tools, '_default_cache', cache)
+    return cache
+
+@pytest.fixture(scope='session')
+def dataset(tmp_path_factory):
+    '''
+    A small synthetic Survey Monkey export and its matching Avatar report (CSV), as (export path, report path).
+    '''
+    return synthetic_data.write_dataset(str(tmp_path_factory.mktemp('synthetic')), 600, seed=7, misspell_rate=0.05)
+
+def write_recent_dataset(directory, rows, seed=0):
+    '''
+    Writes a synthetic export and Avatar report with one episode per client, admitted in the first half of 2024, so
+    every assessment falls inside the duplicate index's retention window. Returns (export path, report path).
+    '''
+    os.makedirs(directory, exist_ok=True)
+    roster = synthetic_data.generate_roster(max(10, rows // 6), seed=seed, start='2024-01-01', end='2024-12-31',
+                                            max_episodes=1)
+    export, report = os.path.join(directory, 'export.csv'), os.path.join(directory, 'report.csv')
+    pd.concat(synthetic_data.iter_survey_export(roster, rows, seed=seed, end='2024-12-31')).to_csv(export, index=False)
+    synthetic_data.avatar_report(roster).to_csv(report, index=False)
+    return export, report
+
+def cleaned_frame(rows, **items):
+    '''
+    Builds a cleaned frame (clean_data layout) of `rows` assessments with every item answered 1, except the item
+    columns given as keyword arguments, which take that value (a scalar or one value per row).
+    '''
+    frame = pd.DataFrame({
+        'name': pd.Series([f'Client,{number}' for number in range(rows)], dtype='category'),
+        'assess_date': pd.date_range('2024-01-01', periods=rows, freq='D'),
+        'cottage': pd.Series(['Cottage A'] * rows, dtype='category'),
+    })
+    for column in EXPORT_COLUMNS[4:]:
+        frame[column] = items.get(column, 1)
+    return compact_items(frame)
+
+@pytest.fixture
+def cleaned():
+    return cleaned_frame
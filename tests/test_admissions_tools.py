@@ -0,0 +1,56 @@
+import pandas as pd
+
+from admissions_tools import AdmissionsStore
+from conftest import write_recent_dataset
+from import_prep import _run_report_group
+import synthetic_data
+
+# A discharged episode in every report, so no report column is entirely blank
+DISCHARGED = ['Sam', 'Lee', 1000, 1, '2023-01-01', '2023-02-01', 'Residential Program']
+
+def write_report(path, episodes):
+    roster = pd.DataFrame([DISCHARGED] + episodes, columns=['first_name', 'last_name', 'pid', 'epn', 'adm_date', 'disc_date', 'program'])
+    roster['adm_date'] = pd.to_datetime(roster['adm_date'])
+    roster['disc_date'] = pd.to_datetime(roster['disc_date'])
+    synthetic_data.avatar_report(roster).to_csv(path, index=False)
+    return str(path)
+
+def stored(store):
+    return store.frame().set_index(['pid', 'epn']).sort_index()
+
+def test_older_report_does_not_reopen_a_discharged_episode(tmp_path):
+    older = write_report(tmp_path / 'older.csv', [['Maria', 'Johnson', 1001, 1, '2024-01-01', None, 'Residential Program']])
+    newer = write_report(tmp_path / 'newer.csv', [['Maria', 'Johnson', 1001, 1, '2024-01-01', '2024-03-01', 'Residential Program']])
+    with AdmissionsStore(str(tmp_path / 'admissions.sqlite')) as store:
+        assert store.refresh(newer) == 2
+        assert store.refresh(older) == 0
+        assert stored(store).loc[(1001, 1), 'disc_date'] == pd.Timestamp('2024-03-01')
+        assert store.refresh(newer) == 0  # same file, skipped
+
+def test_refresh_all_loads_reports_oldest_first(tmp_path):
+    older = write_report(tmp_path / 'older.csv', [['Maria', 'Jonhson', 1001, 1, '2024-01-01', None, 'Residential Program']])
+    newer = write_report(tmp_path / 'newer.csv', [['Maria', 'Johnson', 1001, 1, '2024-01-01', None, 'Residential Program'],
+                                                  ['Alex', 'Smith', 1002, 1, '2024-02-01', None, 'Residential Program']])
+    broken = tmp_path / 'broken.csv'
+    broken.write_text('not a report\n')
+    errors = {}
+    with AdmissionsStore(str(tmp_path / 'admissions.sqlite')) as store:
+        changed = store.refresh_all([newer, str(broken), older], errors=errors)
+        assert list(errors) == [str(broken)]
+        assert changed[older] == 2 and changed[newer] == 2  # the newer report corrects the name
+        episodes = stored(store)
+        assert episodes.loc[(1001, 1), 'name'] == 'Johnson,Maria'
+        assert len(episodes) == 3
+
+def test_report_groups_use_the_store_without_reloading(tmp_path, monkeypatch):
+    export, report = write_recent_dataset(str(tmp_path / 'data'), 120, seed=5)
+    database = str(tmp_path / 'admissions.sqlite')
+    with AdmissionsStore(database) as store:
+        store.refresh_all([report])
+
+    def refresh(self, *args, **kwargs):
+        raise AssertionError("report loaded a second time")
+    monkeypatch.setattr(AdmissionsStore, 'refresh', refresh)
+    batch = {'batch_id': 1, 'raw_file': export, 'avatar_report': report, 'output_dir': str(tmp_path / 'out')}
+    [summary] = _run_report_group(report, [batch], admissions_db=database)
+    assert summary['status'] == 'ok', summary['error']
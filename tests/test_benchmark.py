@@ -0,0 +1,14 @@
+import pytest
+
+import benchmark
+
+@pytest.mark.parametrize('repeat', ['0', '-2'])
+def test_repeat_must_be_positive(repeat):
+    with pytest.raises(SystemExit):
+        benchmark.main(['--sizes', '1k', '--repeat', repeat])
+    with pytest.raises(ValueError):
+        benchmark._measure(lambda: None, int(repeat))
+
+def test_measure_returns_the_result():
+    result, measurement = benchmark._measure(lambda: 42, 1)
+    assert result == 42 and set(measurement) == {'seconds', 'peak_mb'}
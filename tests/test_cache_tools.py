@@ -0,0 +1,50 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import cache_tools
+import measure_tools
+from cache_tools import FrameCache, cached_clean_data, clean_data_schema, avatar_report_schema
+
+def test_repeat_load_is_served_from_the_cache(dataset, tmp_path):
+    export, _ = dataset
+    cache = FrameCache(str(tmp_path / 'cache'))
+    first = cached_clean_data(export, cache=cache)
+    second = cached_clean_data(export, cache=cache)
+    pd.testing.assert_frame_equal(first, second)
+    assert len(os.listdir(cache.directory)) == 1
+
+@pytest.mark.parametrize('name, value', [('INVALID_RESPONSE', 254), ('ITEM_DTYPE', 'UInt16')])
+def test_clean_data_key_covers_item_compaction(monkeypatch, name, value):
+    before = clean_data_schema()
+    monkeypatch.setattr(measure_tools, name, value)
+    assert clean_data_schema() != before
+
+def test_clean_data_key_covers_helper_functions(monkeypatch):
+    before = clean_data_schema(), avatar_report_schema()
+    monkeypatch.setattr(measure_tools, 'compact_items', lambda dataframe, first_item='ders_1': dataframe)
+    monkeypatch.setattr(measure_tools, 'compact_ids', lambda series, dtype: series)
+    after = clean_data_schema(), avatar_report_schema()
+    assert before[0] != after[0] and before[1] != after[1]
+
+def test_store_keeps_an_entry_another_worker_wrote_first(tmp_path):
+    cache = FrameCache(str(tmp_path / 'cache'))
+    theirs = pd.DataFrame({'value': [1, 2, 3]})
+    cache.store('key', theirs)
+    cache.store('key', pd.DataFrame({'value': [4, 5, 6]}))
+    pd.testing.assert_frame_equal(cache.load('key'), theirs)
+    assert os.listdir(cache.directory) == ['key']  # no staging directories left behind
+
+def test_entry_evicted_while_loading_is_a_miss(tmp_path, monkeypatch):
+    cache = FrameCache(str(tmp_path / 'cache'))
+    cache.store('key', pd.DataFrame({'value': [1, 2, 3]}))
+    load_column = cache_tools._load_column
+
+    def evicted(directory, position, column):
+        # Another worker removes the entry after this one has read its manifest
+        shutil.rmtree(directory)
+        return load_column(directory, position, column)
+    monkeypatch.setattr(cache_tools, '_load_column', evicted)
+    assert cache.load('key') is None
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from column_tools import ScoreColumns
+from measure_tools import INSTRUMENTS, ScoringEngine, clean_data, score_frame
+
+def history(dataset):
+    cleaned = clean_data(dataset[0]).reset_index(drop=True)
+    return cleaned.iloc[:250], cleaned.iloc[250:]
+
+def test_frame_equals_score_frame(dataset, tmp_path):
+    first, second = history(dataset)
+    columns = ScoreColumns(str(tmp_path / 'columns'))
+    columns.append(first, batch_id=1)
+    columns.append(second, batch_id=2)
+    assert columns.append(second, batch_id=2) is None
+
+    expected = score_frame(pd.concat([first, second], ignore_index=True))
+    frame = columns.frame()
+    assert frame.columns.tolist() == expected.columns.tolist()
+    pd.testing.assert_frame_equal(frame, expected, check_dtype=False, check_categorical=False)
+    assert columns.stale() == []
+
+def test_changing_one_spec_recomputes_only_its_columns(dataset, tmp_path):
+    first, second = history(dataset)
+    directory = str(tmp_path / 'columns')
+    columns = ScoreColumns(directory)
+    columns.append(first)
+    columns.append(second)
+    original = columns.frame()
+
+    # dts_6 is no longer reverse keyed: only the subscale using it and the composite built on that change
+    instruments = dict(INSTRUMENTS, dts=INSTRUMENTS['dts']._replace(reverse_keyed=[]))
+    changed = ScoreColumns(directory, instruments=instruments)
+    assert sorted(changed.stale()) == ['dts_appraisal', 'dts_overall']
+    frame = changed.frame()
+    assert changed.computed == 2 * 2  # two columns in each of the two segments
+
+    expected = ScoringEngine(instruments.values()).score_frame(pd.concat([first, second], ignore_index=True))
+    for column in ['dts_appraisal', 'dts_overall', 'dts_tolerance', 'ders_overall']:
+        np.testing.assert_allclose(frame[column].to_numpy(), expected[column].to_numpy())
+    assert not np.allclose(frame['dts_appraisal'], original['dts_appraisal'], equal_nan=True)
+    assert sorted(ScoreColumns(directory).stale()) == ['dts_appraisal', 'dts_overall']  # the original version was replaced
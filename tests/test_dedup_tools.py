@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+from cache_tools import cached_clean_avatar_report
+from dedup_tools import DuplicateIndex, flag_duplicates, UNIQUE, EXACT_DUPLICATE, NEAR_DUPLICATE, DUPLICATE
+from import_prep import prepare_import, run_batch, run_batches
+from conftest import write_recent_dataset
+
+def test_flags_within_the_frame_and_against_earlier_batches(cleaned, tmp_path):
+    frame = cleaned(4, ari_1=[0, 1, 2, 2])
+    frame['name'] = frame['name'].cat.set_categories(['Client,0', 'Client,1', 'Client,2'])
+    frame.loc[3, ['name', 'assess_date']] = frame.loc[2, ['name', 'assess_date']].to_numpy()  # row 3 repeats row 2
+    frame.loc[1, 'assess_date'] = frame.loc[0, 'assess_date']
+    frame.loc[1, 'name'] = 'Client,0'                                                          # same visit, new answers
+    flagged = flag_duplicates(frame)
+    assert list(flagged['duplicate_status']) == [UNIQUE, NEAR_DUPLICATE, UNIQUE, EXACT_DUPLICATE]
+    assert list(flagged['duplicate_of'])[1:] == ['row 0', None, 'row 2']
+
+    index = DuplicateIndex(str(tmp_path / 'index.npz'))
+    index.record(frame.loc[[0, 2]], batch_id=7)
+    again = flag_duplicates(frame.loc[[0, 2]], DuplicateIndex(index.path))
+    assert list(again['duplicate_status']) == [EXACT_DUPLICATE, EXACT_DUPLICATE]
+    assert list(again['duplicate_of']) == ['batch 7', 'batch 7']
+    own = flag_duplicates(frame.loc[[0, 2]], DuplicateIndex(index.path), batch_id=7)
+    assert list(own['duplicate_status']) == [UNIQUE, UNIQUE]
+
+def test_recording_a_batch_again_replaces_its_entries(cleaned, tmp_path):
+    index = DuplicateIndex(str(tmp_path / 'index.npz'))
+    index.record(cleaned(5), batch_id=1)
+    index.record(cleaned(3), batch_id=2)
+    index.record(cleaned(4), batch_id=1)
+    stored = DuplicateIndex(index.path)
+    assert len(stored) == 7
+    assert sorted(np.unique(stored.batches, return_counts=True)[1]) == [3, 4]
+
+def test_rerunning_a_batch_does_not_flag_its_own_rows(tmp_path):
+    export, report = write_recent_dataset(str(tmp_path / 'data'), 300, seed=11)
+    index = str(tmp_path / 'index.npz')
+    first = run_batch(1, export, report, str(tmp_path / 'first'), dedup_index=index)
+    second = run_batch(1, export, report, str(tmp_path / 'second'), dedup_index=index)
+    assert first['status'] == second['status'] == 'ok'
+    assert second['outcomes'] == first['outcomes']
+    assert len(DuplicateIndex(index)) == first['outcomes'].get('matched', 0) + first['outcomes'].get('fuzzy_matched', 0)
+
+def test_parallel_batches_all_reach_the_index(tmp_path):
+    batches = []
+    for number in range(3):
+        export, report = write_recent_dataset(str(tmp_path / f'data{number}'), 120, seed=20 + number)
+        batches.append({'batch_id': number, 'raw_file': export, 'avatar_report': report,
+                        'output_dir': str(tmp_path / f'out{number}')})
+    index = str(tmp_path / 'index.npz')
+    summaries = run_batches(batches, max_workers=3, dedup_index=index)
+    assert [summary['status'] for summary in summaries] == ['ok'] * 3
+    assert all('combined' not in summary for summary in summaries)
+    exported = {summary['batch_id']: summary['outcomes'].get('matched', 0) + summary['outcomes'].get('fuzzy_matched', 0)
+                for summary in summaries}
+    batches_recorded, counts = np.unique(DuplicateIndex(index).batches, return_counts=True)
+    assert dict(zip(batches_recorded.tolist(), counts.tolist())) == exported
+
+def test_overlapping_batches_in_one_manifest_are_checked_against_each_other(tmp_path):
+    # A cumulative export run as two batches: the second holds every submission of the first
+    export, report = write_recent_dataset(str(tmp_path / 'data'), 240, seed=31)
+    first = str(tmp_path / 'first.csv')
+    raw = pd.read_csv(export, dtype=str)
+    raw.iloc[:121].to_csv(first, index=False)
+    batches = [{'batch_id': 'early', 'raw_file': first, 'avatar_report': report, 'output_dir': str(tmp_path / 'early')},
+               {'batch_id': 'later', 'raw_file': export, 'avatar_report': report, 'output_dir': str(tmp_path / 'later')}]
+    early, later = run_batches(batches, max_workers=2, dedup_index=str(tmp_path / 'index.npz'))
+    assert early['status'] == later['status'] == 'ok'
+    exported_early = early['outcomes'].get('matched', 0) + early['outcomes'].get('fuzzy_matched', 0)
+    assert exported_early > 0
+    assert later['outcomes'].get(DUPLICATE, 0) >= exported_early
+
+def test_rows_sharing_a_name_keep_their_export_order(cleaned, dataset):
+    frame = cleaned(60)
+    frame['name'] = pd.Series(['Client,Same'] * 60, dtype='category').to_numpy()
+    frame['assess_date'] = pd.Timestamp('2024-01-01')
+    frame.index = np.arange(60)[::-1]
+    combined = prepare_import(frame, cached_clean_avatar_report(dataset[1]))
+    assert combined.index.tolist() == frame.index.tolist()
@@ -0,0 +1,42 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from export_tools import IMPORT_LAYOUT
+from import_prep import run_batch
+from measure_tools import EXPORT_COLUMNS, INSTRUMENTS, INVALID_RESPONSE, score_ari
+
+def write_export_with_bad_responses(export, path):
+    # Raw item columns follow the same order as the cleaned ones, starting 14 columns in
+    raw = pd.read_csv(export, dtype=str)
+    position = {item: 14 + number for number, item in enumerate(EXPORT_COLUMNS[4:])}
+    raw.iloc[1:6, position['ari_1']] = 'often'
+    raw.iloc[1:6, position['ari_2']] = '9'
+    raw.iloc[6:8, position['ders_3']] = 'sometimes'
+    raw.to_csv(path, index=False)
+    return str(path)
+
+def test_text_responses_never_reach_the_import_files(dataset, tmp_path):
+    export, report = dataset
+    export = write_export_with_bad_responses(export, tmp_path / 'export.csv')
+    summary = run_batch(1, export, report, str(tmp_path / 'out'))
+    assert summary['status'] == 'ok', summary['error']
+
+    for path in glob.glob(os.path.join(tmp_path, 'out', '*.csv')):
+        written = pd.read_csv(path, dtype=str)
+        items = [column for column in written.columns if column in EXPORT_COLUMNS[4:]]
+        assert not written[items].isin(['often', 'sometimes', str(INVALID_RESPONSE)]).any(axis=None), path
+        ari = written[[column for column in items if column.startswith('ari_')]]
+        assert not ari.isin(['9']).any(axis=None), path  # out of the ARI's 0-2 range
+        if 'ari_total' in written.columns:
+            # The total is the engine's ARI score, which leaves out the unscored item 7
+            responses = written[INSTRUMENTS['ari'].items].apply(pd.to_numeric, errors='coerce')
+            expected = score_ari(responses).to_numpy()
+            total = pd.to_numeric(written['ari_total'], errors='coerce').to_numpy()
+            assert np.array_equal(total, expected, equal_nan=True), path
+            assert not (total > 12).any()
+    assert set(summary['files']) == set(IMPORT_LAYOUT) | {'unmatched'}
+    ari = pd.concat([pd.read_csv(summary['files'][name], dtype=str) for name in ['ari', 'unmatched']])
+    assert (ari['ari_1'] == 'Missing').sum() == 5  # the text responses are written as missing
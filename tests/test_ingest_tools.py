@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+from ingest_tools import SOURCE_COLUMN, expand_sources, ingest_exports
+from measure_tools import clean_data
+import synthetic_data
+
+@pytest.fixture
+def exports(tmp_path):
+    # Two sites' exports with dotted names, plus a file a directory source should skip
+    directory = tmp_path / 'exports'
+    paths = []
+    for number, rows in enumerate([120, 90]):
+        written, _ = synthetic_data.write_dataset(str(tmp_path / f'site{number}'), rows, seed=40 + number)
+        path = directory / f'site {number}.2024.03.csv'
+        os.makedirs(directory, exist_ok=True)
+        os.replace(written, path)
+        paths.append(str(path))
+    (directory / 'notes.txt').write_text('not an export')
+    return str(directory), paths
+
+def test_globs_directories_and_lists_expand_to_the_same_files(exports):
+    directory, paths = exports
+    assert expand_sources(directory) == paths
+    assert expand_sources(os.path.join(directory, '*.csv')) == paths
+    assert expand_sources([paths[1], os.path.join(directory, '*.csv')]) == [paths[1], paths[0]]
+    with pytest.raises(FileNotFoundError):
+        expand_sources(os.path.join(directory, '*.xlsx'))
+
+def test_every_row_is_tagged_with_its_source(exports):
+    directory, paths = exports
+    combined = ingest_exports(directory, max_workers=2)
+    expected = {path: len(clean_data(path)) for path in paths}
+    assert len(combined) == sum(expected.values())
+    assert combined[SOURCE_COLUMN].value_counts().to_dict() == expected
+    assert combined.columns[0] == SOURCE_COLUMN
+    assert combined['name'].dtype == 'category'
+    assert combined[['name', 'assess_date']].equals(
+        combined[['name', 'assess_date']].sort_values(['name', 'assess_date'], kind='mergesort'))
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from longitudinal_tools import (cronbach_alpha, change_report, IMPROVED, DETERIORATED, NO_RELIABLE_CHANGE,
+                                INSUFFICIENT_DATA)
+from measure_tools import INVALID_RESPONSE
+
+def scored(rows):
+    return pd.DataFrame(rows, columns=['name', 'assess_date', 'dts_overall', 'camm']).assign(
+        assess_date=lambda frame: pd.to_datetime(frame['assess_date']))
+
+# With these, the RCI denominator SD * sqrt(2 * (1 - reliability)) is just the SD
+RELIABILITY = {'dts_overall': 0.5, 'camm': 0.5}
+SD = {'dts_overall': 1.0, 'camm': 5.0}
+
+def test_change_uses_first_and_last_valid_scores_in_the_better_direction():
+    scores = scored([
+        ['Better,Ann', '2024-01-01', np.nan, 30], ['Better,Ann', '2024-02-01', 2.0, 25],
+        ['Better,Ann', '2024-03-01', 4.5, 10],
+        ['Worse,Bob', '2024-01-05', 4.0, 10], ['Worse,Bob', '2024-03-05', 2.0, 30],
+        ['Steady,Cy', '2024-01-10', 3.0, 20], ['Steady,Cy', '2024-02-10', 3.5, 22],
+    ])
+    report = change_report(scores, RELIABILITY, baseline_sd=SD).set_index('name')
+
+    ann = report.loc['Better,Ann']
+    assert (ann['dts_overall_baseline'], ann['dts_overall_latest']) == (2.0, 4.5)  # the first score was missing
+    assert ann['dts_overall_rci'] == pytest.approx(2.5)
+    assert ann['camm_rci'] == pytest.approx(-4.0)
+    assert ann['dts_overall_status'] == ann['camm_status'] == IMPROVED  # higher DTS, lower CAMM
+    assert ann['n_assessments'] == 3
+
+    bob = report.loc['Worse,Bob']
+    assert bob['dts_overall_status'] == bob['camm_status'] == DETERIORATED
+    assert report.loc['Steady,Cy', 'dts_overall_status'] == report.loc['Steady,Cy', 'camm_status'] == NO_RELIABLE_CHANGE
+
+def test_a_single_valid_assessment_has_no_change():
+    scores = scored([['Once,Dee', '2024-01-01', 3.0, 12], ['Once,Dee', '2024-02-01', np.nan, np.nan],
+                     ['Twice,Eve', '2024-01-01', 2.0, 12], ['Twice,Eve', '2024-02-01', 2.5, 11]])
+    dee = change_report(scores, RELIABILITY, baseline_sd=SD).set_index('name').loc['Once,Dee']
+    assert dee['n_assessments'] == 2
+    assert dee['dts_overall_baseline'] == dee['dts_overall_latest'] == 3.0
+    assert np.isnan(dee['dts_overall_change']) and np.isnan(dee['dts_overall_rci'])
+    assert dee['dts_overall_status'] == dee['camm_status'] == INSUFFICIENT_DATA
+
+def test_cronbach_alpha(cleaned):
+    # ders_clarity has two items with variances 1 and 1 and totals with variance 3: alpha = 2 * (1 - 2/3)
+    frame = cleaned(4, ders_1=[1, 2, 3, 2], ders_2=[1, 3, 2, INVALID_RESPONSE],
+                    **{f'camm_{number}': [0, 2, 4, 1] for number in range(1, 11)})
+    alpha = cronbach_alpha(frame)
+    assert alpha['ders_clarity'] == pytest.approx(2 / 3)  # the out-of-range row is left out
+    assert alpha['camm'] == pytest.approx(1.0)  # identical items
+    assert np.isnan(cronbach_alpha(frame.iloc[:1])['camm'])
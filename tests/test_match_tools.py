@@ -0,0 +1,52 @@
+import pandas as pd
+
+from match_tools import (EpisodeIndex, NameIndex, MATCHED, NO_EPISODE, NO_NAME, FUZZY_MATCHED, normalize_name,
+                         soundex)
+
+def avatar_frame(rows):
+    return pd.DataFrame(rows, columns=['name', 'pid', 'adm_date', 'disc_date', 'epn', 'program']).astype(
+        {'adm_date': 'datetime64[ns]', 'disc_date': 'datetime64[ns]'})
+
+EPISODES = avatar_frame([
+    ['Johnson,Maria', 1001, '2024-01-01', '2024-03-01', 1, 'Residential Program'],
+    ['Johnson,Maria', 1001, '2024-06-01', None, 2, 'Residential Program'],          # still open
+    ['Smith,Alex', 1002, '2023-01-01', '2024-12-31', 1, 'Residential Program'],
+    ['Smith,Alex', 1002, '2023-06-01', '2023-07-01', 2, 'Residential Program'],     # nested in episode 1
+])
+
+def assessments(*rows):
+    return pd.DataFrame(rows, columns=['name', 'assess_date']).astype({'assess_date': 'datetime64[ns]'})
+
+def test_episode_index_outcomes():
+    matched = EpisodeIndex(EPISODES).match(assessments(
+        ['Johnson,Maria', '2024-02-01'], ['Johnson,Maria', '2024-04-01'], ['Johnson,Maria', '2025-01-01'],
+        ['Smith,Alex', '2024-02-01'], ['Nobody,Here', '2024-02-01']))
+    assert list(matched['match_status']) == [MATCHED, NO_EPISODE, MATCHED, MATCHED, NO_NAME]
+    assert list(matched['epn'].fillna(0)) == [1, 0, 2, 1, 0]
+
+def test_misspelled_name_is_resolved():
+    index = EpisodeIndex(EPISODES)
+    resolved = NameIndex(EPISODES, index).resolve(index.match(assessments(['Jonhson,Maria', '2024-02-01'])))
+    assert resolved['match_status'].iloc[0] == FUZZY_MATCHED
+    assert resolved['suggested_name'].iloc[0] == 'Johnson,Maria'
+    assert resolved['epn'].iloc[0] == 1
+
+def test_names_are_scored_once_per_normalized_name(monkeypatch):
+    names = NameIndex(EPISODES)
+    calls = []
+    score = names.score
+    monkeypatch.setattr(names, 'score', lambda *args: calls.append(args[0]) or score(*args))
+    rows = assessments(*[[' jonhson, Maria ', '2024-02-01']] * 50, *[['Jonhson,Maria', '2024-07-01']] * 50)
+    suggestions = names.suggest(rows, k=1)
+    assert len(suggestions) == 100
+    assert set(calls) == {normalize_name('Jonhson,Maria')}
+    assert len(calls) == len(names.candidates('Jonhson,Maria'))
+
+def test_phonetic_candidates_are_capped():
+    # Every name shares the last name's Soundex code with the query, but only max_phonetic of them are scored
+    crowd = avatar_frame([[f'Jonson,{first}{suffix}', 2000 + number, '2024-01-01', None, 1, 'Residential Program']
+                          for number, (first, suffix) in enumerate((first, suffix) for first in 'abcdefghij'
+                                                                   for suffix in ['x', 'yy', 'zzz', 'wq', 'vk'])])
+    names = NameIndex(crowd, min_shared_trigrams=100, max_phonetic=5)
+    assert soundex('jonson') == soundex('johnsen')
+    assert len(names.candidates('Johnsen,Mike')) == 5
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+import measure_tools
+from measure_tools import (INSTRUMENTS, OUT_OF_RANGE, INVALID_RESPONSE, clean_data, generate_scores, score_dts,
+                           score_ceas, stream_scores, validity_flags)
+
+def test_score_dts_does_not_modify_the_input(cleaned):
+    frame = cleaned(3, dts_6=[1, 2, 5])
+    before = frame.copy()
+    score_dts(frame)
+    score_dts(frame)
+    pd.testing.assert_frame_equal(frame, before)
+
+def test_dts_6_is_reverse_keyed_once(cleaned):
+    # Appraisal is the mean of dts_6 (reversed), 7, 9, 10, 11 and 12; every other item is answered 1
+    frame = cleaned(2, dts_6=[1, 5])
+    first = score_dts(frame)[2]
+    second = score_dts(frame)[2]
+    np.testing.assert_allclose(first, [(5 + 5 * 1) / 6, (1 + 5 * 1) / 6])
+    np.testing.assert_allclose(second, first)
+
+def test_ceas_to_is_scored_from_ceas_to_items_only(cleaned):
+    frame = cleaned(1, **{item: 10 for item in INSTRUMENTS['ceas'].items if not item.startswith('ceas_to_')})
+    ceas_self, ceas_to, ceas_from = score_ceas(frame)
+    assert ceas_to.iloc[0] == 10  # ten scored items answered 1; items 3, 7 and 11 are not scored
+    assert ceas_self.iloc[0] == ceas_from.iloc[0] == 100
+
+def test_invalid_responses_are_flagged_and_scored_as_missing(cleaned):
+    frame = cleaned(1, ari_1='often', ari_2=7)
+    assert frame['ari_1'].iloc[0] == INVALID_RESPONSE
+    scores = generate_scores(frame)
+    assert validity_flags(scores['validity'])['ari_flags'].iloc[0] & OUT_OF_RANGE
+    assert pd.isna(scores['ari'].iloc[0])  # ARI allows no missing items
+
+def test_stream_scores_matches_generate_scores(dataset, tmp_path):
+    export, _ = dataset
+    output = tmp_path / 'scores.csv'
+    written = stream_scores(export, str(output), chunksize=97)
+    streamed = pd.read_csv(output)
+    expected = generate_scores(clean_data(export)).reset_index(drop=True)
+    assert written == len(expected)
+    assert list(streamed['name']) == list(expected['name'].astype(str))
+    for column in ['ders_overall', 'ari', 'dts_overall', 'ceas_to', 'camm', 'validity']:
+        np.testing.assert_allclose(streamed[column].to_numpy(dtype='float64'), expected[column].to_numpy(dtype='float64'))
+
+def test_compact_items_uses_item_dtype(cleaned, monkeypatch):
+    assert (cleaned(3).loc[:, 'ders_1':].dtypes == measure_tools.ITEM_DTYPE).all()
+    monkeypatch.setattr(measure_tools, 'ITEM_DTYPE', 'UInt16')
+    frame = cleaned(3, ders_1=[1, None, 'often'])
+    assert (frame.loc[:, 'ders_1':].dtypes == 'UInt16').all()
+    assert frame['ders_1'].tolist() == [1, pd.NA, measure_tools.INVALID_RESPONSE]
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from norms_tools import NormsTable, ALL_COHORT, attach_percentiles
+
+def scores(values, programs=None):
+    return pd.DataFrame({'program': programs or ['Residential'] * len(values), 'ari': values})
+
+def assert_same_tables(left, right):
+    assert sorted(left.tables) == sorted(right.tables)
+    for key, (values, counts) in left.tables.items():
+        np.testing.assert_array_equal(values, right.tables[key][0])
+        np.testing.assert_array_equal(counts, right.tables[key][1])
+
+def test_percentile_ranks_at_the_edges():
+    norms = NormsTable(cohort_columns=[], subscales=['ari']).update(scores([1, 2, 2, 3]))
+    ranks = norms.percentiles(scores([0, 1, 2, 3, 4, np.nan]), min_size=1)['ari_pct'].to_numpy()
+    # Below everything, then (share below + half the share tied) for each value, then above everything
+    np.testing.assert_allclose(ranks, [0, 12.5, 50, 87.5, 100, np.nan])
+
+def test_small_cohorts_are_ranked_against_everyone():
+    history = scores([1, 2, 3, 4, 10], ['Residential'] * 4 + ['PHP'])
+    norms = NormsTable(subscales=['ari']).update(history)
+    ranked = attach_percentiles(scores([4, 4], ['Residential', 'PHP']), norms, min_size=2)
+    assert ranked['ari_pct'].tolist() == [87.5, 70.0]  # PHP has one score on record, so the population norm is used
+    assert norms.cohort_size(ALL_COHORT, 'ari') == 5
+
+def test_merging_tables_equals_one_table_fed_both():
+    first, second = scores([1, 2, 2, 5], ['Residential', 'PHP', 'PHP', 'Residential']), scores([2, 3], ['PHP', 'PHP'])
+    together = NormsTable(subscales=['ari']).update(pd.concat([first, second]))
+    merged = NormsTable(subscales=['ari']).update(first).merge(NormsTable(subscales=['ari']).update(second))
+    sequential = NormsTable(subscales=['ari']).update(first).update(second)
+    assert_same_tables(merged, together)
+    assert_same_tables(sequential, together)
+    with pytest.raises(ValueError):
+        merged.merge(NormsTable(cohort_columns=[], subscales=['ari']))
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / 'norms.npz')
+    assert NormsTable.load(path) is None
+    norms = NormsTable(subscales=['ari']).update(scores([1, 2, 2, 3], ['Residential', 'PHP', 'PHP', 'PHP']),
+                                                 batch_id='2024-Q1')
+    norms.save(path)
+    loaded = NormsTable.load(path)
+    assert_same_tables(loaded, norms)
+    assert (loaded.cohort_columns, loaded.subscales, loaded.batches) == (['program'], ['ari'], ['2024-Q1'])
+    loaded.update(scores([9]), batch_id='2024-Q1')  # already added
+    assert_same_tables(loaded, norms)
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cli
+import measure_tools
+from rollup_tools import RollupTable
+from store_tools import FINGERPRINT, ScoreStore, incremental_scores
+
+def _partial_export(export_path, path, rows):
+    # The first `rows` submissions of a cumulative export, with Survey Monkey's question-text row kept
+    measure_tools.read_export(export_path).iloc[:rows + 1].to_csv(path, index=False)
+    return str(path)
+
+def _counted(path):
+    return int(RollupTable(str(path)).summary(by=[])['ders_overall_n'].iloc[0])
+
+def test_score_rollups_count_each_submission_once(dataset, tmp_path):
+    export_path, _ = dataset
+    rollups = tmp_path / 'rollups.npz'
+    first = _partial_export(export_path, tmp_path / 'first.csv', 300)
+    output = str(tmp_path / 'scores.csv')
+
+    store = ['--store', str(tmp_path / 'store')]
+
+    cli.main(['score', first, '--rollups', str(rollups), *store, '-o', output])
+    after_first = _counted(rollups)
+    cli.main(['score', export_path, '--rollups', str(rollups), *store, '-o', output])
+    cli.main(['score', export_path, '--rollups', str(rollups), *store, '-o', output])
+
+    expected = measure_tools.generate_scores(measure_tools.clean_data(export_path))
+    assert 0 < after_first < _counted(rollups)
+    assert _counted(rollups) == int(expected['ders_overall'].notna().sum())
+    assert len(pd.read_csv(output)) == len(expected)
+
+def test_store_reset_does_not_recount(dataset, tmp_path):
+    export_path, _ = dataset
+    store = ScoreStore(str(tmp_path / 'store'))
+    rollups = RollupTable(str(tmp_path / 'rollups.npz'))
+    incremental_scores(export_path, store, rollups=rollups)
+    counted = _counted(tmp_path / 'rollups.npz')
+
+    store.clear()  # What a schema change does: every submission is scored again
+    incremental_scores(export_path, store, rollups=RollupTable(str(tmp_path / 'rollups.npz')))
+    assert _counted(tmp_path / 'rollups.npz') == counted
+
+def test_update_needs_fingerprints_and_remembers_them(dataset, tmp_path):
+    export_path, _ = dataset
+    scores = measure_tools.generate_scores(measure_tools.clean_data(export_path))
+    with pytest.raises(ValueError):
+        RollupTable().update(scores)
+
+    scores.index = pd.Index(np.arange(len(scores), dtype=np.uint64)[::-1], name=FINGERPRINT)
+    path = str(tmp_path / 'rollups.npz')
+    RollupTable(path).update(scores.iloc[:100])
+    reloaded = RollupTable(path)
+    assert reloaded.seen(scores.index[:100]).all() and not reloaded.seen(scores.index[100:]).any()
+    reloaded.update(scores)
+    assert _counted(path) == int(scores['ders_overall'].notna().sum())
+
+def test_score_rollups_need_a_store_and_the_cache(dataset, tmp_path):
+    export_path, _ = dataset
+    rollups = str(tmp_path / 'rollups.npz')
+    with pytest.raises(SystemExit):
+        cli.main(['score', export_path, '--rollups', rollups])
+    with pytest.raises(SystemExit):
+        cli.main(['score', export_path, '--rollups', rollups, '--store', str(tmp_path / 'store'), '--no-cache'])
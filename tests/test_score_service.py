@@ -0,0 +1,73 @@
+import asyncio
+import json
+import threading
+
+from score_service import MAX_BODY_BYTES, ScoringServer
+
+class StubService:
+    '''
+    Echoes submissions back. While `hold` is clear, score_batch waits; batches with more than `fail_over` submissions
+    raise ValueError, so the batcher falls back to scoring each request on its own.
+    '''
+    episodes = 0
+
+    def __init__(self, fail_over=None):
+        self.hold = threading.Event()
+        self.hold.set()
+        self.fail_over = fail_over
+
+    def score_batch(self, submissions):
+        self.hold.wait(5)
+        if self.fail_over is not None and len(submissions) > self.fail_over:
+            raise ValueError("batch too large")
+        return list(submissions)
+
+async def _exchange(port, raw):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(raw)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+def test_malformed_requests_get_400():
+    async def run():
+        server = await ScoringServer(StubService(), host='127.0.0.1', port=0).start()
+        try:
+            bad_line = await _exchange(server.port, b'GARBAGE\r\n\r\n')
+            bad_length = await _exchange(server.port, b'POST /score HTTP/1.1\r\nContent-Length: ten\r\n\r\n')
+            too_large = await _exchange(
+                server.port, f'POST /score HTTP/1.1\r\nContent-Length: {MAX_BODY_BYTES + 1}\r\n\r\n'.encode())
+            health = await _exchange(server.port, b'GET /health HTTP/1.1\r\nConnection: close\r\n\r\n')
+        finally:
+            await server.stop()
+        return bad_line, bad_length, too_large, health
+
+    bad_line, bad_length, too_large, health = asyncio.run(run())
+    assert bad_line.startswith(b'HTTP/1.1 400')
+    assert bad_length.startswith(b'HTTP/1.1 400')
+    assert too_large.startswith(b'HTTP/1.1 413')
+    assert json.loads(too_large.split(b'\r\n\r\n', 1)[1])['error'].startswith('Request body of')
+    assert health.startswith(b'HTTP/1.1 200')
+
+def test_cancelled_caller_does_not_stop_the_batcher():
+    async def run():
+        service = StubService(fail_over=1)
+        server = await ScoringServer(service, host='127.0.0.1', port=0, max_delay_ms=50).start()
+        try:
+            service.hold.clear()
+            first = asyncio.create_task(server.score([{'row': 1}]))
+            second = asyncio.create_task(server.score([{'row': 2}]))
+            await asyncio.sleep(0.2)  # Both are in one batch, held inside score_batch
+            first.cancel()
+            service.hold.set()
+            second_result = await asyncio.wait_for(second, 5)
+            later = await asyncio.wait_for(server.score([{'row': 3}]), 5)
+            assert not server.batcher.done()
+        finally:
+            await server.stop()
+        return second_result, later
+
+    second_result, later = asyncio.run(run())
+    assert second_result == [{'row': 2}]
+    assert later == [{'row': 3}]
@@ -0,0 +1,35 @@
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from xml_tools import write_batch, option_identifiers, system_tags
+
+def test_write_batch_lays_out_one_record_per_row(cleaned, tmp_path):
+    frame = cleaned(3, ari_1=[0, 1, None])
+    frame['pid'] = pd.array([1001, 1002, None], dtype='UInt32')
+    frame['epn'] = [1.0, 2.0, np.nan]
+    frame['ari_total'] = [1.5, 7.0, np.nan]
+    path = tmp_path / 'ari.xml'
+    for pretty in (False, True):
+        assert write_batch(frame, 'ari', str(path), pretty=pretty) == 3
+
+        root = ET.parse(path).getroot()
+        assert root.findtext('optionidentifier') == option_identifiers['ari']
+        data = root.find('optiondata')
+        assert [element.text or '' for element in data.findall('PATID')] == ['1001', '1002', '']
+        assert [element.text or '' for element in data.findall('EPISODE_NUMBER')] == ['1', '2', '']
+        records = data.findall(system_tags['ari'])
+        assert [record.findtext('ari_1') for record in records] == ['0', '1', '']
+        assert [record.findtext('ari_total') for record in records] == ['1.5', '7', '']
+        assert [child.tag for child in records[0]] == [f'ari_{number}' for number in range(1, 8)] + ['ari_total']
+
+def test_text_values_are_escaped(cleaned, tmp_path):
+    frame = cleaned(1)
+    frame['pid'], frame['epn'] = ['A&B <1>'], [1]
+    frame['dts_status'] = 'D'
+    path = tmp_path / 'dts.xml'
+    write_batch(frame, 'dts', str(path))
+    data = ET.parse(path).getroot().find('optiondata')
+    assert data.findtext('PATID') == 'A&B <1>'
+    assert data.find(system_tags['dts']).findtext('dts_status') == 'D'
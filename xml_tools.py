@@ -1,25 +1,38 @@
-from numpy.lib.function_base import copy
+import numpy as np
 import pandas as pd
 from xml.etree import ElementTree as ET
-from xml.dom.minidom import parseString
-from collections import namedtuple
+from measure_tools import INSTRUMENTS
+from metrics_tools import stage
 
 # TODO 
 # Think about whether it's logical to create a dictionary to convert df column names into the XML tags
 # If so, does each dictionary live within a separate inherited sub-class or can it be bound to the parent class?
 # Check placement of patient_id and episode_num variables. They are repeated within the XML file so they should probably live in a sub-class
 
+system_tags = {
+    'ders':'SYSTEM.DERS_16',
+    'ari':'SYSTEM.ARI',
+    'dts':'SYSTEM.distress_tolerance',
+    'camm':'SYSTEM.camm'
+}
+
+option_identifiers = {
+    'ders':'USER119',
+    'ari':'USER124',
+    'dts':'USER130',
+    'camm':'USER129'
+}
+
+# Columns written inside each assessment's system tag, in order. Columns missing from a frame are skipped.
+assessment_columns = {
+    'ders': INSTRUMENTS['ders'].items + ['ders_assessment_type', 'ders_draft_final'],
+    'ari': INSTRUMENTS['ari'].items + ['ari_total'],
+    'dts': INSTRUMENTS['dts'].items + ['dts_status'],
+    'camm': INSTRUMENTS['camm'].items
+}
+
 class Batch:
-    mode = None
-    option = ET.Element("option")
-    opt_id = ET.SubElement(option, "optionidentifier")
-    client_data = ET.SubElement(option, "optiondata")
-    system_tags = {
-        'ders':'SYSTEM.DERS_16',
-        'ari':'SYSTEM.ARI',
-        'dts':'SYSTEM.distress_tolerance',
-        'camm':'SYSTEM.camm'
-    }
+    system_tags = system_tags
 
     def __init__(self, assessment_type=None):
         '''
@@ -30,6 +43,12 @@ class Batch:
             - "dts": Distress Tolerance Scale
             - "camm": Child and Adolescent Mindfulness Measure
         '''        
+        # Each batch owns its own document tree
+        self.mode = None
+        self.option = ET.Element("option")
+        self.opt_id = ET.SubElement(self.option, "optionidentifier")
+        self.client_data = ET.SubElement(self.option, "optiondata")
+
         if assessment_type.lower() == "ders":
             self.mode = assessment_type
             self.opt_id.text = "USER119"
@@ -58,9 +77,8 @@ class Batch:
         if self.mode == None:
             return "\nHey everyone, check out this @$$hole. \nBatch wasn't created, go back and specify your assessment type again."
         else:
-            document = ET.tostring(self.option, encoding='utf-8')
-            formatted_xml = parseString(document)
-            return formatted_xml.toprettyxml(indent="\t")
+            ET.indent(self.option, space="\t")  # Indents the tree in place rather than re-parsing a serialized copy
+            return '<?xml version="1.0" ?>\n' + ET.tostring(self.option, encoding='unicode')
     
     def write(self, output_path):
         document = ET.ElementTree(self.option)
@@ -81,12 +99,98 @@ class Batch:
             except KeyError:
                 print(f"DataBlock was initialized with an invalid assessment_type. Valid types include: ['ders', 'ari', 'dts', 'camm']. \nCurrent assessment_type = {self.mode}")
     
-df = pd.read_csv("./data_files/xml_dataset.csv")
 
-# Try again to see if it's possible to access the column headers with df.itertuples()
-for index, item in df.iterrows():
-    print(item['ders_1'])  # prints just the ders_1 for each client.
+class BatchWriter:
+    '''
+    Streams an Avatar import batch straight to an open text file handle instead of building the whole document in
+    memory. Records are built from the column arrays of a cleaned frame a block of rows at a time (no per-row
+    iterrows), so memory use is bounded by block_size no matter how many assessments are written.
+
+    The document has the same layout a Batch produces:
+        <option>
+            <optionidentifier>USER119</optionidentifier>
+            <optiondata>
+                <PATID>..</PATID> <EPISODE_NUMBER>..</EPISODE_NUMBER> <SYSTEM.DERS_16>..items..</SYSTEM.DERS_16>
+                ...one PATID/EPISODE_NUMBER/system tag group per client record...
+            </optiondata>
+        </option>
+    With pretty=True each element is written on its own tab-indented line as it is produced.
+
+    Usage:
+        with open(path, "w", encoding="utf-8") as handle, BatchWriter(handle, "ders") as writer:
+            writer.write_frame(dataframe)
+    '''
+    def __init__(self, handle, assessment_type, pretty=False, id_column='pid', episode_column='epn'):
+        self.mode = str(assessment_type).lower()
+        if self.mode not in system_tags:
+            raise ValueError(f"Invalid assessment_type {assessment_type!r}. Valid types include: {list(system_tags)}")
+        self.handle = handle
+        self.pretty = pretty
+        self.id_column = id_column
+        self.episode_column = episode_column
+        self.records_written = 0
+
+    def _line(self, depth):
+        return '\n' + '\t' * depth if self.pretty else ''
+
+    def __enter__(self):
+        self.handle.write('<?xml version="1.0" encoding="utf-8"?>')
+        self.handle.write(f'{self._line(0)}<option>{self._line(1)}<optionidentifier>{option_identifiers[self.mode]}'
+                          f'</optionidentifier>{self._line(1)}<optiondata>')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.handle.write(f'{self._line(1)}</optiondata>{self._line(0)}</option>\n')
+        return False
+
+    def write_frame(self, dataframe, block_size=10000):
+        '''
+        Writes one client record per row of `dataframe`. Returns the number of records written.
+        '''
+        tag = system_tags[self.mode]
+        columns = [column for column in assessment_columns[self.mode] if column in dataframe.columns]
+        # One format string per record: each column's text is slotted in, so a block is a single pass over its rows
+        record = (f'{self._line(2)}<PATID>{{}}</PATID>{self._line(2)}<EPISODE_NUMBER>{{}}</EPISODE_NUMBER>'
+                  f'{self._line(2)}<{tag}>' + ''.join(f'{self._line(3)}<{column}>{{}}</{column}>' for column in columns) +
+                  f'{self._line(2)}</{tag}>')
+        written = 0
+        for start in range(0, len(dataframe), block_size):
+            block = dataframe.iloc[start:start + block_size]
+            texts = [_text_column(block[column]) for column in [self.id_column, self.episode_column] + columns]
+            self.handle.write(''.join([record.format(*values) for values in zip(*texts)]))
+            written += len(block)
+        self.records_written += written
+        return written
+
+def write_batch(dataframe, assessment_type, output_path, pretty=False, block_size=10000):
+    '''
+    Writes the Avatar import batch for one assessment type from a cleaned/matched frame to `output_path`.
+    Returns the number of client records written.
+    '''
+    with stage(f'write_xml:{str(assessment_type).lower()}', rows_in=len(dataframe)) as record:
+        with open(output_path, 'w', encoding='utf-8') as handle, BatchWriter(handle, assessment_type, pretty=pretty) as writer:
+            written = writer.write_frame(dataframe, block_size=block_size)
+        record.rows_out = written
+    return written
+
+def _text_column(series):
+    '''
+    Converts a column to a list of XML-safe strings: whole numbers without a trailing ".0", missing values as empty
+    strings and text escaped.
+    '''
+    if pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+        text = series.astype(object).where(series.notna(), '').astype(str)
+        if text.str.contains('[&<>]', regex=True).any():
+            text = text.str.replace('&', '&amp;', regex=False).str.replace('<', '&lt;', regex=False) \
+                .str.replace('>', '&gt;', regex=False)
+        return text.tolist()
 
-# x = Batch(assessment_type="ders")
-# x.add_data()
-# x.write("dummy_output.xml")
\ No newline at end of file
+    numeric = series.to_numpy(dtype='float64', na_value=np.nan)
+    missing = np.isnan(numeric)
+    if not missing.any() and (numeric == np.floor(numeric)).all():
+        return numeric.astype(np.int64).astype(str).tolist()
+    text = numeric.astype(str).astype(object)
+    whole = ~missing & (numeric == np.floor(numeric))
+    text[whole] = numeric[whole].astype(np.int64).astype(str)
+    text[missing] = ''
+    return text.tolist()